@@ -0,0 +1,61 @@
+/*
+ * Persistent CHATTER worker used by chatter.py (-worker option).
+ *
+ * Keeps one JVM running and converts one CHAT file per request, so JVM
+ * startup and class loading are paid once instead of once per CHATTER run.
+ *
+ * Protocol (UTF-8, one request per line on stdin):
+ *     <input .cha path> TAB <output .xml path>
+ * The XML is appended to the output file (like the '>>' redirection of the
+ * one-shot command) and the diagnostics are written to stdout, followed by
+ * a line containing only the end marker below.
+ *
+ * Compile with:
+ *     javac -cp chatter.jar ChatterWorker.java
+ */
+
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+
+public class ChatterWorker {
+
+	public static final String END_MARKER = "@@CHATTER-DONE@@";
+
+	public static void main(String[] args) throws Exception {
+		BufferedReader in = new BufferedReader(
+			new InputStreamReader(System.in, "UTF-8"));
+		PrintStream realOut = System.out;
+		PrintStream realErr = System.err;
+		String request;
+		while ((request = in.readLine()) != null) {
+			String[] paths = request.split("\t");
+			ByteArrayOutputStream diagnostics = new ByteArrayOutputStream();
+			PrintStream diagStream = new PrintStream(diagnostics, true, "UTF-8");
+			if (paths.length != 2) {
+				diagStream.println("Invalid request: " + request);
+			} else {
+				PrintStream xmlStream = new PrintStream(
+					new FileOutputStream(paths[1], true), true, "UTF-8");
+				System.setOut(xmlStream);
+				System.setErr(diagStream);
+				try {
+					org.talkbank.chatter.App.main(new String[] {
+						"-inputFormat", "cha", "-outputFormat", "xml", paths[0]});
+				} catch (Throwable t) {
+					t.printStackTrace(diagStream);
+				} finally {
+					System.setOut(realOut);
+					System.setErr(realErr);
+					xmlStream.close();
+				}
+			}
+			realOut.print(diagnostics.toString("UTF-8"));
+			realOut.println();
+			realOut.println(END_MARKER);
+			realOut.flush();
+		}
+	}
+}
@@ -4,7 +4,20 @@ import sys
 import os
 import argparse
 import codecs				# For reading utf-8 files
+import re
 import subprocess
+import shlex
+import shutil
+import tempfile
+import threading
+import time
+import multiprocessing
+import traceback
+import bisect
+import hashlib
+import json
+import talkbank_xml
+from metrics import Metrics, NO_METRICS, write_metrics
 
 
 # Function that verifies that the given file exists.
@@ -22,120 +35,251 @@ def check_extension(filename,extension):
 	else:
 		return False
 
+# Function that encodes text the same way as the lines read from a CHAT file
+# (utf-8 bytes in Python 2, text in Python 3).
+def native(text):
+	if str is bytes:
+		return text.encode('utf-8')
+	return text
+
+# Invisible and layout characters that are not part of CHAT. The first group
+# is removed and the second group is replaced with a space.
+NON_CHAT_MARKERS = [native(x) for x in [u'\ufeff',u'\u200b',u'\u200c',
+	u'\u200d',u'\u2060',u'\u00ad',u'\u2028',u'\u2029']]
+NON_CHAT_SPACES = [native(x) for x in [u'\u00a0',u'\u2007',u'\u202f']]
+# Control characters other than tabs, line endings and the bullet marker,
+# and the markers above.
+NON_CHAT_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x14\x16-\x1f\x7f]|' +
+	'|'.join(re.escape(x) for x in NON_CHAT_MARKERS + NON_CHAT_SPACES))
+# A speaker tier with the separator after the speaker code.
+SPEAKER_TIER = re.compile(r'^\*([^:\s]+)[ \t]*:[ \t]*')
+# A well formed bullet.
+BULLET = re.compile('\x15(\\d+)_(\\d+)\x15')
+# A comment: the first '[^' and the first ']' after it.
+COMMENT = re.compile(r'\[\^(.*?)\]')
+# A period directly after a letter that is followed by another period.
+EXTRA_PERIOD = re.compile(r'(?<=[^\W\d_])\.(?=[^\n]*\.)')
+# The first ']' of a line if it is surrounded by spaces.
+LONE_BRACKET = re.compile(r'^([^\]]* )\](?= )')
+# Pairs of delimiters that should be balanced in an utterance.
+DELIM_PAIRS = [('[',']'),('<','>'),('(',')')]
+# Pairs of delimiters that are always opened before they are closed. '<'
+# and '>' are not, since CA marks faster speech as >fast<.
+ORDERED_PAIRS = [('[',']'),('(',')')]
+# Any of the delimiters above.
+DELIMS = re.compile(r'[\[\]()]')
+
+# Function that gives the replacement of a character that is not part of CHAT.
+def replace_non_chat(match):
+	if match.group() in NON_CHAT_SPACES:
+		return ' '
+	return ''
+
+# Function that removes characters that are not part of CHAT from a line.
+def neutralize_markers(line):
+	return NON_CHAT_CHARS.sub(replace_non_chat,line)
+
+# Function that normalizes the separator between the speaker code and the
+# utterance of a speaker tier to ':' followed by a tab.
+def fix_speaker_tier(line):
+	if not line.startswith('*'):
+		return line
+	match = SPEAKER_TIER.match(line)
+	if match is None:
+		return line
+	return '*' + match.group(1) + ':\t' + line[match.end():]
+
+# Function that removes the delimiters of the first comment in a line,
+# keeping its content.
+def rem_comment_delims(line):
+	if line.find('[^') == -1:
+		return line
+	match = COMMENT.search(line)
+	if match is None:
+		return line
+	return line[:match.start()] + match.group(1) + line[match.end():]
+
+# Function that removes the negative signs from a line (except headers).
+def fix_neg_sign(line):
+	if line.startswith('@'):
+		return line
+	return line.replace('-','')
+
+# Function that removes bullets that are not of the form \x15start_end\x15,
+# including unpaired bullet markers, and swaps the times of the bullets where
+# start time > end time.
+def fix_bullets(line):
+	if line.find('\x15') == -1:
+		return line
+	# Split gives the text between bullets and the two times of each bullet.
+	parts = BULLET.split(line)
+	if (len(parts) == 4 and parts[0].find('\x15') == -1 and
+			parts[3].find('\x15') == -1 and int(parts[1]) <= int(parts[2])):
+		return line
+	new_line = parts[0].replace('\x15','')
+	for i in range(1,len(parts),3):
+		start,end = parts[i],parts[i+1]
+		if int(start) > int(end):
+			start,end = end,start
+		new_line += ('\x15' + start + '_' + end + '\x15' +
+			parts[i+2].replace('\x15',''))
+	return new_line
+
+# Function that ensures that only valid periods exist in a line: periods
+# directly after a letter are removed unless they are the last in the line.
+def check_periods(line):
+	if line.count('.') < 2:
+		return line
+	return EXTRA_PERIOD.sub('',line)
+
+# Function that removes the first ']' of a line if it stands alone.
+def rem_lone_delimiter(line):
+	if line.find(']') == -1:
+		return line
+	match = LONE_BRACKET.match(line)
+	if match is None:
+		return line
+	return match.group(1) + line[match.end():]
+
 '''
-Function that removes specific start and end delimiters from a file stream
-Inputs:
-	1. all_data -> List containing all lines of CHAT file.
-	2. start_delim_list -> List of individual characters comprising the starting
-		delimiter.
-	3. end_delim_list -> List of individual characters comprising the ending
-		delimiter.
-Returns -> List containing the modified data.
+Class that applies all the refinement rules to one line at a time.
+The rules are applied in this order:
+	1. Removing characters that are not part of CHAT.
+	2. Fixing the separator after the speaker codes.
+	3. Removing the comment markers.
+	4. Removing '%' and replacing **** (curse words) with CURSE.
+	5. Removing any negative times in the transcript.
+	6. Removing malformed bullets and fixing the bullet times.
+	7. Fixing the extra periods in the sentence.
+	8. Removing empty comment markers and lone ']' delimiters.
+	9. Removing closing brackets and parentheses that were never opened in
+	   the utterance.
+The only state kept is the delimiter depth of the current utterance.
 '''
-def rem_delim(all_data, start_delim_list, end_delim_list):
-	if len(start_delim_list) == 0 or len(end_delim_list) == 0:
-		return all_data
-	new_data = []
-	for line in all_data:
-		start_delims = ''.join(start_delim_list)
-		end_delims = ''.join(end_delim_list)
-		# Verify that the starting delimiters exist
-		check_start = line.find(start_delims)
-		# Substring after initial delimiters.
-		sub_line = line[check_start+len(start_delims):]
-		check_end = sub_line.find(end_delims)
-		if check_start != -1 and check_end != -1:
-			# Removing the delimiters if both starting and ending pairs are 
-			# found.
-			check_end += check_start+len(start_delims)
-			sub_str = (line[:check_start] + 
-				line[check_start + len(start_delims):check_end] +
-				line[check_end + len(end_delims):])
-			new_data.append(sub_str)
-		else:
-			new_data.append(line)
-	# New list with the modified lines returned
-	return new_data
-
-# Function that fixes the bullets if start time > end time
-# Input -> List containing all the lines.
-# Output -> Modified list with fixed bullets.
-def fix_bullets(all_data):
-	for i,line in enumerate(all_data):
-		start_bullet_pos = line.find('\x15')+1
-		end_bullet_pos = line.rfind('\x15')
-		if start_bullet_pos != -1 and end_bullet_pos != -1:
-			times = line[start_bullet_pos:end_bullet_pos]
-			start_time = times[:times.find('_')]
-			end_time = times[times.find('_')+1:end_bullet_pos]
-			if int(start_time) > int(end_time):
-				new_times = end_time + "_" + start_time
-				newline = line[:start_bullet_pos] + new_times + line[end_bullet_pos:]
-				all_data[i] = newline
-	return all_data
-
-# Function that removes the negative sign from a line
-# Input -> List containing all the lines.
-# Output -> Modified list with the removed negative sign.
-def fix_neg_sign(all_data):
-	for i, line in enumerate(all_data):
-		if line[0] != '@':
-			line = line.replace('-','')
-		all_data[i] = line
-	return all_data
+class CHATRefiner(object):
 
+	def __init__(self):
+		self.openers = dict(ORDERED_PAIRS)
+		self.depths = dict((end,0) for start,end in ORDERED_PAIRS)
 
-# Functions that ensures that only valid periods exist in a line.
-# Input -> List of all the lines
-# Output -> Modified list of all the lines
-def check_periods(all_data):
-	new_data = []
-	for i, line in enumerate(all_data):
-		for j,char in enumerate(line):
-			if char == '.':
-				if line[j-1].isalpha():
-					for i in range(line.count('.')-1):
-						line = line[:j] + line[j+1:]
-						j+=2
-		new_data.append(line)
-	return new_data
-
-def rem_lone_delimiter(all_data,delim_list):
-	delim = ''.join(delim_list)
-	new_data = []
-	for line in all_data:
-		pos = line.find(delim)
-		if pos != -1:
-			if line[pos-1] == ' ' and line[pos+1] == ' ':
-				#print('NEW')
-				#print(line)
-				line = line[:pos] + line[pos+1:]
-				#print(line)
-		new_data.append(line)
-	return new_data
+	# Function that removes closing brackets and parentheses that have no
+	# opening one before them in the utterance (e.g. the ']' left behind by
+	# a comment).
+	def rem_stray_delimiters(self,line):
+		# A new tier starts a new utterance.
+		if not line.startswith('\t'):
+			for end in self.depths:
+				self.depths[end] = 0
+		if line.startswith('@') or line.startswith('%'):
+			return line
+		# Only the delimiters are visited and only stray ones are cut out.
+		pieces = []
+		last = 0
+		for match in DELIMS.finditer(line):
+			char = match.group()
+			if char in self.openers:
+				self.depths[self.openers[char]] += 1
+			elif self.depths[char] > 0:
+				self.depths[char] -= 1
+			else:
+				pieces.append(line[last:match.start()])
+				last = match.end()
+		if last == 0:
+			return line
+		pieces.append(line[last:])
+		return ''.join(pieces)
 
+	def refine(self,line):
+		line = fix_speaker_tier(neutralize_markers(line))
+		line = rem_comment_delims(line).replace('%','').replace('****','CURSE')
+		line = fix_bullets(fix_neg_sign(line))
+		line = rem_lone_delimiter(check_periods(line).replace('[^',''))
+		return self.rem_stray_delimiters(line)
 
+# Function that refines a stream of lines.
+# Input -> Iterable of lines
+# Output -> Generator of the refined lines.
+def refine_lines(lines):
+	refiner = CHATRefiner()
+	for line in lines:
+		yield refiner.refine(line)
 
 # Function that removes unnecessary lines and fixes syntax in the CHAT file.
 # Input -> List containing the lines
 # Output -> List containing the modified lines.
 def refine_CHAT(all_data):
-	# Removing the comment markers.
-	new_data = rem_delim(all_data,['[','^'],[']'])
-	new_data = [line.replace('%','') for line in new_data]
-	# Removing **** that indicate curse words.
-	new_data = [line.replace('****','CURSE') for line in new_data]
-	# Removing any negative times in the transcript.
-	new_data = fix_neg_sign(new_data)
-	# Fixing the bullet markers
-	new_data = fix_bullets(new_data)
-	# Fixing the extra periods in the sentence
-	new_data = check_periods(new_data)
-	# Removing empty comment markers
-	new_data = [line.replace('[^','') for line in new_data]
-	# Removing lone delimiters ( ']' marker here)
-	new_data = rem_lone_delimiter(new_data,']')
-	return new_data
+	return list(refine_lines(all_data))
+
+# Function that refines a CHAT file line by line into another file, so
+# memory does not grow with the size of the file.
+# Output -> The number of lines written.
+def refine_file(in_file,out_file):
+	num_lines = 0
+	with open(in_file,'rU') as f:
+		with open(out_file,'w') as out:
+			for line in refine_lines(f):
+				out.write(line)
+				num_lines += 1
+	return num_lines
+
+'''
+Function that finds the lines that CHATTER would reject for the most common
+violations, so that they are removed before CHATTER is ever called.
+Lines are grouped into utterances (a speaker tier and its continuation
+lines). All the lines of an utterance are flagged if:
+	1. The speaker is not declared in the @Participants header.
+	2. The utterance is empty.
+Any other line that is not a header, tier or continuation line is flagged.
+The placeholder of an utterance with an undeclared speaker would still be
+rejected for its speaker, so the number of its first line is mapped to the
+first declared participant in speakers, when it is given (see removed_line).
+Utterances with unbalanced delimiters are not flagged, since they can be
+valid CA (e.g. >fast< or a <slow> stretch over several lines); the number
+of their first line is added to unbalanced, when it is given, so that they
+can be reported. CHATTER still checks them.
+The lines are read in a single pass, so they can be a file.
+Input -> Iterable of lines.
+		List the utterances with unbalanced delimiters are added to.
+		Dictionary the speakers of the placeholders are added to.
+Returns -> List of line numbers.
+'''
+def find_illegal_lines(all_data,unbalanced=None,speakers=None):
+	participants = [None]
+	line_nums = []
+	utterance = []
+	def check_utterance(utterance):
+		if len(utterance) == 0:
+			return
+		first = utterance[0][1]
+		text = ''.join(line for i,line in utterance)
+		text = BULLET.sub('',text[text.find(':')+1:])
+		undeclared = (participants[0] is not None and
+			first[1:first.find(':')] not in participants[0])
+		if undeclared or len(text.strip()) == 0:
+			line_nums.extend(i for i,line in utterance)
+			if undeclared and speakers is not None and len(participants[0]) > 0:
+				speakers[utterance[0][0]] = participants[0][0]
+		elif unbalanced is not None and any(text.count(start) !=
+				text.count(end) for start,end in DELIM_PAIRS):
+			unbalanced.append(utterance[0][0])
+	for i,line in enumerate(all_data):
+		if line.startswith('*') and line.find(':') != -1:
+			check_utterance(utterance)
+			utterance = [(i,line)]
+		elif line.startswith('\t') and len(utterance) > 0:
+			utterance.append((i,line))
+		else:
+			check_utterance(utterance)
+			utterance = []
+			if line.startswith('@Participants:'):
+				entries = line[len('@Participants:'):].split(',')
+				participants[0] = [entry.split()[0] for entry in entries
+					if entry.strip()]
+			if not (line.startswith('@') or line.startswith('%') or
+					line.strip() == ''):
+				line_nums.append(i)
+	check_utterance(utterance)
+	return line_nums
 
 # Function that gets the line numbers from the CHATTER output.
 # Inputs -> Output of the Chatter script run on the file.
@@ -153,97 +297,795 @@ def get_line_nums(chatter_output):
 	return line_nums
 
 
-# Function that removes the given lines from the data
-# Inputs -> all_data is a list of all lines
+# Function that replaces a line to be removed with a placeholder.
+# The speaker of a speaker tier is replaced when one is given.
+# Output -> The placeholder, or None if the line already is one (it is then
+#			dropped).
+def removed_line(line,speaker=None):
+	if line.find("ORIGINAL") != -1:
+		return None
+	if speaker is not None and line.startswith('*'):
+		line = '*' + speaker + line[line.find(':'):]
+	if line.find(':') != -1:
+		if line.split('.')[-1].find('\x15') == 1:
+			return line[:line.find(":")+1] + "\tORIGINAL DATA REMOVED  . " + line[line.find('\x15'):]
+		return line[:line.find(":")+1] + "\tORIGINAL DATA REMOVED " + line[line.find('\x15'):]
+	if line.split('.')[-1].find('\x15') == 1:
+		return "\tORIGINAL DATA REMOVED . " + line[line.find('\x15'):]
+	return "\tORIGINAL DATA REMOVED " + line[line.find('\x15'):]
+
+# Function that removes the given lines from a stream of lines.
+# Inputs -> all_data is an iterable of all lines
 #			line_nums is the line numbers to be removed.
 #			lines_removed is a list of the lines removed from the file.
-# Output -> List containing the modified lines.
-def remove_lines(all_data,line_nums,lines_removed):
-	new_data = []
+#			speakers maps line numbers to the speakers of their placeholders
+#			(see find_illegal_lines).
+# Output -> Generator of the modified lines.
+def iter_remove_lines(all_data,line_nums,lines_removed,speakers=None):
+	line_nums = set(line_nums)
+	speakers = speakers or {}
 	for i, line in enumerate(all_data):
-		if line[0] == '@':
-			new_data.append(line)
-		elif not i in line_nums:
-			new_data.append(line)
+		if line.startswith('@') or not i in line_nums:
+			yield line
 		else:
-			if line.find(':') != -1:
-				if line.split('.')[-1].find('\x15') == 1:
-					newline = line[:line.find(":")+1] + "\tORIGINAL DATA REMOVED  . " + line[line.find('\x15'):]
-				else:
-					newline = line[:line.find(":")+1] + "\tORIGINAL DATA REMOVED " + line[line.find('\x15'):]
-			else:
-				if line.split('.')[-1].find('\x15') == 1:
-					newline = "\tORIGINAL DATA REMOVED . " + line[line.find('\x15'):]
-				else:
-					newline = "\tORIGINAL DATA REMOVED " + line[line.find('\x15'):]
-			if line.find("ORIGINAL") == -1:
-				new_data.append(newline)
+			newline = removed_line(line,speakers.get(i))
+			if newline is not None:
 				lines_removed.append([i,line])
-	return new_data
+				yield newline
+
+# Function that removes the given lines from the data
+# Inputs -> all_data is a list of all lines
+#			line_nums is the line numbers to be removed.
+#			lines_removed is a list of the lines removed from the file.
+# Output -> List containing the modified lines.
+def remove_lines(all_data,line_nums,lines_removed,speakers=None):
+	return list(iter_remove_lines(all_data,line_nums,lines_removed,speakers))
+
+# Function that removes the given lines from a file, streaming it through a
+# temporary file next to it.
+def remove_lines_file(file,line_nums,lines_removed,speakers=None):
+	if len(line_nums) == 0:
+		return
+	with open(file,'rU') as f:
+		with open(file + '.tmp','w') as out:
+			for line in iter_remove_lines(f,line_nums,lines_removed,speakers):
+				out.write(line)
+	shutil.move(file + '.tmp',file)
 	
 	
+# The command that runs Talkbank's CHATTER program on a single file.
+CHATTER_COMMAND = ('java -cp chatter.jar org.talkbank.chatter.App'
+	' -inputFormat cha -outputFormat xml')
+# The command that starts a persistent CHATTER worker (see ChatterWorker.java).
+WORKER_COMMAND = 'java -cp chatter.jar' + os.pathsep + '. ChatterWorker'
+# Line printed by the worker after the diagnostics for each request.
+WORKER_END_MARKER = b'@@CHATTER-DONE@@'
+
+# Raised when CHATTER does not finish within the time allowed.
+class ChatterTimeout(Exception):
+	pass
+
+# Function that starts a timer that kills a process after timeout seconds.
+# Output -> The timer (None if there is no timeout) and a list that gets a
+#			value appended when the process is killed.
+def start_kill_timer(proc,timeout):
+	killed = []
+	if timeout is None:
+		return None,killed
+	def kill():
+		killed.append(True)
+		try:
+			proc.kill()
+		except OSError:
+			pass
+	timer = threading.Timer(timeout,kill)
+	timer.daemon = True
+	timer.start()
+	return timer,killed
+
+'''
+Base of the conversion backends given to convert_file. A backend converts a
+file with convert, by default with the repair loop of the module's convert
+around its run method (one run of the converter on the file). Backends that
+convert files another way (SegmentPool) override convert.
+'''
+class Backend(object):
+
+	# Name of the converter, part of the conversion cache keys.
+	name = 'chatter'
+
+	# Function that converts a file (see convert).
+	def convert(self,file,xml_file,timeout=None,metrics=NO_METRICS,
+			unbalanced=None):
+		return convert(self,file,xml_file,timeout,metrics,unbalanced)
+
+	def close(self):
+		pass
+
+'''
+Backend that runs a new CHATTER process for every conversion.
+Input -> The command to run. The CHAT file is appended as the last argument
+	and the XML written to stdout is appended to the XML file.
+'''
+class ChatterProcess(Backend):
+
+	def __init__(self,command=CHATTER_COMMAND):
+		self.command = shlex.split(command)
+		# Number of processes started.
+		self.invocations = 0
+
+	# Function that runs CHATTER on a file.
+	# Inputs -> The CHAT file and the XML file to append the output to.
+	#			The number of seconds after which CHATTER is stopped.
+	# Output -> The diagnostics printed by CHATTER.
+	def run(self,cha_file,xml_file,timeout=None):
+		with open(xml_file,'ab') as xml:
+			proc = subprocess.Popen(self.command + [cha_file],stdout=xml,
+				stderr=subprocess.PIPE)
+			self.invocations += 1
+			timer,killed = start_kill_timer(proc,timeout)
+			try:
+				output = proc.communicate()[1]
+			finally:
+				if timer is not None:
+					timer.cancel()
+		if len(killed) > 0:
+			raise ChatterTimeout("CHATTER timed out on " + cha_file)
+		return output
+
+'''
+Backend that keeps one long-lived CHATTER worker process and sends it one
+request per conversion, so that JVM startup is paid once per worker instead
+of once per CHATTER run.
+Input -> The command that starts the worker. The worker reads requests of
+	the form '<CHAT file>\t<XML file>' on stdin, appends the XML to the XML
+	file and prints the diagnostics followed by WORKER_END_MARKER on stdout.
+	Any process following this protocol (e.g. a stub for testing) can be
+	used in place of ChatterWorker.java.
+'''
+class ChatterWorker(Backend):
+
+	def __init__(self,command=WORKER_COMMAND):
+		self.command = shlex.split(command)
+		self.proc = None
+		# Number of worker processes started.
+		self.invocations = 0
+
+	def start(self):
+		self.proc = subprocess.Popen(self.command,stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE)
+		self.invocations += 1
+
+	# Function that sends a request to the worker, restarting it if needed.
+	def send(self,request):
+		for attempt in range(2):
+			if self.proc is None or self.proc.poll() is not None:
+				self.start()
+			try:
+				self.proc.stdin.write(request)
+				self.proc.stdin.flush()
+				return
+			except (IOError,OSError):
+				self.proc.wait()
+				self.proc = None
+		raise IOError("Unable to send request to the CHATTER worker")
+
+	# Function that runs CHATTER on a file.
+	# Inputs -> The CHAT file and the XML file to append the output to.
+	#			The number of seconds after which the worker is stopped.
+	# Output -> The diagnostics printed by CHATTER.
+	def run(self,cha_file,xml_file,timeout=None):
+		request = os.path.abspath(cha_file) + '\t' + os.path.abspath(xml_file) + '\n'
+		if not isinstance(request,bytes):
+			request = request.encode('utf-8')
+		self.send(request)
+		timer,killed = start_kill_timer(self.proc,timeout)
+		output = []
+		try:
+			while True:
+				line = self.proc.stdout.readline()
+				# The worker died, it is restarted on the next request.
+				if len(line) == 0:
+					self.proc.wait()
+					self.proc = None
+					break
+				if line.rstrip(b'\r\n') == WORKER_END_MARKER:
+					break
+				output.append(line)
+		finally:
+			if timer is not None:
+				timer.cancel()
+		if len(killed) > 0:
+			raise ChatterTimeout("CHATTER timed out on " + cha_file)
+		return b''.join(output)
+
+	def close(self):
+		if self.proc is not None:
+			self.proc.stdin.close()
+			self.proc.wait()
+			self.proc = None
+
+'''
+Backend that writes the XML in Python with talkbank_xml.write_xml instead of
+running CHATTER, so a conversion costs the time needed to parse the file
+rather than JVM startup and strict validations. The lines that cannot be
+converted are reported in the diagnostics format of CHATTER, so the
+conversion loop removes them the same way.
+Input -> Optional TalkBank XSD file the XML is validated against.
+'''
+class NativeWriter(Backend):
+
+	name = 'native'
+
+	def __init__(self,xsd=None):
+		self.schema = None
+		if xsd is not None:
+			self.schema = etree.XMLSchema(etree.parse(xsd))
+		# Number of conversions run.
+		self.invocations = 0
+
+	# Function that converts a file.
+	# Inputs -> The CHAT file and the XML file to append the output to.
+	#			The timeout is not used: a conversion cannot hang.
+	# Output -> The diagnostics of the lines that could not be converted.
+	# Raises etree.XMLSyntaxError if the XML is not valid for the schema.
+	def run(self,cha_file,xml_file,timeout=None):
+		name = os.path.basename(cha_file)
+		with open(cha_file,'rU') as f:
+			with open(xml_file,'ab') as xml:
+				diagnostics = talkbank_xml.write_xml(f,xml,
+					name[:name.rfind('.')])
+		self.invocations += 1
+		if len(diagnostics) == 0 and self.schema is not None:
+			talkbank_xml.validate(xml_file,self.schema)
+		return '\n'.join(str(line) for line in diagnostics)
+
+# Function that creates the conversion backend.
+# Inputs -> native is True to write the XML in Python (see NativeWriter),
+#			with the optional XSD file to validate against.
+#			Otherwise CHATTER is used: worker is True to use a persistent
+#			worker and command overrides the default command of the backend.
+def make_backend(worker=False,command=None,native=False,xsd=None):
+	if native:
+		return NativeWriter(xsd)
+	if worker:
+		return ChatterWorker(command or WORKER_COMMAND)
+	return ChatterProcess(command or CHATTER_COMMAND)
+
+# Version of the conversion rules. Bump it whenever the refinement or the
+# line removal changes the XML produced for a file, so that the conversions
+# cached by older versions are no longer used.
+CONVERTER_VERSION = '5'
+# Default directory and size (in MB) of the conversion cache.
+CACHE_DIRECTORY = '.chatter-cache'
+CACHE_SIZE = 1024
+
+'''
+Persistent cache of conversions, so that unchanged CHAT files are not
+converted again.
+Entries are keyed by a hash of the content of the CHAT file and the
+converter version. Each entry is the XML file ('<key>.xml') and a record of
+the conversion report ('<key>.json'), which is written last and marks the
+entry as complete. Files are written under temporary names and renamed, so
+several processes can share the cache.
+When the cache grows over its size, the least recently used entries are
+evicted.
+Inputs -> Directory of the cache.
+		Maximum size of the cache in bytes.
+'''
+class ConversionCache(object):
+
+	def __init__(self,directory=CACHE_DIRECTORY,max_size=CACHE_SIZE*1024*1024):
+		self.directory = directory
+		self.max_size = max_size
+		if not os.path.isdir(directory):
+			try:
+				os.makedirs(directory)
+			except OSError:
+				# Created by another process in the meantime.
+				if not os.path.isdir(directory):
+					raise
+
+	# Function that computes the key of a CHAT file converted with the
+	# backend of the given name.
+	def key(self,path,backend_name='chatter'):
+		digest = hashlib.sha1()
+		digest.update((backend_name + ' ' + CONVERTER_VERSION +
+			'\n').encode('ascii'))
+		with open(path,'rb') as f:
+			for block in iter(lambda: f.read(1 << 20),b''):
+				digest.update(block)
+		return digest.hexdigest()
+
+	def _path(self,key,extension):
+		return os.path.join(self.directory,key + extension)
+
+	# Function that writes a file of the cache atomically.
+	def _write(self,key,extension,write):
+		fd,tmp = tempfile.mkstemp(prefix='.' + key,dir=self.directory)
+		try:
+			with os.fdopen(fd,'wb') as f:
+				write(f)
+			os.rename(tmp,self._path(key,extension))
+		except Exception:
+			os.remove(tmp)
+			raise
+
+	# Function that looks up a conversion.
+	# Output -> The XML file in the cache and the record of the conversion,
+	#			or None if the file is not in the cache.
+	def get(self,key):
+		try:
+			with open(self._path(key,'.json'),'r') as f:
+				record = json.load(f)
+			xml_file = self._path(key,'.xml')
+			# Marking the entry as recently used.
+			os.utime(self._path(key,'.json'),None)
+			if not os.path.isfile(xml_file):
+				return None
+		except (IOError,OSError,ValueError):
+			return None
+		record['lines_removed'] = [[i,native(line)]
+			for i,line in record['lines_removed']]
+		return xml_file,record
+
+	# Function that stores a conversion.
+	# Inputs -> Key of the CHAT file, XML file and record of the conversion.
+	def put(self,key,xml_file,record):
+		def copy_xml(out):
+			with open(xml_file,'rb') as f:
+				shutil.copyfileobj(f,out)
+		def dump_record(out):
+			lines = [[i,line.decode('utf-8','replace') if isinstance(line,bytes)
+				else line] for i,line in record['lines_removed']]
+			data = json.dumps(dict(record,lines_removed=lines))
+			if not isinstance(data,bytes):
+				data = data.encode('utf-8')
+			out.write(data)
+		self._write(key,'.xml',copy_xml)
+		self._write(key,'.json',dump_record)
+		self.evict()
+
+	# Function that lists the entries of the cache.
+	# Output -> List of (last use, size, key), least recently used first.
+	def entries(self):
+		entries = []
+		for name in os.listdir(self.directory):
+			if not name.endswith('.json') or name.startswith('.'):
+				continue
+			key = name[:-len('.json')]
+			try:
+				used = os.path.getmtime(self._path(key,'.json'))
+				size = (os.path.getsize(self._path(key,'.json')) +
+					os.path.getsize(self._path(key,'.xml')))
+			except OSError:
+				continue
+			entries.append((used,size,key))
+		return sorted(entries)
+
+	# Function that removes an entry (the record first, so a half removed
+	# entry is never used).
+	def remove(self,key):
+		for extension in ['.json','.xml']:
+			try:
+				os.remove(self._path(key,extension))
+			except OSError:
+				pass
+
+	# Function that evicts the least recently used entries until the cache
+	# fits in its size.
+	def evict(self):
+		entries = self.entries()
+		size = sum(entry[1] for entry in entries)
+		for used,entry_size,key in entries:
+			if size <= self.max_size:
+				break
+			self.remove(key)
+			size -= entry_size
+
+	# Function that invalidates the whole cache.
+	# Output -> Number of entries removed.
+	def clear(self):
+		entries = self.entries()
+		for used,size,key in entries:
+			self.remove(key)
+		return len(entries)
+
 # Function that recursively uses chatter to convert CHAT to XML.
-# Input -> String that is the command to run the chatter script.
-#			List of the lines
-#			Filename of the CHAT file.
-# Output -> List of lines that were removed.
-def convert(chatter_command,new_data,file):
-	with open(file, 'w') as f:
-		for item in new_data:
-			f.write("%s" % item)
+# Input -> The CHATTER backend used to run the conversion.
+#			Filename of the working copy of the (refined) CHAT file.
+#			Filename of the XML file.
+#			Number of seconds allowed for the whole conversion.
+#			The Metrics the stages are recorded in.
+#			List the utterances with unbalanced delimiters are added to (see
+#			find_illegal_lines).
+# Output -> List of lines that were removed and the number of CHATTER runs.
+def convert(backend,file,xml_file,timeout=None,metrics=NO_METRICS,
+		unbalanced=None):
+	if timeout is not None:
+		deadline = time.time() + timeout
 	lines_removed = []
+	# Removing the lines that CHATTER would reject before running it, so
+	# that CHATTER is usually only run once as a final check.
+	speakers = {}
+	with metrics.stage('pre-validation'):
+		with open(file,'rU') as f:
+			line_nums = find_illegal_lines(f,unbalanced,speakers)
+	with metrics.stage('rewrite'):
+		remove_lines_file(file,line_nums,lines_removed,speakers)
+	metrics.count('lines_prevalidated',len(lines_removed))
+	invocations = backend.invocations
+	iterations = 0
 	while True:
-		# Calling the chatter command as a subprocess in a shell.
-		proc = subprocess.Popen(chatter_command ,stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-		# Storing the stdout stream from the chatter command.
-		chatter_output =  proc.communicate()[0]
+		remaining = None
+		if timeout is not None:
+			remaining = deadline - time.time()
+			if remaining <= 0:
+				raise ChatterTimeout("Conversion timed out on " + file)
+		# Only the output of the last CHATTER run is kept.
+		open(xml_file,'w').close()
+		# Running chatter and storing its diagnostics.
+		with metrics.stage(backend.name + ' iteration'):
+			chatter_output = backend.run(file,xml_file,remaining)
+		iterations += 1
 		#print(chatter_output)
 		# Getting illegal line numbers from the chatter stdout stream.
 		line_nums = get_line_nums(chatter_output)
 		# Stop if there are no lines to fix.
 		if(len(line_nums) == 0):
 			break
-		# Removing illegal lines from data/
-		new_data = remove_lines(new_data,line_nums,lines_removed)
-		# Writing the modified data.
-		with open(file,'w') as f:
-			for line in new_data:
-				f.write("%s" % line)
-	return lines_removed
+		# Removing illegal lines from the working copy.
+		with metrics.stage('rewrite'):
+			remove_lines_file(file,line_nums,lines_removed)
+	metrics.count('iterations',iterations)
+	if backend.name == 'chatter':
+		# Each CHATTER process or worker started is a JVM started.
+		metrics.count('jvm_starts',backend.invocations - invocations)
+	return lines_removed,iterations
+
+# Function that converts a CHAT file to XML in its own temporary workspace.
+# The CHAT file is only read; the refined copies CHATTER works on live in
+# the workspace and the XML is moved next to the CHAT file at the end.
+# The file is streamed line by line, so memory does not grow with its size.
+# Unchanged files are copied from the conversion cache when one is given.
+# Inputs -> Path of the CHAT file
+#			The Backend (or SegmentPool)
+#			Number of seconds allowed for the conversion.
+#			The ConversionCache (None to always convert).
+#			The Metrics the stages are recorded in.
+# Output -> Dictionary with the lines removed, the number of lines and the
+#			lines of the utterances with unbalanced delimiters.
+def convert_file(path,backend,timeout=None,cache=None,metrics=NO_METRICS):
+	name = os.path.basename(path)
+	xml_name = name[:name.rfind('.')]+'.xml'
+	xml_path = os.path.join(os.path.dirname(path),xml_name)
+	if cache is not None:
+		with metrics.stage('cache lookup'):
+			key = cache.key(path,backend.name)
+			entry = cache.get(key)
+			if entry is not None:
+				cached_xml,record = entry
+				try:
+					shutil.copyfile(cached_xml,xml_path)
+				except (IOError,OSError):
+					# The entry was evicted (e.g. by another run sharing the
+					# cache) after it was looked up: the file is converted.
+					entry = None
+		if entry is not None:
+			metrics.count('cache_hits')
+			record.update({'file': path, 'iterations': 0, 'cached': True})
+			return record
+	workspace = tempfile.mkdtemp(prefix='chatter-')
+	try:
+		work_file = os.path.join(workspace,name)
+		work_xml = os.path.join(workspace,xml_name)
+		# Removing illegal syntax from CHAT file.
+		with metrics.stage('refine'):
+			num_lines = refine_file(path,work_file)
+		metrics.count('lines',num_lines)
+		unbalanced = []
+		lines_removed,iterations = backend.convert(work_file,work_xml,timeout,
+			metrics,unbalanced)
+		metrics.count('lines_removed',len(lines_removed))
+		metrics.count('xml_bytes_written',os.path.getsize(work_xml))
+		if cache is not None:
+			with metrics.stage('cache store'):
+				cache.put(key,work_xml,{'lines_removed': lines_removed,
+					'num_lines': num_lines,'unbalanced': unbalanced})
+		shutil.move(work_xml,xml_path)
+	finally:
+		shutil.rmtree(workspace,ignore_errors=True)
+	return {'file': path, 'lines_removed': lines_removed,
+		'num_lines': num_lines, 'unbalanced': unbalanced,
+		'iterations': iterations, 'cached': False}
+
+# Function that prints the lines removed from a file.
+def print_report(result):
+	print('\nFILENAME: ' + result['file'])
+	percentage = round((float(len(result['lines_removed']))/float(result['num_lines']))*100,4)
+	print('The numbers of lines removed is: ' + str(len(result['lines_removed'])) + ' [' + str(percentage) +' % ]')
+	if result.get('cached'):
+		print('The conversion is unchanged and was copied from the cache')
+	else:
+		print('The number of CHATTER iterations is: ' + str(result['iterations']))
+	print('The following lines were removed\n')
+	for line in result['lines_removed']:
+		print(line)
+	if len(result.get('unbalanced',[])) > 0:
+		print('\nThe utterances on the following lines have unbalanced'
+			' delimiters and were left for the converter to check\n')
+		print(', '.join(str(i) for i in result['unbalanced']))
+	print('\n')
 
 
 # The main run function for the program
 # Inputs -> Name of the directory containing the file
 #			Filename
-def run(file,dir_name = ''):
+#			The CHATTER backend (a new one-shot backend by default)
+#			Number of seconds allowed for the conversion.
+#			The ConversionCache (None to always convert).
+#			record_metrics is True to add the metrics of the conversion to
+#			the result.
+# Output -> Dictionary with the lines removed and the number of lines, or
+#			None if the file could not be converted.
+def run(file,dir_name = '',backend = None,timeout = None,cache = None,
+		record_metrics = False):
 	# Verifying files
 	if (not check_extension(dir_name+file,"cha") or not 
 			file_exists(dir_name+file)):
 		print("ERROR: Verify .cha file extension and that file exists")
 		print("FILENAME: " + file)
 		return
-	# Reading files in text mode.
-	with open(dir_name+file,'rU') as f:
-		all_data = f.readlines()
-		# Removing illegal syntax from CHAT file.
-	new_data = refine_CHAT(all_data)
-	# The command to give to Talkbank's CHATTER program.
-	chatter_command = 'java -cp chatter.jar org.talkbank.chatter.App' \
-	' -inputFormat cha -outputFormat xml ' + dir_name+file + ' >> '+dir_name+file[:file.rfind('.')]+'.xml'
-	lines_removed = convert(chatter_command,new_data,dir_name+file)
-
-	# Re-writing the original CHAT file.
-	with open(dir_name+file, 'w') as f:
-		for item in all_data:
-			f.write("%s" % item)
-	print('\nFILENAME: ' + file)
-	percentage = round((float(len(lines_removed))/float(len(new_data)))*100,4)
-	print('The numbers of lines removed is: ' + str(len(lines_removed)) + ' [' + str(percentage) +' % ]')
-	print('The following lines were removed\n')
-	for line in lines_removed:
-		print(line)
-	print('\n')
-	
+	if backend is None:
+		backend = make_backend()
+	metrics = Metrics() if record_metrics else NO_METRICS
+	result = convert_file(dir_name+file,backend,timeout,cache,metrics)
+	result['metrics'] = metrics.to_dict()
+	print_report(result)
+	return result
+
+# Backend and conversion cache of the pool worker process running convert_job.
+worker_backend = None
+worker_cache = None
+
+# Function that creates the backend of a pool worker process.
+def init_pool_worker(backend_options,cache=None):
+	global worker_backend,worker_cache
+	worker_backend = make_backend(**backend_options)
+	worker_cache = cache
+
+# Function that converts one file in a pool worker process.
+# Any failure is caught and returned so that it only affects that file.
+# Output -> (path, result, error)
+def convert_job(job):
+	path,timeout,record_metrics = job
+	try:
+		metrics = Metrics() if record_metrics else NO_METRICS
+		result = convert_file(path,worker_backend,timeout,worker_cache,metrics)
+		result['metrics'] = metrics.to_dict()
+		return path,result,None
+	except ChatterTimeout:
+		return path,None,'timed out'
+	except etree.XMLSyntaxError as e:
+		return path,None,'invalid XML: ' + str(e)
+	except Exception:
+		return path,None,traceback.format_exc()
+
+# Function that converts files concurrently on a pool of processes.
+# Inputs -> List of CHAT files
+#			Number of processes
+#			Dictionary of the keyword arguments of make_backend
+#			Number of seconds allowed for the conversion of each file.
+#			The ConversionCache (None to always convert).
+#			record_metrics is True to add the metrics of each conversion to
+#			its result.
+# Output -> List of (path, result, error) in the order of the files.
+def run_parallel(paths,jobs,backend_options=None,timeout=None,cache=None,
+		record_metrics=False):
+	pool = multiprocessing.Pool(processes=jobs,initializer=init_pool_worker,
+		initargs=(backend_options or {},cache))
+	try:
+		results = []
+		for path,result,error in pool.imap(convert_job,
+				[(path,timeout,record_metrics) for path in paths]):
+			if result is not None:
+				print_report(result)
+			else:
+				print('\nFILENAME: ' + path)
+				print('ERROR: ' + error)
+			results.append((path,result,error))
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
+# Function that splits a CHAT file at utterance boundaries into segments
+# that can be converted on their own: every segment starts with a copy of
+# the headers of the file (the '@' lines before the first utterance) and
+# ends with @End if the file does. The segments hold about the same number
+# of lines.
+# Inputs -> The (refined) CHAT file, the number of segments and the
+#			directory the segments are written to (one directory per
+#			segment, with the name of the file, so that the converters see
+#			the same file name).
+# Output -> List of (segment file, number of its first line after the
+#			headers in the file) and the number of header lines.
+def split_segments(file,num_segments,directory):
+	num_headers = None
+	starts = []
+	num_lines = 0
+	end = None
+	with open(file,'rU') as f:
+		for i,line in enumerate(f):
+			if num_headers is None and not line.startswith('@'):
+				num_headers = i
+			if line.startswith('*'):
+				starts.append(i)
+			if line.startswith('@End'):
+				end = i
+			elif line.strip() != '':
+				end = None
+			num_lines += 1
+	if num_headers is None:
+		num_headers = num_lines
+	body_end = num_lines if end is None else end
+	# The first utterance after an even share of the lines starts a segment.
+	bounds = [num_headers]
+	for k in range(1,num_segments):
+		target = num_headers + (body_end - num_headers) * k // num_segments
+		pos = bisect.bisect_left(starts,max(target,bounds[-1] + 1))
+		if pos < len(starts) and starts[pos] < body_end:
+			bounds.append(starts[pos])
+	segments = [(os.path.join(directory,'segment-' + str(k),
+		os.path.basename(file)),start) for k,start in enumerate(bounds)]
+	for seg_file,start in segments:
+		os.mkdir(os.path.dirname(seg_file))
+	if num_headers == num_lines:
+		# Nothing after the headers: the file is its own segment.
+		shutil.copyfile(file,segments[0][0])
+		return segments,num_headers
+	headers = []
+	out = None
+	k = -1
+	with open(file,'rU') as f:
+		for i,line in enumerate(f):
+			if i < num_headers:
+				headers.append(line)
+				continue
+			if k + 1 < len(bounds) and i == bounds[k + 1]:
+				if out is not None:
+					if end is not None:
+						out.write('@End\n')
+					out.close()
+				k += 1
+				out = open(segments[k][0],'w')
+				out.writelines(headers)
+			out.write(line)
+	out.close()
+	return segments,num_headers
+
+# Function that converts one segment in a pool worker process (see
+# SegmentPool) with the same repair loop as a whole file.
+# Failures are returned as text, since not all of them can be pickled.
+# Output -> (lines removed, unbalanced utterances, iterations, metrics, error)
+def convert_segment_job(job):
+	file,xml_file,deadline,record_metrics = job
+	metrics = Metrics() if record_metrics else NO_METRICS
+	unbalanced = []
+	try:
+		timeout = None
+		if deadline is not None:
+			timeout = deadline - time.time()
+			if timeout <= 0:
+				raise ChatterTimeout("Conversion timed out on " + file)
+		lines_removed,iterations = convert(worker_backend,file,xml_file,
+			timeout,metrics,unbalanced)
+		return lines_removed,unbalanced,iterations,metrics.to_dict(),None
+	except ChatterTimeout as e:
+		return None,None,None,None,('timeout',str(e))
+	except etree.XMLSyntaxError as e:
+		return None,None,None,None,('xml',(e.msg,e.code,e.lineno,e.offset))
+	except Exception:
+		return None,None,None,None,('error',traceback.format_exc())
+
+'''
+Converter that splits CHAT files into segments (see split_segments) and
+converts the segments concurrently on a pool of processes, each with its
+own backend. Every segment runs its own repair loop, so the segments that
+are clean stop after one run and only the segments that still have
+illegal lines are run again. The XML of the segments is then joined into
+one document with talkbank_xml.stitch_xml. It is given to convert_file as
+the backend.
+Inputs -> Number of processes, number of segments of each file and the
+		keyword arguments of make_backend.
+'''
+class SegmentPool(Backend):
+
+	def __init__(self,processes,num_segments,backend_options=None):
+		backend_options = backend_options or {}
+		# Segmented conversions are cached apart from whole files.
+		self.name = (('native' if backend_options.get('native') else
+			'chatter') + ' segments')
+		self.num_segments = num_segments
+		# Number of files converted.
+		self.invocations = 0
+		self.pool = multiprocessing.Pool(processes=processes,
+			initializer=init_pool_worker,initargs=(backend_options,))
+
+	# Function that converts a file segment by segment in the directory of
+	# the file.
+	# Inputs -> The (refined) CHAT file and the XML file.
+	#			Number of seconds allowed for the whole conversion.
+	#			The Metrics the stages of all the segments are added to.
+	#			List the utterances with unbalanced delimiters are added to.
+	# Output -> List of lines that were removed and the largest number of
+	#			runs of a segment.
+	def convert(self,file,xml_file,timeout=None,metrics=NO_METRICS,
+			unbalanced=None):
+		deadline = None
+		if timeout is not None:
+			deadline = time.time() + timeout
+		with metrics.stage('split'):
+			segments,num_headers = split_segments(file,self.num_segments,
+				os.path.dirname(os.path.abspath(file)))
+		metrics.count('segments',len(segments))
+		jobs = [(seg_file,seg_file[:seg_file.rfind('.')] + '.xml',deadline,
+			metrics is not NO_METRICS) for seg_file,start in segments]
+		lines_removed = []
+		iterations = 0
+		for (seg_file,start),result in zip(segments,
+				self.pool.map(convert_segment_job,jobs)):
+			(seg_removed,seg_unbalanced,seg_iterations,seg_metrics,
+				error) = result
+			if error is not None:
+				kind,detail = error
+				if kind == 'timeout':
+					raise ChatterTimeout(detail)
+				if kind == 'xml':
+					raise etree.XMLSyntaxError(*detail)
+				raise RuntimeError(detail)
+			# Line numbers in the segment are turned into line numbers in
+			# the file.
+			lines_removed.extend([start + i - num_headers,line]
+				for i,line in seg_removed)
+			if unbalanced is not None:
+				unbalanced.extend(start + i - num_headers for i in seg_unbalanced)
+			iterations = max(iterations,seg_iterations)
+			if seg_metrics is not None:
+				metrics.add(seg_metrics)
+		with metrics.stage('stitch'):
+			talkbank_xml.stitch_xml([job[1] for job in jobs],xml_file)
+		self.invocations += 1
+		return lines_removed,iterations
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+# Function that prints the summary of a conversion of several files.
+def print_summary(results):
+	print('SUMMARY\n')
+	for path,result,error in results:
+		if result is None:
+			print('\t' + path + ': FAILED (' + error.strip().split('\n')[-1] + ')')
+		else:
+			percentage = round((float(len(result['lines_removed']))/float(result['num_lines']))*100,4)
+			if result.get('cached'):
+				iterations = 'cached'
+			else:
+				iterations = str(result['iterations']) + ' CHATTER iterations'
+			print('\t' + path + ': ' + str(len(result['lines_removed'])) +
+				' lines removed [' + str(percentage) + ' % ], ' + iterations)
+	failed = len([1 for path,result,error in results if result is None])
+	print('\nFiles converted: ' + str(len(results) - failed) +
+		', failed: ' + str(failed))
+	single = len([1 for path,result,error in results
+		if result is not None and result['iterations'] == 1])
+	print('Files converted with a single CHATTER run: ' + str(single))
+	cached = len([1 for path,result,error in results
+		if result is not None and result.get('cached')])
+	print('Files copied from the cache: ' + str(cached) + '\n')
+
 
 if __name__ == '__main__':
 
@@ -255,49 +1097,122 @@ if __name__ == '__main__':
 	parser.add_argument(
 		'-files', action = 'store', dest = 'in_files', default = None,
 		help = 'path to the CHAT file(s)', nargs = '*', required = False)
+	parser.add_argument(
+		'-chatter', action = 'store_true', dest = 'chatter', default = False,
+		help = 'convert with CHATTER (strict) instead of the native writer')
+	parser.add_argument(
+		'-xsd', action = 'store', dest = 'xsd', default = None,
+		help = 'TalkBank XSD file the XML of the native writer is validated'
+			' against')
+	parser.add_argument(
+		'-worker', action = 'store_true', dest = 'worker', default = False,
+		help = 'keep one CHATTER worker process running for all conversions'
+			' (implies -chatter)')
+	parser.add_argument(
+		'-chatter-command', action = 'store', dest = 'chatter_command',
+		default = None, help = 'command used to run CHATTER (or to start the'
+			' worker with -worker, implies -chatter)')
+	parser.add_argument(
+		'-jobs', '--jobs', action = 'store', dest = 'jobs', type = int,
+		default = 1, help = 'number of files converted concurrently')
+	parser.add_argument(
+		'-segments', action = 'store', dest = 'segments', type = int,
+		default = None, help = 'split every file into this number of'
+			' segments at utterance boundaries and convert the segments'
+			' concurrently on -jobs processes')
+	parser.add_argument(
+		'-timeout', action = 'store', dest = 'timeout', type = float,
+		default = None, help = 'number of seconds allowed for each file')
+	parser.add_argument(
+		'-cache', action = 'store', dest = 'cache', nargs = '?',
+		const = CACHE_DIRECTORY, default = None,
+		help = 'reuse the conversions of unchanged files stored in this'
+			' directory (default ' + CACHE_DIRECTORY + ')')
+	parser.add_argument(
+		'-cache-size', action = 'store', dest = 'cache_size', type = float,
+		default = CACHE_SIZE, help = 'maximum size of the cache in MB')
+	parser.add_argument(
+		'-clear-cache', action = 'store_true', dest = 'clear_cache',
+		default = False, help = 'invalidate the cache before converting')
+	parser.add_argument(
+		'-metrics', '--metrics', action = 'store', dest = 'metrics_file',
+		default = None, help = 'JSON file the time spent in each stage and'
+			' the counters of every conversion are written to')
 	args = parser.parse_args()
 
+	# The native writer is used unless CHATTER is asked for.
+	backend_options = {'native': not (args.chatter or args.worker or
+		args.chatter_command is not None), 'worker': args.worker,
+		'command': args.chatter_command, 'xsd': args.xsd}
+	if args.xsd is not None and not backend_options['native']:
+		print("ERROR: -xsd is only used by the native writer\nExiting...")
+		sys.exit()
 
-	# Getting the directory name
+	cache = None
+	if args.cache is not None:
+		cache = ConversionCache(args.cache,int(args.cache_size*1024*1024))
+		if args.clear_cache:
+			print('Cleared ' + str(cache.clear()) + ' cached conversions')
+
+	run_metrics = Metrics()
+
+	# Collecting the files to convert.
+	paths = []
 	if args.in_direc != None:
-		dir_name = "./"+args.in_direc[0]
 		# Going through the directory
 		for root, dirs, files in os.walk(args.in_direc[0]):
-			for file in files:
-				run(dir_name = dir_name,file = file)
-				
+			dirs.sort()
+			for file in sorted(files):
+				if check_extension(file,"cha"):
+					paths.append(os.path.join(root,file))
 	#G oing through the files.
 	if args.in_files != None:
-		for file in args.in_files:
-			run(file = file)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+		paths += args.in_files
 
+	if args.segments is not None and args.segments < 1:
+		print("ERROR: -segments must be at least 1\nExiting...")
+		sys.exit()
 
+	if args.jobs > 1 and args.segments is None:
+		results = run_parallel([path for path in paths if
+			check_extension(path,"cha") and file_exists(path)],args.jobs,
+			backend_options,args.timeout,cache,args.metrics_file != None)
+		for path in paths:
+			if not check_extension(path,"cha") or not file_exists(path):
+				print("ERROR: Verify .cha file extension and that file exists")
+				print("FILENAME: " + path)
+	else:
+		# One backend (or pool converting the segments of each file) is
+		# shared by all the conversions.
+		if args.segments is not None:
+			backend = SegmentPool(args.jobs,args.segments,backend_options)
+		else:
+			backend = make_backend(**backend_options)
+		results = []
+		try:
+			for path in paths:
+				try:
+					result = run(file = path,backend = backend,
+						timeout = args.timeout,cache = cache,
+						record_metrics = args.metrics_file != None)
+					if result is not None:
+						results.append((path,result,None))
+				except ChatterTimeout:
+					print('\nFILENAME: ' + path)
+					print('ERROR: timed out')
+					results.append((path,None,'timed out'))
+				except etree.XMLSyntaxError as e:
+					print('\nFILENAME: ' + path)
+					print('ERROR: invalid XML: ' + str(e))
+					results.append((path,None,'invalid XML: ' + str(e)))
+		finally:
+			backend.close()
+	if len(results) > 1:
+		print_summary(results)
+	if args.metrics_file != None:
+		files = [(path,result['metrics']) for path,result,error in results
+			if result is not None]
+		# The stages and counters of the run are those of all its files.
+		for path,file_metrics in files:
+			run_metrics.add(file_metrics)
+		write_metrics(args.metrics_file,run_metrics.to_dict(),files)
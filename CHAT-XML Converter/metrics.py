@@ -0,0 +1,135 @@
+'''
+	Per-stage timing and counters for conversions (-metrics option).
+
+	A Metrics object accumulates the wall time spent in named stages (e.g.
+	refinement, each CHATTER run) and named counters (e.g. lines removed,
+	JVM starts). NO_METRICS is used when metrics are not recorded, so the
+	code being measured never has to check.
+
+	The metrics of a run are written to a JSON file with one entry per
+	converted file along with the totals.
+'''
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+	import resource
+except ImportError:
+	# Not available on Windows.
+	resource = None
+
+
+# Function that returns the peak resident set size of the process in MB.
+def peak_rss_mb():
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# ru_maxrss is in bytes on macOS and in KB elsewhere.
+	if sys.platform == 'darwin':
+		return round(peak / (1024.0 * 1024.0), 1)
+	return round(peak / 1024.0, 1)
+
+
+class Metrics(object):
+
+	def __init__(self):
+		self.start = time.time()
+		# Stage name -> [seconds, calls]
+		self.stages = {}
+		self.counters = {}
+		self._lock = threading.Lock()
+
+	# Function that times a stage: with metrics.stage('search'): ...
+	@contextmanager
+	def stage(self, name):
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.time() - start)
+
+	def add_time(self, name, seconds):
+		with self._lock:
+			entry = self.stages.setdefault(name, [0.0, 0])
+			entry[0] += seconds
+			entry[1] += 1
+
+	def count(self, name, value=1):
+		with self._lock:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	# Function that adds the stages and counters of metrics recorded
+	# elsewhere (e.g. in another process), as returned by to_dict.
+	def add(self, entry):
+		with self._lock:
+			for name, stage in entry['stages'].items():
+				totals = self.stages.setdefault(name, [0.0, 0])
+				totals[0] += stage['seconds']
+				totals[1] += stage['calls']
+			for name, value in entry['counters'].items():
+				self.counters[name] = self.counters.get(name, 0) + value
+
+	# Function that returns the metrics as a dictionary that can be written
+	# as JSON.
+	def to_dict(self):
+		return {'wall_seconds': round(time.time() - self.start, 6),
+			'stages': dict((name, {'seconds': round(seconds, 6), 'calls': calls})
+				for name, (seconds, calls) in self.stages.items()),
+			'counters': dict(self.counters),
+			'peak_rss_mb': peak_rss_mb()}
+
+
+class NoMetrics(object):
+
+	@contextmanager
+	def stage(self, name):
+		yield
+
+	def add_time(self, name, seconds):
+		pass
+
+	def count(self, name, value=1):
+		pass
+
+	def add(self, entry):
+		pass
+
+	def to_dict(self):
+		return None
+
+NO_METRICS = NoMetrics()
+
+
+# Function that sums the metrics of several runs (as returned by to_dict).
+# The peak memory is the largest of the peaks.
+def aggregate(entries):
+	total = {'wall_seconds': 0.0, 'stages': {}, 'counters': {},
+		'peak_rss_mb': None}
+	for entry in entries:
+		total['wall_seconds'] += entry['wall_seconds']
+		for name, stage in entry['stages'].items():
+			totals = total['stages'].setdefault(name, {'seconds': 0.0, 'calls': 0})
+			totals['seconds'] += stage['seconds']
+			totals['calls'] += stage['calls']
+		for name, value in entry['counters'].items():
+			total['counters'][name] = total['counters'].get(name, 0) + value
+		if entry['peak_rss_mb'] is not None:
+			total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0,
+				entry['peak_rss_mb'])
+	return total
+
+
+# Function that writes the metrics of a run to a JSON file.
+# Inputs -> Filename, the metrics of the whole run and, in batch runs, a
+#			list of (name, metrics) for each file.
+def write_metrics(filename, run, files=None):
+	data = {'run': run}
+	if files is not None:
+		data['files'] = [dict(metrics, file=name) for name, metrics in files]
+		data['totals'] = aggregate([metrics for name, metrics in files])
+	with open(filename, 'w') as f:
+		json.dump(data, f, indent=2, sort_keys=True)
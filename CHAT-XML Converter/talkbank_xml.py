@@ -0,0 +1,401 @@
+'''
+	Native CHAT to TalkBank XML writer.
+
+	Converts the subset of CHAT used by Gailbot transcripts (headers,
+	participants, utterances, words, pauses, terminators, media bullets and
+	dependent tiers) to XML following the TalkBank schema
+	(https://talkbank.org/software/xsddoc/), without running CHATTER.
+
+	The transcript is read line by line and the XML is streamed with
+	etree.xmlfile one utterance at a time, so memory stays constant
+	regardless of the length of the transcript. Unlike CHATTER, the content
+	of the utterances is not strictly checked: anything that is not part of
+	the subset is written as plain words or comments. Only the lines that
+	cannot be written at all are reported, using the diagnostics format of
+	CHATTER ('Error on line N, ...') so that chatter.py can remove them the
+	same way.
+'''
+
+from lxml import etree
+import itertools
+import re
+
+# Namespaces and version of the TalkBank schema.
+TALKBANK_NAMESPACE = 'http://www.talkbank.org/ns/talkbank'
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+SCHEMA_LOCATION = (TALKBANK_NAMESPACE +
+	' https://talkbank.org/software/talkbank.xsd')
+TALKBANK_VERSION = '2.16.0'
+# Elements written one at a time declare the TalkBank namespace as default.
+NSMAP = {None: TALKBANK_NAMESPACE}
+
+# Utterance terminators and their types.
+TERMINATORS = {u'.': 'p', u'?': 'q', u'!': 'e', u'+...': 'trail off',
+	u'+..?': 'trail off question', u'+!?': 'question exclamation',
+	u'+/.': 'interruption', u'+/?': 'interruption question',
+	u'+//.': 'self interruption', u'+//?': 'self interruption question',
+	u'+"/.': 'quotation next line', u'+".': 'quotation precedes'}
+# Terminator of utterances without one in CA transcripts.
+MISSING_TERMINATOR = 'missing CA terminator'
+# Untranscribed material.
+UNTRANSCRIBED = {u'xxx': 'unintelligible', u'yyy': 'unphonetic',
+	u'www': 'untranscribed'}
+# Untimed pauses.
+PAUSES = {u'(.)': 'simple', u'(..)': 'long', u'(...)': 'very long'}
+# Timed pauses, e.g. (0.5) or (1:02.5).
+TIMED_PAUSE = re.compile(u'^\\((?:(\\d+):)?(\\d+(?:\\.\\d*)?|\\.\\d+)\\)$')
+# Media bullets.
+BULLET = re.compile(u'\x15(\\d+)_(\\d+)\x15')
+# Types of the annotations in square brackets ([% ...], [= ...], [=! ...]).
+GROUP_TYPES = [(u'=!', 'paralinguistics'), (u'%', 'comments'),
+	(u'=', 'explanation')]
+# Headers written as comments and their comment types.
+HEADER_COMMENTS = {u'Comment': 'Generic', u'Location': 'Location',
+	u'Situation': 'Situation', u'Activities': 'Activities',
+	u'Warning': 'Warning', u'Transcriber': 'Transcriber', u'Date': 'Date',
+	u'Time Duration': 'Time Duration', u'Bck': 'Bck'}
+# Dependent tiers and their types. Other tiers are written as extensions.
+TIER_TYPES = {u'com': 'comments', u'act': 'actions', u'exp': 'explanation',
+	u'sit': 'situation', u'gpx': 'gesture', u'add': 'addressee',
+	u'spa': 'speech act', u'int': 'intonation', u'par': 'paralinguistics',
+	u'eng': 'english translation', u'alt': 'alternative',
+	u'cod': 'coding', u'fac': 'facial', u'ort': 'orthography'}
+
+
+# Function that returns a line read from a CHAT file as text.
+def to_text(line):
+	if isinstance(line,bytes):
+		return line.decode('utf-8','replace')
+	return line
+
+# Function that returns the tag of an element in the TalkBank namespace.
+def tag(name):
+	return '{' + TALKBANK_NAMESPACE + '}' + name
+
+# Function that groups the lines of a CHAT file into entries: a header,
+# utterance or dependent tier line followed by its continuation lines.
+# Output -> Generator of (line numbers, text) pairs, text without the line
+#			breaks and with the continuation lines joined by spaces.
+def entries(lines):
+	nums = []
+	text = []
+	for i,line in enumerate(lines):
+		line = to_text(line).rstrip(u'\r\n')
+		if line.startswith(u'\t') and len(nums) > 0:
+			nums.append(i)
+			text.append(line.strip())
+			continue
+		if len(nums) > 0:
+			yield nums,u' '.join(text)
+		nums = [i]
+		text = [line]
+	if len(nums) > 0:
+		yield nums,u' '.join(text)
+
+# Function that splits a header or tier into its name and value.
+def split_entry(text):
+	sep = text.find(u':')
+	if sep == -1:
+		return text[1:].strip(),u''
+	return text[1:sep].strip(),text[sep+1:].strip()
+
+# Function that parses the @Participants header.
+# Output -> List of (id, name, role); name is None when it is not given.
+def parse_participants(value):
+	participants = []
+	for entry in value.split(u','):
+		fields = entry.split()
+		if len(fields) == 0:
+			continue
+		if len(fields) == 1:
+			participants.append((fields[0],None,'Unidentified'))
+		elif len(fields) == 2:
+			participants.append((fields[0],None,fields[1]))
+		else:
+			participants.append((fields[0],u' '.join(fields[1:-1]),fields[-1]))
+	return participants
+
+'''
+Headers of a transcript, collected before the first utterance.
+'''
+class Headers(object):
+
+	def __init__(self):
+		self.languages = []
+		self.participants = []
+		# Attributes from the @ID headers by participant id.
+		self.ids = {}
+		self.media = None
+		self.media_type = None
+		self.options = None
+		self.corpus = None
+		# Headers written as comments, as (comment type, text).
+		self.comments = []
+
+	# Function that adds a header. Returns False if it is not a header.
+	def add(self,text):
+		if not text.startswith(u'@'):
+			return False
+		name,value = split_entry(text)
+		if name == u'Languages':
+			self.languages = [x for x in re.split(u'[,\\s]+',value) if x]
+		elif name == u'Participants':
+			self.participants = parse_participants(value)
+		elif name == u'ID':
+			fields = value.split(u'|')
+			if len(fields) >= 3:
+				if self.corpus is None and fields[1]:
+					self.corpus = fields[1]
+				self.ids[fields[2]] = fields
+		elif name == u'Media':
+			fields = [x.strip() for x in value.split(u',')]
+			self.media = fields[0]
+			if len(fields) > 1:
+				self.media_type = fields[1]
+		elif name == u'Options':
+			self.options = value
+		elif name in HEADER_COMMENTS:
+			self.comments.append((HEADER_COMMENTS[name],value))
+		return True
+
+	# Function that returns the attributes of the CHAT element.
+	def root_attributes(self,default_corpus):
+		attrib = {'{' + XSI_NAMESPACE + '}schemaLocation': SCHEMA_LOCATION,
+			'Version': TALKBANK_VERSION,
+			'Lang': u' '.join(self.languages) or u'eng',
+			'Corpus': self.corpus or default_corpus}
+		if self.media is not None:
+			attrib['Media'] = self.media
+			attrib['Mediatypes'] = self.media_type or u'audio'
+		if self.options:
+			attrib['Options'] = self.options
+		return attrib
+
+	# Function that returns the Participants element.
+	def participants_element(self):
+		element = etree.Element(tag('Participants'),nsmap=NSMAP)
+		for id,name,role in self.participants:
+			participant = etree.SubElement(element,tag('participant'),
+				id=id,role=role)
+			if name is not None:
+				participant.set('name',name)
+			fields = self.ids.get(id)
+			if fields is not None and fields[0]:
+				participant.set('language',fields[0])
+			elif len(self.languages) > 0:
+				participant.set('language',self.languages[0])
+		return element
+
+# Function that adds the XML of the words of an utterance to an element.
+# Output -> The type of the terminator (None if there is none).
+def add_words(element,tokens):
+	terminator = None
+	pos = 0
+	while pos < len(tokens):
+		token = tokens[pos]
+		pos += 1
+		# Annotations in square brackets can span several tokens.
+		if token.startswith(u'['):
+			group = [token]
+			while not group[-1].endswith(u']') and pos < len(tokens):
+				group.append(tokens[pos])
+				pos += 1
+			text = u' '.join(group)[1:].rstrip(u']')
+			group_type = 'comments'
+			for prefix,name in GROUP_TYPES:
+				if text.startswith(prefix):
+					group_type = name
+					text = text[len(prefix):]
+					break
+			etree.SubElement(element,tag('ga'),type=group_type).text = text.strip()
+			continue
+		# Scope delimiters are not kept.
+		token = token.strip(u'<>')
+		if len(token) == 0:
+			continue
+		if token in TERMINATORS:
+			terminator = TERMINATORS[token]
+			continue
+		if token in PAUSES:
+			etree.SubElement(element,tag('pause'),
+				{'symbolic-length': PAUSES[token]})
+			continue
+		match = TIMED_PAUSE.match(token)
+		if match is not None:
+			length = float(match.group(2)) + 60 * int(match.group(1) or 0)
+			etree.SubElement(element,tag('pause'),
+				{'symbolic-length': 'simple', 'length': '%.2f' % length})
+			continue
+		if token == u',':
+			etree.SubElement(element,tag('s'),type='comma')
+			continue
+		if token.startswith(u'&='):
+			event = etree.SubElement(element,tag('e'))
+			etree.SubElement(event,tag('ga'),type='actions').text = token[2:]
+			continue
+		word = etree.SubElement(element,tag('w'))
+		if token in UNTRANSCRIBED:
+			word.set('untranscribed',UNTRANSCRIBED[token])
+		elif token.startswith(u'&') and len(token) > 1:
+			word.set('type','fragment')
+			token = token[1:]
+		elif token.startswith(u'0') and len(token) > 1 and not token[1].isdigit():
+			word.set('type','omission')
+			token = token[1:]
+		word.text = token
+	return terminator
+
+# Function that builds the element of an utterance.
+# Inputs -> Text of the utterance, its dependent tiers, its id and whether
+#			the transcript is in CA (terminators are then optional).
+def utterance_element(text,tiers,uid,ca):
+	speaker,content = split_entry(text)
+	element = etree.Element(tag('u'),who=speaker,uID=uid,nsmap=NSMAP)
+	times = [(int(start),int(end)) for start,end in BULLET.findall(content)]
+	terminator = add_words(element,BULLET.sub(u' ',content).split())
+	if terminator is None:
+		terminator = MISSING_TERMINATOR if ca else 'p'
+	etree.SubElement(element,tag('t'),type=terminator)
+	if len(times) > 0:
+		etree.SubElement(element,tag('media'),unit='s',
+			start='%.3f' % (min(start for start,end in times) / 1000.0),
+			end='%.3f' % (max(end for start,end in times) / 1000.0))
+	for tier in tiers:
+		name,value = split_entry(tier)
+		if name in TIER_TYPES:
+			etree.SubElement(element,tag('a'),type=TIER_TYPES[name]).text = value
+		else:
+			etree.SubElement(element,tag('a'),type='extension',
+				flavor=name).text = value
+	return element
+
+# Function that writes a CHAT transcript as TalkBank XML.
+# Inputs -> Iterable of the lines of the transcript.
+#			Binary file (or filename) the XML is written to.
+#			Corpus name used when the transcript has no @ID header.
+# Output -> List of the diagnostics of the lines that could not be written
+#			(in the format of CHATTER).
+def write_xml(lines,out,corpus=u'unknown'):
+	diagnostics = []
+	headers = Headers()
+	stream = entries(lines)
+	# The headers come before the first utterance and give the attributes
+	# of the root element.
+	first = None
+	for nums,text in stream:
+		if not headers.add(text):
+			first = (nums,text)
+			break
+	declared = set(id for id,name,role in headers.participants)
+	ca = headers.options is not None and u'CA' in headers.options.split()
+
+	def error(nums,message):
+		for num in nums:
+			diagnostics.append('Error on line %d, column 1: %s' % (num,message))
+
+	with etree.xmlfile(out,encoding='UTF-8') as xf:
+		xf.write_declaration()
+		with xf.element(tag('CHAT'),headers.root_attributes(corpus),
+				nsmap=dict(NSMAP,xsi=XSI_NAMESPACE)):
+			xf.write(headers.participants_element())
+			for comment_type,value in headers.comments:
+				comment = etree.Element(tag('comment'),type=comment_type,
+					nsmap=NSMAP)
+				comment.text = value
+				xf.write(comment)
+
+			# The current utterance is written once all its dependent tiers
+			# have been read.
+			utterance = [None]
+			num_utterances = [0]
+			def flush():
+				if utterance[0] is None:
+					return
+				nums,text,tiers = utterance[0]
+				utterance[0] = None
+				speaker = split_entry(text)[0]
+				if len(declared) > 0 and speaker not in declared:
+					error(nums,'speaker ' + speaker + ' is not declared')
+					return
+				try:
+					element = utterance_element(text,tiers,
+						'u%d' % num_utterances[0],ca)
+				except ValueError as e:
+					error(nums,str(e))
+					return
+				xf.write(element)
+				num_utterances[0] += 1
+
+			if first is not None:
+				stream = itertools.chain([first],stream)
+			for nums,text in stream:
+				if text.startswith(u'*') and text.find(u':') != -1:
+					flush()
+					utterance[0] = (nums,text,[])
+				elif text.startswith(u'%') and utterance[0] is not None:
+					utterance[0][0].extend(nums)
+					utterance[0][2].append(text)
+				elif text.startswith(u'@'):
+					flush()
+					name,value = split_entry(text)
+					if name in HEADER_COMMENTS:
+						comment = etree.Element(tag('comment'),
+							type=HEADER_COMMENTS[name],nsmap=NSMAP)
+						comment.text = value
+						xf.write(comment)
+				elif len(text.strip()) > 0:
+					flush()
+					error(nums,'not a header, utterance or tier')
+			flush()
+	return diagnostics
+
+# Function that validates an XML file against a schema while streaming it.
+# Raises etree.XMLSyntaxError (with the first error) if it is not valid.
+def validate(xml_file,schema):
+	for event,element in etree.iterparse(xml_file,schema=schema):
+		element.clear()
+
+# Function that checks whether an element is an utterance, with or without
+# the TalkBank namespace (CHATTER and the native writer).
+def is_utterance(element):
+	return element.tag in (tag('u'),'u')
+
+# Function that joins the XML of the segments of a transcript (see
+# chatter.split_segments) into one document. Every segment repeats the
+# headers of the transcript, so the elements before the first utterance of
+# a segment that are the same as those of the first segment are only
+# written once, and the utterances are numbered again from u0.
+# Inputs -> List of the XML files of the segments, in order.
+#			Binary file (or filename) the XML is written to.
+# Output -> The number of utterances.
+def stitch_xml(xml_files,out):
+	num_utterances = 0
+	root = etree.parse(xml_files[0]).getroot()
+	headers = []
+	for child in root:
+		if is_utterance(child):
+			break
+		headers.append(etree.tostring(child))
+	with etree.xmlfile(out,encoding='UTF-8') as xf:
+		xf.write_declaration()
+		with xf.element(root.tag,root.attrib,nsmap=root.nsmap):
+			for k,xml_file in enumerate(xml_files):
+				if k > 0:
+					root = etree.parse(xml_file).getroot()
+				children = list(root)
+				skip = 0
+				if k > 0:
+					while (skip < min(len(children),len(headers)) and
+							not is_utterance(children[skip]) and
+							etree.tostring(children[skip]) == headers[skip]):
+						skip += 1
+				for child in children[skip:]:
+					# Detached, the element no longer repeats the namespaces
+					# of the root.
+					root.remove(child)
+					if is_utterance(child):
+						if child.get('uID') is not None:
+							child.set('uID','u%d' % num_utterances)
+						num_utterances += 1
+					xf.write(child)
+	return num_utterances
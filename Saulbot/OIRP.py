@@ -12,22 +12,33 @@
 	2. pip install -r requirements.txt
 	3. pip install progressbar
 
+	The audio is read through wav_source.WavSource, which memory-maps the
+	recording once and serves every slice from it without decoding it.
+
 '''
 
 
-from pydub import AudioSegment
-from pydub.utils import make_chunks
+from wav_source import WavSource
+from turn_index import TranscriptIndex, read_turns
+from turn_cache import cached_index
+from clip_export import ExportPipeline, EXPORT_THREADS
+from clip_archive import ARCHIVE_FORMATS, open_writer, write_manifest
+from clip_journal import ClipJournal, JOURNAL_FILE, checksum
+from metrics import Metrics, NO_METRICS, write_metrics
 import argparse   
 import os
 import sys
 import json
 import io
 import re
+import csv
+import multiprocessing
+import traceback
+from collections import namedtuple
+import numpy as np
 from termcolor import colored
-from progressbar import AnimatedMarker, Bar, BouncingBar, Counter, ETA, \
-    AdaptiveETA, FileTransferSpeed, FormatLabel, Percentage, \
-    ProgressBar, ReverseBar, RotatingMarker, \
-    SimpleProgress, Timer, UnknownLength
+from progressbar import Bar, ETA, Percentage, ProgressBar, RotatingMarker, \
+    SimpleProgress
 
 # List of special delimiters in the CA/CHAT formats.
 # Used when searching for keywords to ensure that these characters do not
@@ -40,6 +51,15 @@ SP = [u'\x40',u'\x3a',u'\x2a',u'\x09',u'\x2e','\u02cc',u'\x3f','\u0294',
 		'\u2308','\u204E',u'\x20','\u230a','\u25c1','\u27b4','\u222c',
 		'\xb0',u'\x5e','\u263a',u'\xa3','\u230b']
 
+# The delimiters in SP as unicode characters. Some entries of SP are written
+# as escaped byte strings, so they are decoded here.
+DELIMITERS = frozenset(x.decode('raw_unicode_escape') if isinstance(x,bytes)
+	else x for x in SP)
+
+# Regular expression that splits a line into tokens at the delimiters.
+TOKEN_SPLIT = re.compile(u'[' + u''.join(re.escape(x) for x in
+	sorted(DELIMITERS)) + u']+', re.UNICODE)
+
 # Function that verifies that the given file exists.
 def file_exists(filename):
     if os.path.isfile(filename) == True:
@@ -60,76 +80,122 @@ def check_extension(filename,extension):
 	else:
 		return False
 
-# Function that searches for keywords in the file and returns all lines
-# with those keywords.
+# Function that normalizes a line and splits it into tokens at the CA/CHAT
+# delimiters.
+def tokenize(line):
+	return [token for token in TOKEN_SPLIT.split(line.lower()) if token]
+
+# Class that finds all the keywords in a line in a single pass over its
+# tokens. Single word keywords are found with a hash lookup of each token and
+# multi-word keywords with a lookup of the token sequences that start with
+# one of their first tokens.
+class KeywordMatcher(object):
+
+	def __init__(self,keywords):
+		self.keywords = keywords
+		# Token sequence -> positions of the keywords in the keyword list.
+		self.single = {}
+		self.multi = {}
+		for i,word in enumerate(keywords):
+			key = tuple(tokenize(word))
+			if len(key) == 1:
+				self.single.setdefault(key[0],[]).append(i)
+			elif len(key) > 1:
+				self.multi.setdefault(key,[]).append(i)
+		self.first_tokens = set(key[0] for key in self.multi)
+		self.lengths = sorted(set(len(key) for key in self.multi))
+
+	# Function that returns the positions of the keywords found in the line
+	# and the number of words in the utterance (after the speaker).
+	def match(self,line):
+		colon = line.find(':')
+		text_tokens = tokenize(line[colon+1:])
+		if colon != -1:
+			tokens = tokenize(line[:colon+1]) + text_tokens
+		else:
+			tokens = text_tokens
+		num_words = sum(1 for token in text_tokens
+			if any(x.isalpha() for x in token))
+
+		found = set()
+		for pos,token in enumerate(tokens):
+			if token in self.single:
+				found.update(self.single[token])
+			if token in self.first_tokens:
+				for length in self.lengths:
+					key = tuple(tokens[pos:pos+length])
+					if key in self.multi:
+						found.update(self.multi[key])
+		return found,num_words
+
+	# Function that returns the number of words in a keyword.
+	def num_words(self,i):
+		return len(tokenize(self.keywords[i]))
+
+# Function that searches for keywords in the turns of a transcript (as
+# generated by turn_index.read_turns) and returns all lines with those
+# keywords and the turns they are in.
 # The mode defines how they keyword should occur in the line i.e. if it is 
 # the entire line or part of a line
 # Current modes: 1. solo (keyword is alone in line)
 #				 2. in_line (keyword is not alone in line)
-def search_keywords(all_lines,keywords,form,mode):
+# Every line is tokenized once and all keywords are found in one pass over
+# its tokens. The results are grouped by keyword in the order given.
+# If hit_nums is a list, the line numbers of the lines with keywords are
+# appended to it, in the same order.
+# Output -> The turns and lines with keywords, the number of lines with each
+#			keyword, the number of lines read and the number of speaker
+#			turns read.
+def search_turns(turns,keywords,mode,hit_nums=None):
 	found_lines = []
 	ind_lines = []
 
 	# Converting keywords into a dictionary form for statistics
 	keywords_dict = dict(zip(keywords,[0] * len(keywords)))
 
+	matcher = KeywordMatcher(keywords)
+	keyword_lengths = [matcher.num_words(i) for i in range(len(keywords))]
+	hits = [[] for word in keywords]
+	num_lines = 0
+	num_turns = 0
+	last_start = -1
+	for turn in turns:
+		first_line,end_line,lines,line_nums = turn
+		# Every line is searched in exactly one turn.
+		num_lines += len(line_nums)
+		# Lines after the bullet of a turn come as turns with the same start.
+		if first_line != last_start and turn.speaker is not None:
+			num_turns += 1
+		last_start = first_line
+		text = None
+		for line_num in line_nums:
+			line = lines[line_num - first_line]
+			found,num_words = matcher.match(line)
+			for i in found:
+				# Checking the word depending on the mode
+				if mode == 'solo' and num_words != keyword_lengths[i]:
+					continue
+				if text is None:
+					text = turn.text
+				hits[i].append((line,text,line_num))
+
+	for word,word_hits in zip(keywords,hits):
+		for line,text,line_num in word_hits:
+			# Adding to statistics dictionary
+			keywords_dict[word] += 1
+			ind_lines.append(line)
+			found_lines.append(text)
+			if hit_nums is not None:
+				hit_nums.append(line_num)
+	return found_lines,ind_lines,keywords_dict,num_lines,num_turns
+
+# Function that searches for keywords in the lines of a transcript (a list
+# or any iterable of lines, such as an open file) and returns all lines with
+# those keywords and the turns they are in.
+def search_keywords(all_lines,keywords,form,mode):
 	if form == '.ca' or form == '.cha':
-		for word in keywords:
-			#print("Keyword: {}".format(word))
-			line_num = 0
-			for line in all_lines:
-				if word in line or word.lower() in line.lower():
-
-					# Changing to lowercase for comparisson
-					orig_line = line
-					orig_word = word
-					line = line.lower()
-					word = word.lower()
-
-					if (not line[line.find(word)-1].encode('raw_unicode_escape') in SP):
-						line_num += 1
-						continue
-					if (not line[line.find(word)+len(word)].encode('raw_unicode_escape') in SP):
-						line_num += 1
-						continue
-
-
-					# Changing back to original case
-					line = orig_line
-					word = orig_word
-
-					# Checking the word depending on the mode
-					if mode == 'solo':
-						check_string = line[line.find(':')+1:]
-						check_string = ''.join(x for x in check_string if x.isalpha())
-						if (len(check_string) != len(word)):
-							line_num += 1
-							continue
-
-					# Adding to statistics dictionary
-					keywords_dict[word] += 1
-					ind_lines.append(line)
-					# Ensurnig the line contains the start of the turn
-					if (line.find(':') == -1):
-						curr_count = line_num
-						curr_line = line
-						while(curr_line.find(':') == -1):
-							curr_count -= 1
-							curr_line = all_lines[curr_count]
-							line = curr_line + line
-
-					# Ensuring the line contains the end of the turn.
-					if (line.find('\x15') == -1):
-						curr_count = line_num
-						curr_line = line
-						while(curr_line.find('\x15') == -1):
-							curr_count += 1
-							curr_line = all_lines[curr_count]
-							line = line + curr_line
-
-					found_lines.append(line)
-				line_num += 1
-	return found_lines,ind_lines,keywords_dict
+		return search_turns(read_turns(all_lines),keywords,mode)[:3]
+	return [],[],dict(zip(keywords,[0] * len(keywords)))
 
 
 # Function that extracts times from lines that were found in the transcript
@@ -145,79 +211,89 @@ def extract_times(found_lines,form):
 				times.append(float(start_time)/1000)
 	return times
 
-# Function that extracts the transcript for the given time range
-def extract_transcript(all_lines,times,slice_names,ran,audio_duration,form,
-	keywords,found_lines,out_dir_name):
+# Window of transcript and audio extracted around one or more keywords:
+# the positions of the turns that bound it in the TranscriptIndex, its
+# thresholds in milliseconds (the start times of those turns), the range of
+# lines [first_line, end_line) of its excerpt and the range of frames
+# [start_frame, end_frame) of its audio.
+Window = namedtuple('Window', ['low', 'high', 'low_thresh', 'high_thresh',
+	'first_line', 'end_line', 'start_frame', 'end_frame'])
+
+# Function that resolves the windows of time to extract around the keywords.
+# The range +- ran seconds around each start time is clamped to the audio and
+# widened to the turns that bound it, and the line and frame ranges of the
+# windows are found, for all the times at once with array operations.
+# If merge is True, windows that overlap once they are widened to the turn
+# boundaries are merged into one so that no region is extracted twice.
+# Output -> List of Windows, in the order of the times (or of the merged
+#			windows' start).
+def resolve_windows(index,times,ran,audio,merge=False):
+	if len(times) == 0:
+		return []
+	times = np.asarray(times,dtype=np.float64)
+	low_thresh = np.maximum((times - ran) * 1000,0)
+	high_thresh = np.minimum((times + ran) * 1000,audio.duration_seconds * 1000)
+
+	low,high = index.windows(low_thresh,high_thresh)
+	low_thresh = index.start_at(low).astype(np.float64)
+	high_thresh = index.start_at(high).astype(np.float64)
+
+	if merge:
+		# Sweeping the windows in order: a window starts a new merged window
+		# unless it starts before the end of the windows before it.
+		order = np.lexsort((high_thresh,low_thresh))
+		low,high = low[order],high[order]
+		low_thresh,high_thresh = low_thresh[order],high_thresh[order]
+		new = np.ones(len(order),dtype=bool)
+		new[1:] = low_thresh[1:] >= np.maximum.accumulate(high_thresh)[:-1]
+		groups = np.flatnonzero(new)
+		low,low_thresh = low[groups],low_thresh[groups]
+		high = np.maximum.reduceat(high,groups)
+		high_thresh = np.maximum.reduceat(high_thresh,groups)
+
+	first_line,end_line = index.line_ranges(low,high)
+	start_frame,end_frame = audio.frame_ranges(low_thresh,high_thresh)
+	return [Window(*window) for window in zip(low.tolist(),high.tolist(),
+		low_thresh.tolist(),high_thresh.tolist(),first_line.tolist(),
+		end_line.tolist(),start_frame.tolist(),end_frame.tolist())]
+
+# Function that formats the transcript excerpt of a window.
+# The index is the parsed TranscriptIndex of the transcript, the window is
+# one returned by resolve_windows and hit_lines is the set of lines with
+# keywords (uppercased in the excerpt).
+# Output -> The name of the excerpt file and its content (utf-8 bytes).
+def format_excerpt(index,window,name,keywords,hit_lines):
+	# Extracting the appropriate part of the transcript.
+	excerpt = index.lines[window.first_line:window.end_line]
+	trans = excerpt[:1]
+	for curr_line in excerpt[1:]:
+		if (curr_line in hit_lines):
+			curr_line = curr_line.upper()
+		trans.append(curr_line)
+
+	trans = zero_times(trans)
+	file_name = name[:name.rfind(".")] + '.S.ca'
+	comment = "OIR's: "+" ,".join(keywords)
+	data = [u'@Media:\t'+unicode(name)+u',audio\n',
+		u'@Comment:\t'+unicode(comment)+u'\n']
+	data += trans
+	data.append(u'@End\r')
+	return file_name,u''.join(data).encode('utf-8','ignore')
+
+# Function that extracts the transcript for the given windows
+# The index is the parsed TranscriptIndex of the transcript and the windows
+# are those returned by resolve_windows.
+def extract_transcript(index,windows,slice_names,form,keywords,found_lines,
+	out_dir_name):
 
 	trans_names = []
+	hit_lines = set(found_lines)
 	if (form == '.ca' or form == '.cha'):
-		for start_time,name in zip(times,slice_names):
-
-			low_thresh = (start_time - ran) * 1000
-			if (low_thresh < 0 ):
-				low_thresh = 0
-			high_thresh = (start_time + ran) * 1000
-			if (high_thresh > audio_duration * 1000):
-				high_thresh = audio_duration * 1000
-
-			orig_low = low_thresh
-			orig_high = high_thresh
-
-			# Searching for a time in all_lines
-			line_times = extract_times(all_lines,'.ca')
-
-			low_thresh = (takeClosest(low_thresh/1000,line_times) * 1000)
-			ol = low_thresh
-			if low_thresh > orig_low:
-				low_thresh = line_times[line_times.index(low_thresh/1000) - 1] * 1000
-				if low_thresh > orig_low:
-					low_thresh = ol
-			high_thresh =  (takeClosest(high_thresh/1000,line_times) * 1000)
-			if high_thresh < orig_high:
-				if (line_times.index(high_thresh/1000) + 1) < len(line_times):
-					high_thresh = (line_times[line_times.index(high_thresh/1000) + 1] * 1000)
-
-			low_thresh = low_thresh/1000
-			high_thresh = high_thresh/1000
-
-			trans = []
-			line_num = 0
-			for line in all_lines:
-				time = extract_times([line],'.ca')
-
-				# #xtracting the appropriate part of the transcript.
-				if (len(time) > 0):	
-					if time[0] == low_thresh:
-						count = line_num + 1
-						trans.append(line)
-
-						while(True):
-							if (count == len(all_lines)):
-								break
-							curr_line = all_lines[count]
-							time2 = extract_times([curr_line],'.ca')
-							if (curr_line in found_lines):
-								curr_line = curr_line.upper()
-							if (len(time2) > 0):
-								if time2[0] == high_thresh:
-									trans.append(curr_line)
-									break
-							trans.append(curr_line)
-							count += 1
-
-				line_num += 1
-
-			trans = zero_times(trans)
-			file_name = name[:name.rfind(".")] + '.S.ca'
+		for window,name in zip(windows,slice_names):
+			file_name,data = format_excerpt(index,window,name,keywords,hit_lines)
 			trans_names.append(file_name)
-			file = open(os.path.join(out_dir_name, file_name),'wb')
-			file.write(u'@Media:\t'+unicode(name)+u',audio\n')
-			comment = "OIR's: "+" ,".join(keywords)
-			file.write(u'@Comment:\t'+unicode(comment)+u'\n')
-			for line in trans:
-				file.write(line.encode('utf-8', 'ignore'))
-			file.write(u'@End\r')
-			file.close()
+			with open(os.path.join(out_dir_name, file_name),'wb') as file:
+				file.write(data)
 	return trans_names
 
 # Function that zeros the bullets for the transcript file relative to the start
@@ -241,87 +317,186 @@ def zero_times(all_lines):
 			new_trans.append(lines)
 	return new_trans
 
-# Helper function that finds the closest number in a list to the given number
-def takeClosest(num,collection):
-   return min(collection,key=lambda x:abs(x-num))
-
-# Function that finds closest with a certain threshold
-def takeCloset_threshold(start_time,line_times,ran):
-	min_val = start_time - ran
-
-# Function that slices audio +- x seconds from a given time y seconds
-# The input time and range should be in seconds.
-def slice_audio(audio_file,start_time,ran,all_lines,out_dir_name):
-	audio = AudioSegment.from_wav(audio_file)
-	low_thresh = (start_time - ran) * 1000
-	if (low_thresh < 0 ):
-		low_thresh = 0
-	high_thresh = (start_time + ran) * 1000
-	if (high_thresh > audio.duration_seconds * 1000):
-		high_thresh = audio.duration_seconds * 1000
-
-	orig_low = low_thresh
-	orig_high = high_thresh
-
-	line_times = extract_times(all_lines,'.ca')
-
-	low_thresh = (takeClosest(low_thresh/1000,line_times) * 1000)
-	ol = low_thresh
-	if low_thresh > orig_low:
-		low_thresh = line_times[line_times.index(low_thresh/1000) - 1] * 1000
-		if low_thresh > orig_low:
-			low_thresh = ol
-	high_thresh =  (takeClosest(high_thresh/1000,line_times) * 1000)
-	if high_thresh < orig_high:
-		if (line_times.index(high_thresh/1000) + 1) < len(line_times):
-			high_thresh = line_times[line_times.index(high_thresh/1000) + 1] * 1000
-
-	print(low_thresh,high_thresh)
-
-
-	piece = audio[low_thresh:high_thresh]
-
-	high_thresh = int(high_thresh)
-	low_thresh = int(low_thresh)
-
-	piece_name = audio_file[0:audio_file.rfind('.')] + "-"+ str(int(low_thresh)) +"-" + str(int(high_thresh)) + ".wav"
-	piece.export(os.path.join(out_dir_name,piece_name), format="wav")
-	return piece_name,audio.duration_seconds
-
+# Function that returns the name of the audio slice of a window.
+def clip_name(audio_filename,window):
+	low_thresh,high_thresh = window.low_thresh,window.high_thresh
+	audio_file = os.path.basename(audio_filename)
+	return audio_file[0:audio_file.rfind('.')] + "-"+ str(int(low_thresh)) +"-" + str(int(high_thresh)) + ".wav"
+
+# Function that slices the audio for a window returned by resolve_windows.
+# The audio is a WavSource that is opened once and shared by all slices.
+def slice_audio(audio,window,out_dir_name):
+	print(window.low_thresh,window.high_thresh)
+
+	piece_name = clip_name(audio.filename,window)
+	# Copying the samples straight from the recording without decoding it.
+	audio.export_frames(window.start_frame,window.end_frame,
+		os.path.join(out_dir_name,piece_name))
+	return piece_name
+
+# Function that exports the audio slices and transcript excerpts of all the
+# windows concurrently (see clip_export.ExportPipeline): the audio range and
+# the excerpt of each clip are prepared on one thread while the files of the
+# previous clips are written by a pool of threads.
+# If on_clip is given, it is called with the audio slice and transcript
+# excerpt names of every clip as soon as it is written. Otherwise a progress
+# bar is shown if progress is True (the OIRP.py command line).
+# If archive is one of ARCHIVE_FORMATS, the clips are written one after the
+# other into a single archive with a manifest (see clip_archive) instead of
+# separate files; the names are then those of the clips in the archive.
+# Separate files are recorded in the journal of the output directory (see
+# clip_journal) and only written if they are missing, damaged or made from
+# different parameters. If collect is True the windows are all those of the
+# recording in the output directory (a complete run of OIRP.py), and the
+# files of the recording that are no longer produced are removed. Other
+# callers (the service, the corpus index) leave the files of earlier runs.
+# shared maps the names of audio slices of the recording already written (by
+# other queries on the same recording) to their (path, size, checksum); they
+# are linked instead of being read and written again, and the audio slices
+# written are added to it.
+# Output -> Lists of the audio slice and transcript excerpt names, in the
+#			order of the windows.
+def export_clips(audio,index,windows,form,keywords,found_lines,out_dir_name,
+	threads=EXPORT_THREADS,metrics=NO_METRICS,on_clip=None,archive=None,
+	trans_file=None,verify=False,collect=False,shared=None,progress=False):
+	hit_lines = set(found_lines)
+	audio_file = os.path.basename(audio.filename)
+	writer,manifest_file = open_writer(archive,out_dir_name,
+		audio_file[:audio_file.rfind('.')],audio)
+	manifest = []
+	journal = None
+	if archive is not None:
+		# The archive is written sequentially, in the order of the windows.
+		threads = 1
+		matcher = KeywordMatcher(keywords)
+	else:
+		journal = ClipJournal(out_dir_name,verify)
+		source = os.path.abspath(audio.filename)
+		stat = os.stat(audio.filename)
+		if shared is None:
+			shared = {}
+
+	def prepare(window):
+		name = clip_name(audio.filename,window)
+		params = None
+		chunks = None
+		link = None
+		if journal is not None:
+			params = {'audio_size': stat.st_size, 'audio_mtime': stat.st_mtime,
+				'start_frame': window.start_frame, 'end_frame': window.end_frame}
+		if journal is not None and journal.is_done(name,source,params):
+			pass
+		elif journal is not None and name in shared:
+			link = shared[name]
+		else:
+			with metrics.stage('audio read'):
+				chunks = audio.read_frames(window.start_frame,window.end_frame)
+			metrics.count('audio_bytes_read',len(chunks[1]))
+		excerpt = None
+		if (form == '.ca' or form == '.cha'):
+			with metrics.stage('transcript format'):
+				excerpt = format_excerpt(index,window,name,keywords,hit_lines)
+			if (journal is not None and journal.is_done(excerpt[0],source,None,
+				checksum([excerpt[1]]))):
+				excerpt = excerpt[0],None
+		entry = None
+		if archive is not None:
+			# Keywords found in the lines with keywords of the clip.
+			found = set()
+			for line in index.lines[window.first_line:window.end_line]:
+				if line in hit_lines:
+					found.update(matcher.match(line)[0])
+			entry = {'audio': name,
+				'transcript': None if excerpt is None else excerpt[0],
+				'low_ms': window.low_thresh, 'high_ms': window.high_thresh,
+				'first_line': window.first_line, 'end_line': window.end_line,
+				'keywords': [keywords[i] for i in sorted(found)]}
+		return name,params,chunks,link,excerpt,entry
+
+	def write(clip):
+		name,params,chunks,link,excerpt,entry = clip
+		metrics.count('clips')
+		if (link is None and chunks is None and
+			(excerpt is None or excerpt[1] is None)):
+			# Everything of the clip was already written.
+			metrics.count('clips_kept')
+		if link is not None:
+			with metrics.stage('audio export'):
+				writer.add_link(name,link[0])
+			metrics.count('audio_files_linked')
+			journal.record(name,source,params,link[1],link[2])
+		elif chunks is None:
+			metrics.count('audio_files_kept')
+			kept = journal.entries[name]
+			shared[name] = (os.path.join(out_dir_name,name),kept['size'],
+				kept['crc32'])
+		else:
+			with metrics.stage('audio export'):
+				location = writer.add_audio(name,chunks)
+			size = sum(len(x) for x in chunks)
+			metrics.count('audio_bytes_written',size)
+			if journal is not None:
+				crc = checksum(chunks)
+				journal.record(name,source,params,size,crc)
+				shared[name] = (os.path.join(out_dir_name,name),size,crc)
+			if entry is not None:
+				entry['audio_offset'],entry['audio_size'] = location
+				manifest.append(entry)
+		if excerpt is None:
+			return name,None
+		if excerpt[1] is None:
+			metrics.count('transcript_files_kept')
+			return name,excerpt[0]
+		with metrics.stage('transcript write'):
+			location = writer.add_text(excerpt[0],excerpt[1])
+		metrics.count('transcript_bytes_written',len(excerpt[1]))
+		if journal is not None:
+			journal.record(excerpt[0],source,None,len(excerpt[1]),
+				checksum([excerpt[1]]))
+		if entry is not None:
+			entry['transcript_offset'],entry['transcript_size'] = location
+		return name,excerpt[0]
+
+	try:
+		if on_clip is not None:
+			clips = ExportPipeline(prepare,write,threads).run(windows,
+				done=lambda i,clip: on_clip(*clip))
+		elif progress:
+			widgets = ['Extracting clips: ', SimpleProgress(), ' ', Percentage(),
+				' ', Bar(marker=RotatingMarker()), ' ', ETA()]
+			pbar = ProgressBar(widgets=widgets, maxval=max(1,len(windows))).start()
+			clips = ExportPipeline(prepare,write,threads).run(windows,pbar.update)
+			pbar.finish()
+		else:
+			clips = ExportPipeline(prepare,write,threads).run(windows)
+		slice_names = [name for name,trans_name in clips]
+		trans_names = [trans_name for name,trans_name in clips
+			if trans_name is not None]
+		if journal is not None and collect:
+			with metrics.stage('orphan removal'):
+				removed = journal.collect(source,set(slice_names + trans_names))
+			metrics.count('files_removed',len(removed))
+	finally:
+		writer.close()
+		if journal is not None:
+			# Nothing else writes to the directory during a complete run, so
+			# its journal can be compacted.
+			journal.close(compact=collect)
+	if manifest_file is not None:
+		write_manifest(manifest_file,archive,writer,audio.filename,trans_file,
+			manifest)
+	return slice_names,trans_names
 
 # Function that removes all the times which overlap to within a certain 
 # threshold so as not to generate redundant transcripts.
+# The times are sorted and swept once: a time is kept if it is more than
+# thresh after the last time kept, so the result does not depend on the
+# order of the input.
 def rem_redundant_times(times,thresh):
-	rem_times = []
-	#print(times)
-	new_times = []
-	while(True):
-		if (len(times) == 0):
-			break
-		curr_time = times[0]
-		if not (curr_time in rem_times):
-			new_times.append(curr_time)
-			for time in times:
-				if abs(float(time) - float(curr_time)) == 0:
-					continue
-				elif abs(float(time) - float(curr_time)) > thresh:
-					new_times.append(time)
-					#print("new_time {}".format(new_times))
-				elif abs(float(time) - float(curr_time)) <= thresh:
-					rem_times.append(time)
-					#print("rem_time {}".format(rem_times))
-					if (time in new_times):
-						new_times.remove(time)
-			for time in rem_times:
-				times.remove(time)
-				rem_times = []
-		times.pop(0)
-		#print("time {}".format(times))
-	#print(new_times)
 	final = []
-	for i in new_times:
-		if i not in final:
-			final.append(i)
+	for time in sorted(float(x) for x in times):
+		if len(final) == 0 or time - final[-1] > thresh:
+			final.append(time)
 	return final
 
 # Function that prints output prompt
@@ -344,8 +519,9 @@ def output_prompt(slice_names,trans_names,found_lines,keywords,keywords_dict,
 	print('\tTotal number of turns in the transcript: {}'.format(num_turns_total))
 	print('\tTotal number of turns with specified keywords: {}'.
 		format(len(found_lines)))
-	percentage_found = round((float(len(found_lines))/float(num_turns_total))*100,3)
-	print('\tHit-rate for keywords in transcript: {}%'.format(percentage_found))
+	if num_turns_total > 0:
+		percentage_found = round((float(len(found_lines))/float(num_turns_total))*100,3)
+		print('\tHit-rate for keywords in transcript: {}%'.format(percentage_found))
 	for word in keywords:
 		print("\tNumber of turns containing {}: {}".
 			format(word,keywords_dict[word]))
@@ -353,6 +529,383 @@ def output_prompt(slice_names,trans_names,found_lines,keywords,keywords_dict,
 	print(colored("Gailbot Extraction Tool\n"
 		"Powered by: Human Interaction Lab - Tufts University\n",'red'))
 
+# Function that verifies a configuration for the OIR search.
+# Raises a ValueError describing the first problem found.
+def check_config(config):
+	# Ensuring we have the correct extraction mode
+	extraction_mode = config['extraction_mode'].lower()
+	if extraction_mode != "solo" and extraction_mode != 'in_line':
+		raise ValueError("Incorrect extraction mode specified")
+	if (len(config["OIRs"]) == 0):
+		raise ValueError("No keywords specified")
+	if (config["time_thresh"] < 0):
+		raise ValueError("Negative time closeness threshold specified")
+	if (config.get('export_threads',EXPORT_THREADS) < 1):
+		raise ValueError("The number of export threads must be at least 1")
+	if (config.get('archive') is not None and
+		config['archive'] not in ARCHIVE_FORMATS):
+		raise ValueError("Incorrect archive format specified (must be one of"
+			" {})".format(", ".join(ARCHIVE_FORMATS)))
+	name = config.get('name')
+	if (name is not None and (name in ('','.','..') or '/' in name or
+		os.sep in name)):
+		raise ValueError("Incorrect query name specified: {}".format(name))
+
+# Function that verifies every query of a configuration file.
+def check_configs(configs):
+	if (len(configs) == 0):
+		raise ValueError("No configuration specified")
+	for config in configs:
+		check_config(config)
+	names = [query_name(configs,i) for i in range(len(configs))]
+	if (len(set(names)) != len(names)):
+		raise ValueError("Query names must be different")
+
+# Function that returns the name of a query of a configuration file, used
+# for its results directory: its "name" setting or query-N.
+def query_name(configs,i):
+	return configs[i].get('name','query-{}'.format(i + 1))
+
+# Function that extracts the audio and transcript around keyword hits.
+# Inputs -> The lines of the transcript, the turns and lines with keywords
+#			(as returned by search_keywords), the audio filename, the
+#			configuration, the transcript format, the output directory (by
+#			default next to the audio) and the Metrics the stages are
+#			recorded in.
+#			An already opened WavSource of the audio and TranscriptIndex of
+#			the lines can be passed to reuse them (they are not closed), and
+#			on_clip, shared, collect and progress are passed to
+#			export_clips. The
+#			transcript filename is recorded in the manifest of archives.
+# Output -> The output directory and the names of the audio slices and
+#			transcript excerpts.
+def extract_hits(all_lines,found_lines,ind_lines,audio_file,config,form,
+	out_dir_name=None,metrics=NO_METRICS,audio=None,index=None,on_clip=None,
+	trans_file=None,shared=None,collect=False,progress=False):
+	keywords = config["OIRs"]
+	time_thresh = config["time_thresh"]
+
+	# Extracting times for the keywords found
+	with metrics.stage('time extraction'):
+		times = extract_times(found_lines,form)
+	metrics.count('times',len(times))
+
+	slice_names = []
+	trans_names = []
+	# Only extract timing details are found.
+	if (len(times) > 0):
+		# Removing times from list that are close to each other (as defined 
+		# in the configurations to avoid redundant audio and transcript extractions)
+		with metrics.stage('redundancy removal'):
+			times = rem_redundant_times(times,time_thresh)
+		metrics.count('times_kept',len(times))
+		print(times)
+
+		# Generating output directory name
+		if out_dir_name is None:
+			out_dir_name = audio_file[:audio_file.rfind('.')] +'-results'
+		if not os.path.exists(out_dir_name):
+			os.makedirs(out_dir_name)
+
+		# Opening the recording and parsing the transcript once for all the
+		# clips.
+		opened = audio is None
+		if opened:
+			with metrics.stage('audio open'):
+				audio = WavSource(audio_file)
+		try:
+			with metrics.stage('window resolution'):
+				if index is None:
+					index = TranscriptIndex(all_lines)
+				windows = resolve_windows(index,times,config['time_range'],
+					audio,config.get('merge_windows',False))
+			metrics.count('windows',len(windows))
+			print('\n')
+			# Extracting the audio and the transcript for all the windows.
+			with metrics.stage('export'):
+				slice_names,trans_names = export_clips(audio,index,windows,
+					form,keywords,ind_lines,out_dir_name,
+					config.get('export_threads',EXPORT_THREADS),metrics,on_clip,
+					config.get('archive'),trans_file,
+					config.get('verify_clips',False),collect,shared,progress)
+		finally:
+			if opened:
+				audio.close()
+
+	return out_dir_name,slice_names,trans_names
+
+# Function that reads a transcript file into a list of lines.
+def read_transcript(trans_file):
+	with io.open(trans_file, "r",encoding="utf-8") as txt_file:
+		return txt_file.readlines()
+
+# Function that runs the complete extraction for one session.
+# Inputs -> The transcript and audio filenames, the configuration for the
+#			OIR search and the output directory (by default next to the audio).
+#			The Metrics the stages are recorded in and whether the progress
+#			of the export is shown.
+# Output -> Dictionary with the extraction results and the statistics used
+#			by output_prompt.
+def run_session(trans_file,audio_file,config,out_dir_name=None,
+	metrics=NO_METRICS,progress=False):
+	keywords = config["OIRs"]
+	extraction_mode = config['extraction_mode'].lower()
+	form = trans_file[trans_file.rfind('.'):]
+
+	# Searching keywords in the file while it is read turn by turn.
+	# Last argument is the mode. Must be either solo for keyword to be alone in
+	# the turn or in_line for keyword to be present in bigger TCU.
+	with metrics.stage('search'):
+		with io.open(trans_file, "r",encoding="utf-8") as txt_file:
+			found_lines,ind_lines,keywords_dict,num_lines,num_turns = \
+				search_turns(read_turns(txt_file),keywords,extraction_mode)
+	metrics.count('lines_scanned',num_lines)
+	metrics.count('keyword_hits',len(found_lines))
+
+	# The lines of the transcript are only needed to extract the excerpts
+	# around the keywords. With the turn cache they are only read for the
+	# excerpts. Loading the cached index takes the place of reading the
+	# transcript; the windows are resolved in extract_hits.
+	all_lines = []
+	index = None
+	if len(found_lines) > 0 and config.get('turn_cache',False):
+		with metrics.stage('transcript read'):
+			index = cached_index(trans_file)
+		all_lines = index.lines
+	elif len(found_lines) > 0:
+		with metrics.stage('transcript read'):
+			all_lines = read_transcript(trans_file)
+
+	try:
+		out_dir_name,slice_names,trans_names = extract_hits(all_lines,
+			found_lines,ind_lines,audio_file,config,form,out_dir_name,metrics,
+			index=index,trans_file=trans_file,collect=True,progress=progress)
+	finally:
+		if index is not None:
+			index.close()
+
+	return {'transcript': trans_file, 'audio': audio_file,
+		'output': out_dir_name, 'slice_names': slice_names,
+		'trans_names': trans_names, 'found_lines': found_lines,
+		'keywords': keywords, 'keywords_dict': keywords_dict,
+		'num_turns_total': num_turns}
+
+# Function that runs every query of a configuration file on one session.
+# The transcript is read and parsed and the recording opened only once for
+# all the queries, and the audio slices that several queries extract are
+# only read and written once (see export_clips).
+# With a single query this is run_session. Otherwise the results of every
+# query are written to a directory named after it in the output directory.
+# Inputs -> The transcript and audio filenames, the list of configurations,
+#			the output directory (by default next to the audio) and the
+#			Metrics the stages of all the queries are recorded in and whether
+#			the progress of the export is shown.
+# Output -> List of the results of every query, as returned by run_session
+#			(with the name of the query).
+def run_queries(trans_file,audio_file,configs,out_dir_name=None,
+	metrics=NO_METRICS,progress=False):
+	if len(configs) == 1:
+		return [run_session(trans_file,audio_file,configs[0],out_dir_name,
+			metrics,progress)]
+	form = trans_file[trans_file.rfind('.'):]
+	if out_dir_name is None:
+		out_dir_name = audio_file[:audio_file.rfind('.')] +'-results'
+
+	with metrics.stage('transcript read'):
+		all_lines = read_transcript(trans_file)
+	with metrics.stage('window resolution'):
+		if any(config.get('turn_cache',False) for config in configs):
+			index = cached_index(trans_file,all_lines)
+		else:
+			index = TranscriptIndex(all_lines)
+	with metrics.stage('audio open'):
+		audio = WavSource(audio_file)
+	# Audio slices written so far, shared by the queries.
+	shared = {}
+	results = []
+	try:
+		for i,config in enumerate(configs):
+			keywords = config["OIRs"]
+			with metrics.stage('search'):
+				found_lines,ind_lines,keywords_dict,num_lines,num_turns = \
+					search_turns(read_turns(all_lines),keywords,
+						config['extraction_mode'].lower())
+			metrics.count('lines_scanned',num_lines)
+			metrics.count('keyword_hits',len(found_lines))
+			name = query_name(configs,i)
+			query_dir,slice_names,trans_names = extract_hits(all_lines,
+				found_lines,ind_lines,audio_file,config,form,
+				os.path.join(out_dir_name,name),metrics,audio,index,
+				trans_file=trans_file,shared=shared,collect=True,
+				progress=progress)
+			results.append({'query': name, 'transcript': trans_file,
+				'audio': audio_file, 'output': query_dir,
+				'slice_names': slice_names, 'trans_names': trans_names,
+				'found_lines': found_lines, 'keywords': keywords,
+				'keywords_dict': keywords_dict, 'num_turns_total': num_turns})
+	finally:
+		audio.close()
+	return results
+
+# Function that reads a batch manifest.
+# The manifest is either a CSV file with the columns transcript, audio and
+# (optionally) output, or a JSON list of objects with the same keys.
+# Relative paths are taken relative to the directory of the manifest.
+# Output -> List of (transcript, audio, output) triples. Output is None when
+#			the default output directory should be used.
+def read_manifest(filename):
+	base = os.path.dirname(filename)
+	entries = []
+	if check_extension(filename,'json'):
+		for item in read_json(filename):
+			entries.append((item['transcript'],item['audio'],item.get('output')))
+	else:
+		with open(filename,'r') as f:
+			for row in csv.reader(f):
+				row = [x.strip() for x in row]
+				if len(row) == 0 or row[0] == '' or row[0].startswith('#'):
+					continue
+				if row[0].lower() == 'transcript':
+					continue
+				if len(row) < 2:
+					raise ValueError("Manifest row needs a transcript and audio file:"
+						" {}".format(",".join(row)))
+				output = row[2] if len(row) > 2 and row[2] != '' else None
+				entries.append((row[0],row[1],output))
+	sessions = []
+	for trans_file,audio_file,output in entries:
+		trans_file = os.path.join(base,trans_file)
+		audio_file = os.path.join(base,audio_file)
+		if output is not None:
+			output = os.path.join(base,output)
+		sessions.append((trans_file,audio_file,output))
+	return sessions
+
+# Function that returns the names of the audio files that can go with a
+# transcript: X.wav for X.ca, and X.S.wav or X.wav for X.S.ca.
+def audio_candidates(trans_name):
+	name = trans_name[:trans_name.rfind('.')]
+	candidates = [name + '.wav']
+	if name.endswith('.S'):
+		candidates.append(name[:-2] + '.wav')
+	return candidates
+
+# Function that walks a directory of sessions like os.walk, in sorted order,
+# without going into the output directories of extractions (the
+# <audio>-results directories and any directory with a clip journal): the
+# excerpts and audio slices in them would be taken for sessions.
+# Output -> Generator of (directory, filenames) pairs.
+def walk_sessions(dir_name):
+	for root, dirs, files in os.walk(dir_name):
+		dirs[:] = [name for name in sorted(dirs) if not name.endswith('-results')
+			and not os.path.isfile(os.path.join(root,name,JOURNAL_FILE))]
+		yield root, files
+
+# Function that pairs every .ca transcript in a directory with the .wav file
+# of the same name (ignoring a trailing .S in the transcript name).
+# Output -> List of (transcript, audio, output) triples.
+def pair_directory(dir_name):
+	sessions = []
+	for root, files in walk_sessions(dir_name):
+		for file in sorted(files):
+			if not check_extension(file,'ca'):
+				continue
+			for audio in audio_candidates(file):
+				if audio in files:
+					sessions.append((os.path.join(root,file),
+						os.path.join(root,audio),None))
+					break
+			else:
+				print("WARNING: No audio found for {}".format(
+					os.path.join(root,file)))
+	return sessions
+
+# Function that silences a batch worker so that sessions running at the
+# same time do not interleave their output.
+def init_batch_worker():
+	devnull = open(os.devnull,'w')
+	sys.stdout = devnull
+	sys.stderr = devnull
+
+# Function that runs one session of a batch in a worker process.
+# Any failure is caught and returned so that it only affects that session.
+# The result holds the results of every query (see run_queries) and the
+# metrics of the session if record_metrics is True.
+def run_batch_session(job):
+	trans_file,audio_file,output,configs,record_metrics = job
+	try:
+		for filename in (trans_file,audio_file):
+			if not file_exists(filename):
+				raise IOError("File does not exist: {}".format(filename))
+		metrics = Metrics() if record_metrics else NO_METRICS
+		queries = run_queries(trans_file,audio_file,configs,output,metrics)
+		for result in queries:
+			# The turns themselves are not needed for the summary.
+			result['num_found'] = len(result.pop('found_lines'))
+		return {'transcript': trans_file, 'audio': audio_file,
+			'output': output, 'queries': queries,
+			'metrics': metrics.to_dict()},None
+	except Exception:
+		return {'transcript': trans_file, 'audio': audio_file,
+			'output': output},traceback.format_exc()
+
+# Function that runs all the queries of a configuration file on all the
+# sessions of a batch on a pool of processes.
+# Output -> List of (result, error) pairs in the order of the sessions.
+def run_batch(sessions,configs,jobs=None,record_metrics=False):
+	work = [(trans_file,audio_file,output,configs,record_metrics)
+		for trans_file,audio_file,output in sessions]
+	pool = multiprocessing.Pool(processes=jobs,initializer=init_batch_worker)
+	try:
+		results = []
+		for i,result in enumerate(pool.imap(run_batch_session,work)):
+			status = 'FAILED' if result[1] is not None else 'done'
+			print("[{}/{}] {}: {}".format(i+1,len(work),status,result[0]['transcript']))
+			results.append(result)
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
+# Function that prints the aggregate statistics for a batch.
+# Uses the same statistics as output_prompt, summed over all the sessions.
+def batch_summary(results,keywords):
+	print(colored("\nGailbot Extraction Tool\n"
+		"Powered by: Human Interaction Lab - Tufts University\n",'red'))
+	print("Keywords Specified: {}\n".format(" ,".join(keywords)))
+	succeeded = [result for result,error in results if error is None]
+	failed = [(result,error) for result,error in results if error is not None]
+	print("Per session statistics...\n")
+	for result in succeeded:
+		print("\t{}: {} turns, {} with keywords, {} slices".format(
+			result['transcript'],result['num_turns_total'],result['num_found'],
+			len(result['slice_names'])))
+	if len(failed) > 0:
+		print("\nThe following sessions failed...\n")
+		for result,error in failed:
+			print("\t{}".format(result['transcript']))
+			print("\t\t" + error.strip().replace('\n','\n\t\t'))
+	num_turns_total = sum(result['num_turns_total'] for result in succeeded)
+	num_found = sum(result['num_found'] for result in succeeded)
+	print("\nBasic statistics...\n")
+	print('\tTotal number of sessions: {}'.format(len(results)))
+	print('\tTotal number of failed sessions: {}'.format(len(failed)))
+	print('\tTotal number of transcripts generated: {}'.format(
+		sum(len(result['trans_names']) for result in succeeded)))
+	print('\tTotal number of audio files generated: {}'.format(
+		sum(len(result['slice_names']) for result in succeeded)))
+	print('\tTotal number of turns in the transcripts: {}'.format(num_turns_total))
+	print('\tTotal number of turns with specified keywords: {}'.format(num_found))
+	if num_turns_total > 0:
+		percentage_found = round((float(num_found)/float(num_turns_total))*100,3)
+		print('\tHit-rate for keywords in transcripts: {}%'.format(percentage_found))
+	for word in keywords:
+		print("\tNumber of turns containing {}: {}".format(word,
+			sum(result['keywords_dict'][word] for result in succeeded)))
+	print(colored("\nThank you for using",'red'))
+	print(colored("Gailbot Extraction Tool\n"
+		"Powered by: Human Interaction Lab - Tufts University\n",'red'))
+
 if __name__ == '__main__':
 	
 	# Parsing the input arguments
@@ -360,103 +913,106 @@ if __name__ == '__main__':
 		description = "Client to extract audio and text for specific OIR's in" 
 				" a transcript")
 	parser.add_argument(
-		'-transcript', action = 'store', dest = 'trans_file', required = True)
+		'-transcript', action = 'store', dest = 'trans_file', required = False)
 	parser.add_argument(
 		'-config', action = 'store', dest = 'config_file', required = True)
 	parser.add_argument(
-		'-audio', action = 'store', dest = 'audio_file', required = True)
+		'-audio', action = 'store', dest = 'audio_file', required = False)
+	parser.add_argument(
+		'-manifest', action = 'store', dest = 'manifest_file', required = False,
+		help = 'CSV or JSON list of transcript/audio/output triples to process'
+			' in batch mode')
+	parser.add_argument(
+		'-directory', action = 'store', dest = 'in_direc', required = False,
+		help = 'directory of .ca transcripts paired with .wav files of the'
+			' same name to process in batch mode')
+	parser.add_argument(
+		'-jobs', action = 'store', dest = 'jobs', type = int, default = None,
+		help = 'number of sessions processed in parallel in batch mode'
+			' (default: number of cores)')
+	parser.add_argument(
+		'-metrics', '--metrics', action = 'store', dest = 'metrics_file',
+		default = None, help = 'JSON file the time spent in each stage and'
+			' the counters of the run are written to')
 	args = parser.parse_args()
 
+	batch = args.manifest_file != None or args.in_direc != None
+	if not batch and (args.trans_file == None or args.audio_file == None):
+		parser.error("either -transcript and -audio, -manifest or -directory"
+			" is required")
 
 	# Checking if the files exist
-	if (not file_exists(args.trans_file) or 
-		not file_exists(args.config_file) or 
-		not file_exists(args.audio_file)):
+	if (not file_exists(args.config_file) or
+		(args.manifest_file != None and not file_exists(args.manifest_file)) or
+		(args.in_direc != None and not os.path.isdir(args.in_direc)) or
+		(not batch and (not file_exists(args.trans_file) or
+			not file_exists(args.audio_file)))):
 		print("File does not exist\nExiting...")
 		sys.exit()
 
 	# Checking the correct file extensions
-	if ( not check_extension(args.trans_file,'ca')):
+	if ( not batch and not check_extension(args.trans_file,'ca')):
 		print('ERROR: Check .ca file extension\nExiting...')
 		sys.exit()
 	if ( not check_extension(args.config_file,'json')):
 		print('ERROR: Check .json file extension\nExiting...')
 		sys.exit()
-	if ( not check_extension(args.audio_file,'wav')):
+	if ( not batch and not check_extension(args.audio_file,'wav')):
 		print('ERROR: Check .wav file extension\nExiting...')
 		sys.exit()
-
-	# Getting the configuration for the OIR search
-	configs = read_json(args.config_file)
-	keywords = configs[0]["OIRs"]
-	time_thresh = configs[0]["time_thresh"]
-	extraction_mode = configs[0]['extraction_mode'].lower()
-
-	# Ensuring we have the correct extraction mode
-	if extraction_mode.lower() != "solo" and extraction_mode.lower() != 'in_line':
-		print("ERROR: Incorrect extraction mode specified\nExiting...")
-		sys.exit()
-
-	if (len(keywords) == 0):
-		print("ERROR: No keywords specified\nExiting...")
-		sys.exit()
-	if (time_thresh < 0):
-		print("ERROR: Negative time closeness threshold specified\nExiting...")
-		sys.exit()
-
-	# Reading the transcript file into a list of strings.
-	txt_file = io.open(args.trans_file, "r",encoding="utf-8")
-	all_lines = txt_file.readlines()
-	if (all_lines == None):
-		print("ERROR: File is empty\nExiting...")
+	if (args.jobs != None and args.jobs < 1):
+		print('ERROR: The number of jobs must be at least 1\nExiting...')
 		sys.exit()
 
-	# Searching keywords in the file
-	# Last argument is the mode. Must be either solo for keyword to be alone in
-	# the turn or in_line for keyword to be present in bigger TCU.
-	found_lines,ind_lines, keywords_dict = search_keywords(all_lines,keywords,
-		args.trans_file[args.trans_file.rfind('.'):],extraction_mode)
-	if (found_lines == None):
-		print("ERROR: No OIR's found in file\nExiting...")
+	# Getting the configuration for the OIR search. Every entry of the
+	# configuration file is a query.
+	configs = read_json(args.config_file)
+	try:
+		check_configs(configs)
+	except ValueError as e:
+		print("ERROR: {}\nExiting...".format(e))
 		sys.exit()
 
-	# Extracting times for the keywords found
-	times = extract_times(found_lines,
-		args.trans_file[args.trans_file.rfind('.'):])
-
-	# Only extract timing details are found.
-	if (len(times) > 0):
-		# Removing times from list that are close to each other (as defined 
-		# in the configurations to avoid redundant audio and transcript extractions)
-		times = rem_redundant_times(times,time_thresh)
-		print(times)
-
-		# Generating output directory name
-		out_dir_name = args.audio_file[:args.audio_file.rfind('.')] +'-results'
-		if not os.path.exists(out_dir_name):
-			os.makedirs(out_dir_name)
-
-		# Extracting audio for all the times and getting the names of all slices
-		slice_names = []
-		widgets = ['Slicing Audio: ', Percentage(), ' ', Bar(marker=RotatingMarker()),
-			' ', ETA(), ' ', FileTransferSpeed()]
-		pbar = ProgressBar(widgets=widgets, maxval=10000000)
-		print('\n')
-		for time in pbar(times):
-			name,audio_duration = slice_audio(args.audio_file,time,
-				configs[0]['time_range'],all_lines,out_dir_name)
-			slice_names.append(name)
-
-		# Extracting the transcript for all the audio chunks
-		trans_names = extract_transcript(all_lines,times,slice_names,configs[0]['time_range'],
-			audio_duration,args.trans_file[args.trans_file.rfind('.'):],
-			keywords,ind_lines,out_dir_name)
+	if batch:
+		# Collecting the sessions to process.
+		sessions = []
+		try:
+			if args.manifest_file != None:
+				sessions += read_manifest(args.manifest_file)
+			if args.in_direc != None:
+				sessions += pair_directory(args.in_direc)
+		except (ValueError,KeyError) as e:
+			print("ERROR: Invalid manifest: {}\nExiting...".format(e))
+			sys.exit()
+		if len(sessions) == 0:
+			print("ERROR: No sessions to process\nExiting...")
+			sys.exit()
+		metrics = Metrics()
+		results = run_batch(sessions,configs,args.jobs,
+			args.metrics_file != None)
+		for i,config in enumerate(configs):
+			if len(configs) > 1:
+				print("\nQuery: {}".format(query_name(configs,i)))
+			batch_summary([(result['queries'][i] if error is None else result,
+				error) for result,error in results],config["OIRs"])
+		if args.metrics_file != None:
+			files = [(result['transcript'],result['metrics'])
+				for result,error in results if error is None]
+			# The stages and counters of the run are those of its sessions.
+			for trans_file,session_metrics in files:
+				metrics.add(session_metrics)
+			write_metrics(args.metrics_file,metrics.to_dict(),files)
 	else:
-		slice_names = []
-		trans_names = []
-
-
-	# Printing the output prompt and extraction information.
-	output_prompt(slice_names,trans_names,found_lines,keywords,keywords_dict,
-		len(all_lines))
-
+		metrics = Metrics() if args.metrics_file != None else NO_METRICS
+		results = run_queries(args.trans_file,args.audio_file,configs,
+			metrics=metrics,progress=True)
+		if args.metrics_file != None:
+			write_metrics(args.metrics_file,metrics.to_dict())
+
+		# Printing the output prompt and extraction information.
+		for result in results:
+			if len(results) > 1:
+				print("\nQuery: {} ({})".format(result['query'],result['output']))
+			output_prompt(result['slice_names'],result['trans_names'],
+				result['found_lines'],result['keywords'],result['keywords_dict'],
+				result['num_turns_total'])
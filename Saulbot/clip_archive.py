@@ -0,0 +1,268 @@
+'''
+	Packed output for Saulbot clips.
+
+	By default every clip is written as two files in the results directory
+	(the audio slice and its .S.ca transcript excerpt). With the "archive"
+	setting all the clips of a run are instead streamed into one file, as
+	they are exported:
+
+		zip		a zip archive (stored, not compressed) of the usual files
+		tar		a tar archive of the usual files
+		wav		one WAV file with the audio of every clip one after the other,
+				and one text file with the transcript excerpts
+
+	Next to the archive, a JSON manifest lists every clip with its time
+	range, transcript line range, keywords and the byte ranges of its audio
+	samples and transcript excerpt in the archive. The members of zip and
+	tar archives are ordinary files; clips of any format can also be
+	extracted one by one from the manifest:
+
+		python clip_archive.py -manifest a-clips.json [-clip name ...]
+			-output [Directory]
+'''
+
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+import zipfile
+
+from wav_source import WavSource
+
+ARCHIVE_FORMATS = ('zip', 'tar', 'wav')
+
+# Largest data chunk of a WAV file.
+MAX_WAV_DATA = 0xFFFFFFFF
+
+
+class DirectoryWriter(object):
+
+	def __init__(self, dir_name):
+		self.dir_name = dir_name
+
+	# Function that writes a file from a list of byte strings.
+	# Output -> (offset, size) of the data in the output (None for files).
+	def add_audio(self, name, chunks):
+		with open(os.path.join(self.dir_name, name), 'wb') as f:
+			for chunk in chunks:
+				f.write(chunk)
+		return None
+
+	def add_text(self, name, data):
+		return self.add_audio(name, [data])
+
+	# Function that writes a file with the same contents as an existing one,
+	# as a hard link when the file system allows it.
+	def add_link(self, name, path):
+		target = os.path.join(self.dir_name, name)
+		if os.path.exists(target):
+			os.remove(target)
+		try:
+			os.link(path, target)
+		except (AttributeError, OSError):
+			shutil.copyfile(path, target)
+		return None
+
+	def close(self):
+		pass
+
+
+class ZipWriter(object):
+
+	def __init__(self, filename):
+		self.filename = filename
+		# The members are stored so that they can be read straight from the
+		# archive by byte range.
+		self._zip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED,
+			allowZip64=True)
+
+	def add_audio(self, name, chunks):
+		info = zipfile.ZipInfo(name, time.localtime()[:6])
+		info.external_attr = 0o644 << 16
+		self._zip.writestr(info, b''.join(chunks))
+		# The stored data ends where the archive ends.
+		return self._zip.fp.tell() - info.compress_size, info.file_size
+
+	def add_text(self, name, data):
+		return self.add_audio(name, [data])
+
+	def close(self):
+		self._zip.close()
+
+
+class TarWriter(object):
+
+	def __init__(self, filename):
+		self.filename = filename
+		self._tar = tarfile.open(filename, 'w')
+
+	def add_audio(self, name, chunks):
+		data = b''.join(chunks)
+		info = tarfile.TarInfo(name)
+		info.size = len(data)
+		info.mtime = int(time.time())
+		info.mode = 0o644
+		self._tar.addfile(info, io.BytesIO(data))
+		# The data is padded to whole blocks at the end of the archive.
+		blocks = -(-info.size // tarfile.BLOCKSIZE)
+		return self._tar.offset - blocks * tarfile.BLOCKSIZE, info.size
+
+	def add_text(self, name, data):
+		return self.add_audio(name, [data])
+
+	def close(self):
+		self._tar.close()
+
+
+class WavWriter(object):
+
+	# Inputs -> Filename of the packed WAV, filename of the text file the
+	#			transcript excerpts are written to and the WavSource the clips
+	#			are taken from (for the format of the packed WAV).
+	def __init__(self, filename, text_filename, audio):
+		self.filename = filename
+		self.text_filename = text_filename
+		self._audio = audio
+		self._header_size = len(audio.wav_header(0))
+		self._data_size = 0
+		self._wav = open(filename, 'wb')
+		# The header is written again with the final size at the end.
+		self._wav.write(audio.wav_header(0))
+		self._text = open(text_filename, 'wb')
+
+	# Only the samples of the clip are appended (without its header).
+	def add_audio(self, name, chunks):
+		data = chunks[1]
+		if self._data_size + len(data) > MAX_WAV_DATA:
+			raise ValueError("The packed WAV file would be larger than 4 GB,"
+				" use the zip or tar archive instead")
+		offset = self._header_size + self._data_size
+		self._wav.write(data)
+		self._data_size += len(data)
+		return offset, len(data)
+
+	def add_text(self, name, data):
+		offset = self._text.tell()
+		self._text.write(data)
+		return offset, len(data)
+
+	def close(self):
+		if self._data_size & 1:
+			self._wav.write(b'\0')
+		self._wav.seek(0)
+		self._wav.write(self._audio.wav_header(self._data_size))
+		self._wav.close()
+		self._text.close()
+
+
+# Function that opens the writer of the clips of a run.
+# Inputs -> Archive format (None for separate files), output directory, base
+#			name of the archive files and the WavSource of the clips.
+# Output -> The writer and the filename of the manifest (None for files).
+def open_writer(archive, out_dir_name, base_name, audio):
+	if archive is None:
+		return DirectoryWriter(out_dir_name), None
+	prefix = os.path.join(out_dir_name, base_name + '-clips')
+	if archive == 'zip':
+		writer = ZipWriter(prefix + '.zip')
+	elif archive == 'tar':
+		writer = TarWriter(prefix + '.tar')
+	elif archive == 'wav':
+		writer = WavWriter(prefix + '.wav', prefix + '.txt', audio)
+	else:
+		raise ValueError("Unknown archive format: {}".format(archive))
+	return writer, prefix + '.json'
+
+# Function that writes the manifest of an archive.
+# Inputs -> Filename, archive format, the writer, the source audio and
+#			transcript and the list of clip entries.
+def write_manifest(filename, archive, writer, audio_file, trans_file, clips):
+	manifest = {'format': archive, 'audio': audio_file,
+		'transcript': trans_file,
+		'archive': os.path.basename(writer.filename), 'clips': clips}
+	if archive == 'wav':
+		manifest['text'] = os.path.basename(writer.text_filename)
+	with open(filename, 'w') as f:
+		json.dump(manifest, f, indent=2, sort_keys=True)
+
+# Function that reads a byte range of a file.
+def read_range(filename, offset, size):
+	with open(filename, 'rb') as f:
+		f.seek(offset)
+		return f.read(size)
+
+# Function that extracts clips from an archive into separate files, the same
+# as they would have been written without the archive.
+# Inputs -> Filename of the manifest, output directory and the names of the
+#			audio files of the clips to extract (all of them if None).
+# Output -> List of the files written.
+def unpack(manifest_file, out_dir_name, names=None):
+	with open(manifest_file, 'r') as f:
+		manifest = json.load(f)
+	base = os.path.dirname(manifest_file)
+	archive = os.path.join(base, manifest['archive'])
+	clips = manifest['clips']
+	if names is not None:
+		missing = set(names) - set(clip['audio'] for clip in clips)
+		if len(missing) > 0:
+			raise ValueError("Clips not in the archive: {}".format(
+				", ".join(sorted(missing))))
+		clips = [clip for clip in clips if clip['audio'] in names]
+	if not os.path.exists(out_dir_name):
+		os.makedirs(out_dir_name)
+
+	packed = None
+	if manifest['format'] == 'wav':
+		packed = WavSource(archive)
+	written = []
+	try:
+		for clip in clips:
+			audio = read_range(archive, clip['audio_offset'], clip['audio_size'])
+			if packed is not None:
+				chunks = [packed.wav_header(len(audio)), audio]
+				if len(audio) & 1:
+					chunks.append(b'\0')
+				audio = b''.join(chunks)
+			files = [(clip['audio'], audio)]
+			if clip.get('transcript') is not None:
+				text = archive
+				if manifest['format'] == 'wav':
+					text = os.path.join(base, manifest['text'])
+				files.append((clip['transcript'], read_range(text,
+					clip['transcript_offset'], clip['transcript_size'])))
+			for name, data in files:
+				with open(os.path.join(out_dir_name, name), 'wb') as f:
+					f.write(data)
+				written.append(name)
+	finally:
+		if packed is not None:
+			packed.close()
+	return written
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description = 'Extract clips from a Saulbot archive')
+	parser.add_argument('-manifest', action = 'store', dest = 'manifest_file',
+		required = True, help = 'manifest written next to the archive')
+	parser.add_argument('-clip', action = 'store', dest = 'clips', nargs = '+',
+		default = None, help = 'names of the audio files of the clips to'
+			' extract (default: all)')
+	parser.add_argument('-output', action = 'store', dest = 'out_dir_name',
+		required = True, help = 'directory the clips are written to')
+	args = parser.parse_args()
+
+	if not os.path.isfile(args.manifest_file):
+		print("File does not exist\nExiting...")
+		sys.exit()
+	try:
+		written = unpack(args.manifest_file, args.out_dir_name, args.clips)
+	except ValueError as e:
+		print("ERROR: {}\nExiting...".format(e))
+		sys.exit()
+	print("{} files written to {}".format(len(written), args.out_dir_name))
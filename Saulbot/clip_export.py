@@ -0,0 +1,115 @@
+'''
+	Concurrent export pipeline for Saulbot.
+
+	Clips are exported in two stages connected by a bounded queue:
+
+		read	One thread prepares each clip in turn (reads its audio range
+				from the recording and formats its transcript excerpt).
+		write	A pool of threads writes the prepared clips to disk.
+
+	Disk writes release the GIL, so preparing the next clips overlaps with
+	writing the previous ones, and several writes are in flight at once
+	(which hides the latency of network-mounted output directories). The
+	queue bounds the number of prepared clips held in memory.
+'''
+
+import sys
+import threading
+
+try:
+	from Queue import Queue
+except ImportError:
+	from queue import Queue
+
+# Default number of writer threads and of prepared clips that can wait for
+# a writer.
+EXPORT_THREADS = 4
+QUEUE_SIZE = 8
+
+
+class ExportPipeline(object):
+
+	# Inputs -> read is called on the reader thread with each item and
+	#			returns what is passed to write.
+	#			write is called on a writer thread and returns the result for
+	#			the item.
+	#			Number of writer threads and size of the queue between the
+	#			stages.
+	def __init__(self, read, write, threads=EXPORT_THREADS,
+			queue_size=QUEUE_SIZE):
+		self.read = read
+		self.write = write
+		self.threads = max(1, threads)
+		self.queue_size = max(1, queue_size)
+
+	# Function that runs the pipeline over a list of items.
+	# progress is called on the calling thread with the number of items
+	# done every time an item is finished, and done with the position and
+	# the result of the item.
+	# The first exception raised by a stage stops the pipeline and is raised
+	# again here once all the threads have stopped.
+	# Output -> List of the results of write in the order of the items.
+	def run(self, items, progress=None, done=None):
+		tasks = Queue(self.queue_size)
+		finished = Queue()
+		failed = threading.Event()
+		errors = []
+		results = [None] * len(items)
+
+		def fail():
+			errors.append(sys.exc_info()[1])
+			failed.set()
+
+		def read_stage():
+			try:
+				for i, item in enumerate(items):
+					if failed.is_set():
+						break
+					tasks.put((i, self.read(item)))
+			except Exception:
+				fail()
+			finally:
+				for t in range(self.threads):
+					tasks.put(None)
+
+		def write_stage():
+			while True:
+				task = tasks.get()
+				if task is None:
+					break
+				# After a failure the queue is only drained.
+				if failed.is_set():
+					continue
+				i, prepared = task
+				try:
+					finished.put((i, self.write(prepared)))
+				except Exception:
+					fail()
+			finished.put(None)
+
+		workers = [threading.Thread(target=read_stage)]
+		workers += [threading.Thread(target=write_stage)
+			for t in range(self.threads)]
+		for worker in workers:
+			worker.daemon = True
+			worker.start()
+
+		num_done = 0
+		running = self.threads
+		while running > 0:
+			item = finished.get()
+			if item is None:
+				running -= 1
+				continue
+			i, result = item
+			results[i] = result
+			num_done += 1
+			if progress is not None:
+				progress(num_done)
+			if done is not None:
+				done(i, result)
+		for worker in workers:
+			worker.join()
+		if len(errors) > 0:
+			raise errors[0]
+		return results
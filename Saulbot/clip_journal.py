@@ -0,0 +1,144 @@
+'''
+	Journal of the clips written to a Saulbot results directory.
+
+	Every audio slice and transcript excerpt written to a results directory
+	is recorded in clips-journal.jsonl (one JSON object per line, appended as
+	soon as the file is written) with the recording it was cut from, the
+	parameters it was made with and the size and CRC-32 of its contents.
+
+	When the same results directory is extracted again, a file is only
+	written if it is missing, its size (or, with "verify_clips", its
+	checksum) differs from the journal, or it would be made with different
+	parameters: an audio slice when the recording or its frame range
+	changed, a transcript excerpt when its contents changed. A run that
+	died halfway therefore resumes where it stopped, and a run after a
+	change of the configuration only writes the clips that changed. The
+	files of the same recording that a complete run no longer produces are
+	removed.
+'''
+
+import json
+import os
+import threading
+import zlib
+
+JOURNAL_FILE = 'clips-journal.jsonl'
+
+# Size of the blocks read when checking the checksum of a file.
+READ_BLOCK_SIZE = 1 << 20
+
+
+# Function that returns the CRC-32 of a list of byte strings.
+def checksum(chunks):
+	crc = 0
+	for chunk in chunks:
+		crc = zlib.crc32(chunk, crc)
+	return crc & 0xFFFFFFFF
+
+# Function that returns the CRC-32 of a file.
+def file_checksum(filename):
+	crc = 0
+	with open(filename, 'rb') as f:
+		while True:
+			block = f.read(READ_BLOCK_SIZE)
+			if not block:
+				break
+			crc = zlib.crc32(block, crc)
+	return crc & 0xFFFFFFFF
+
+# Function that returns the parameters as they are read back from the
+# journal, so that they can be compared with recorded ones.
+def normalize(params):
+	return json.loads(json.dumps(params))
+
+
+class ClipJournal(object):
+
+	# Inputs -> The results directory and whether the checksums of the files
+	#			are checked (instead of only their size).
+	def __init__(self, dir_name, verify=False):
+		self.dir_name = dir_name
+		self.filename = os.path.join(dir_name, JOURNAL_FILE)
+		self.verify = verify
+		# File name -> last entry recorded for it.
+		self.entries = {}
+		if os.path.exists(self.filename):
+			with open(self.filename, 'r') as f:
+				for line in f:
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						# Line cut short by a run that died while writing it.
+						continue
+					if entry.get('removed'):
+						self.entries.pop(entry['file'], None)
+					else:
+						self.entries[entry['file']] = entry
+		self._file = open(self.filename, 'a')
+		self._lock = threading.Lock()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	# Function that checks whether a file was already written from the same
+	# recording with the same parameters and is still intact.
+	# crc is the checksum the file must have, if it is already known.
+	def is_done(self, name, source, params, crc=None):
+		with self._lock:
+			entry = self.entries.get(name)
+		if (entry is None or entry['source'] != source or
+			entry['params'] != normalize(params) or
+			(crc is not None and entry['crc32'] != crc)):
+			return False
+		path = os.path.join(self.dir_name, name)
+		if (not os.path.isfile(path) or
+			os.path.getsize(path) != entry['size']):
+			return False
+		return not self.verify or file_checksum(path) == entry['crc32']
+
+	# Function that records a file that was written.
+	def record(self, name, source, params, size, crc):
+		entry = {'file': name, 'source': source, 'params': normalize(params),
+			'size': size, 'crc32': crc}
+		self._append(entry)
+		with self._lock:
+			self.entries[name] = entry
+
+	def _append(self, entry):
+		line = json.dumps(entry, sort_keys=True) + '\n'
+		with self._lock:
+			self._file.write(line)
+			self._file.flush()
+
+	# Function that removes the files of a recording that are not in keep
+	# (the files written by a complete run).
+	# Output -> List of the names of the files removed.
+	def collect(self, source, keep):
+		with self._lock:
+			orphans = [name for name, entry in self.entries.items()
+				if entry['source'] == source and name not in keep]
+		for name in sorted(orphans):
+			path = os.path.join(self.dir_name, name)
+			if os.path.isfile(path):
+				os.remove(path)
+			self._append({'file': name, 'removed': True})
+			with self._lock:
+				del self.entries[name]
+		return sorted(orphans)
+
+	# Function that closes the journal. If compact is True, the journal is
+	# rewritten with only the last entry of every file; this must not be
+	# done while other processes write to the same results directory.
+	def close(self, compact=False):
+		if self._file.closed:
+			return
+		self._file.close()
+		if compact:
+			temp = self.filename + '.tmp'
+			with open(temp, 'w') as f:
+				for name in sorted(self.entries):
+					f.write(json.dumps(self.entries[name], sort_keys=True) + '\n')
+			os.rename(temp, self.filename)
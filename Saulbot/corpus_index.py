@@ -0,0 +1,456 @@
+'''
+	Persistent keyword index over a corpus of transcripts.
+
+	Every line of every .ca/.cha transcript in a directory is tokenized with
+	the same delimiter rules as OIRP.search_keywords (OIRP.tokenize) and its
+	tokens are stored in an SQLite database as postings (token, file, line,
+	position), along with the number of words of each line and the start and
+	end times of its turn. The index is updated incrementally: only the
+	transcripts whose size or modification time changed are hashed, and only
+	those whose content changed are indexed again.
+
+	Queries find the same lines as search_keywords (a keyword of several
+	words is found when its tokens are consecutive, and a solo hit is a line
+	with as many words as the keyword) for the whole corpus from the index,
+	without reading the transcripts. The hits can be fed straight into the
+	extraction of OIRP (-extract).
+
+	Usage:
+		python corpus_index.py -index corpus.db -build -directory [Corpus]
+		python corpus_index.py -index corpus.db -config config.json
+			[-keywords pardon "sorry what"] [-mode solo] [-csv hits.csv]
+			[-extract]
+'''
+
+import argparse
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+import time
+
+import OIRP
+from turn_cache import cached_index
+from turn_index import read_turns
+
+# Extensions of the transcripts indexed.
+EXTENSIONS = ('ca', 'cha')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+	id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	size INTEGER NOT NULL,
+	mtime REAL NOT NULL,
+	hash TEXT NOT NULL,
+	num_lines INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+	file_id INTEGER NOT NULL,
+	line INTEGER NOT NULL,
+	num_words INTEGER NOT NULL,
+	start_ms INTEGER,
+	end_ms INTEGER,
+	PRIMARY KEY (file_id, line)
+);
+CREATE TABLE IF NOT EXISTS postings (
+	token TEXT NOT NULL,
+	file_id INTEGER NOT NULL,
+	line INTEGER NOT NULL,
+	pos INTEGER NOT NULL,
+	PRIMARY KEY (token, file_id, line, pos)
+);
+CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+'''
+
+
+# Function that computes the hash of the content of a file.
+def file_hash(path):
+	digest = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+# Function that returns the tokens of a line the way KeywordMatcher.match
+# sees them, and the number of words of the utterance.
+def line_tokens(line):
+	colon = line.find(':')
+	text_tokens = OIRP.tokenize(line[colon+1:])
+	if colon != -1:
+		tokens = OIRP.tokenize(line[:colon+1]) + text_tokens
+	else:
+		tokens = text_tokens
+	num_words = sum(1 for token in text_tokens
+		if any(x.isalpha() for x in token))
+	return tokens, num_words
+
+# Function that lists the transcripts of a directory, leaving out the
+# excerpts written by extractions (see OIRP.walk_sessions).
+def list_transcripts(dir_name):
+	# Listing unicode paths, as they are stored in the index.
+	if isinstance(dir_name, bytes):
+		dir_name = dir_name.decode(sys.getfilesystemencoding() or 'utf-8')
+	paths = []
+	for root, files in OIRP.walk_sessions(dir_name):
+		for file in sorted(files):
+			if file[file.rfind('.')+1:] in EXTENSIONS:
+				paths.append(os.path.abspath(os.path.join(root, file)))
+	return paths
+
+
+class CorpusIndex(object):
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.db = sqlite3.connect(filename)
+		self.db.executescript(SCHEMA)
+
+	def close(self):
+		self.db.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	# Function that removes a file from the index.
+	def _remove(self, file_id):
+		self.db.execute('DELETE FROM postings WHERE file_id = ?', (file_id,))
+		self.db.execute('DELETE FROM lines WHERE file_id = ?', (file_id,))
+		self.db.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+	# Function that indexes the lines of a transcript.
+	# The transcript is read turn by turn (turn_index.read_turns), so every
+	# line gets the times of the turn extract_times reads for it.
+	def _add(self, path, size, mtime, digest):
+		lines = []
+		postings = []
+		num_lines = 0
+		with io.open(path, 'r', encoding='utf-8') as f:
+			for turn in read_turns(f):
+				num_lines += len(turn.line_nums)
+				for line_num in turn.line_nums:
+					tokens, num_words = line_tokens(
+						turn.lines[line_num - turn.first_line])
+					if len(tokens) == 0:
+						continue
+					bullet = turn.bullet
+					start, end = bullet if bullet is not None else (None, None)
+					lines.append((line_num, num_words, start, end))
+					for pos, token in enumerate(tokens):
+						postings.append((token, line_num, pos))
+		cursor = self.db.execute('INSERT INTO files (path, size, mtime, hash,'
+			' num_lines) VALUES (?, ?, ?, ?, ?)',
+			(path, size, mtime, digest, num_lines))
+		file_id = cursor.lastrowid
+		self.db.executemany('INSERT INTO lines VALUES (?, ?, ?, ?, ?)',
+			[(file_id,) + line for line in lines])
+		self.db.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)',
+			set((token, file_id, line_num, pos)
+				for token, line_num, pos in postings))
+
+	# Function that brings the index up to date with a directory.
+	# Transcripts are indexed again only if their content changed, and the
+	# transcripts that no longer exist are removed.
+	# Output -> Dictionary with the number of files added, updated, removed
+	#			and unchanged.
+	def update(self, dir_name):
+		stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+		root = os.path.abspath(dir_name)
+		known = dict((path, (file_id, size, mtime, digest))
+			for file_id, path, size, mtime, digest in self.db.execute(
+				'SELECT id, path, size, mtime, hash FROM files'))
+		paths = list_transcripts(dir_name)
+		with self.db:
+			for path in paths:
+				info = os.stat(path)
+				entry = known.get(path)
+				if entry is not None:
+					file_id, size, mtime, digest = entry
+					if size == info.st_size and mtime == info.st_mtime:
+						stats['unchanged'] += 1
+						continue
+					new_digest = file_hash(path)
+					if new_digest == digest:
+						self.db.execute('UPDATE files SET size = ?, mtime = ?'
+							' WHERE id = ?', (info.st_size, info.st_mtime, file_id))
+						stats['unchanged'] += 1
+						continue
+					self._remove(file_id)
+					self._add(path, info.st_size, info.st_mtime, new_digest)
+					stats['updated'] += 1
+				else:
+					self._add(path, info.st_size, info.st_mtime, file_hash(path))
+					stats['added'] += 1
+			# Removing the transcripts of the directory that were deleted.
+			current = set(paths)
+			for path, entry in known.items():
+				if (path.startswith(root + os.sep) and path not in current):
+					self._remove(entry[0])
+					stats['removed'] += 1
+		return stats
+
+	# Function that finds the lines containing a keyword.
+	# Output -> List of (path, line, num_words, start_ms, end_ms), ordered by
+	#			file and line.
+	def _find(self, keyword):
+		tokens = OIRP.tokenize(keyword)
+		if len(tokens) == 0:
+			return []
+		# The tokens of the keyword must be consecutive in the line.
+		joins = []
+		params = [tokens[0]]
+		for k, token in enumerate(tokens[1:]):
+			joins.append(('JOIN postings p{0} ON p{0}.token = ? AND'
+				' p{0}.file_id = p.file_id AND p{0}.line = p.line AND'
+				' p{0}.pos = p.pos + {0}').format(k + 1))
+			params.append(token)
+		# Reordering the parameters to follow the query.
+		params = params[1:] + params[:1]
+		query = ('SELECT DISTINCT f.path, l.line, l.num_words, l.start_ms,'
+			' l.end_ms FROM postings p ' + ' '.join(joins) +
+			' JOIN lines l ON l.file_id = p.file_id AND l.line = p.line'
+			' JOIN files f ON f.id = p.file_id'
+			' WHERE p.token = ? ORDER BY f.path, l.line')
+		return self.db.execute(query, params).fetchall()
+
+	# Function that finds the hits of the keywords in the whole corpus.
+	# Inputs -> List of keywords and mode ('solo' or 'in_line').
+	# Output -> Dictionary of path -> list of (keyword, line, start_ms,
+	#			end_ms, solo) hits grouped by keyword in the order given (the
+	#			order of search_keywords), and the keywords_dict statistics.
+	def query(self, keywords, mode):
+		hits = {}
+		keywords_dict = dict(zip(keywords, [0] * len(keywords)))
+		for word in keywords:
+			length = len(OIRP.tokenize(word))
+			for path, line, num_words, start, end in self._find(word):
+				solo = num_words == length
+				if mode == 'solo' and not solo:
+					continue
+				keywords_dict[word] += 1
+				hits.setdefault(path, []).append((word, line, start, end, solo))
+		return hits, keywords_dict
+
+	# Function that returns the files of the index that changed since they
+	# were indexed (their hits may then be out of date).
+	def stale_files(self, paths):
+		stale = []
+		for path in paths:
+			row = self.db.execute('SELECT size, mtime FROM files WHERE path = ?',
+				(path,)).fetchone()
+			if (row is None or not os.path.isfile(path) or
+					os.stat(path).st_size != row[0] or
+					os.stat(path).st_mtime != row[1]):
+				stale.append(path)
+		return stale
+
+	# Function that returns the number of lines and files indexed.
+	def totals(self):
+		return self.db.execute('SELECT COALESCE(SUM(num_lines), 0), COUNT(*)'
+			' FROM files').fetchone()
+
+
+# Function that runs the extraction of OIRP on the hits of a transcript.
+# The audio is the .wav file next to the transcript (see
+# OIRP.audio_candidates).
+# With the name of a query, the clips are written to a directory of that
+# name inside the usual output directory, as with OIRP.run_queries.
+# Output -> The extraction result (as returned by OIRP.run_session) or None
+#			if there is no audio for the transcript.
+def extract_hits(path, hits, config, query=None):
+	audio_file = None
+	for name in OIRP.audio_candidates(os.path.basename(path)):
+		candidate = os.path.join(os.path.dirname(path), name)
+		if os.path.isfile(candidate):
+			audio_file = candidate
+			break
+	if audio_file is None:
+		return None
+	with io.open(path, 'r', encoding='utf-8') as f:
+		all_lines = f.readlines()
+	# The turns of the hits, as OIRP.search_turns finds them.
+	hit_nums = set(line for word, line, start, end, solo in hits)
+	turns = {}
+	for turn in read_turns(all_lines):
+		for line_num in turn.line_nums:
+			if line_num in hit_nums:
+				turns[line_num] = turn.text
+	found_lines = [turns[line] for word, line, start, end, solo in hits]
+	ind_lines = [all_lines[line] for word, line, start, end, solo in hits]
+	form = path[path.rfind('.'):]
+	index = None
+	if config.get('turn_cache', False):
+		index = cached_index(path, all_lines)
+	out_dir_name = None
+	if query is not None:
+		out_dir_name = os.path.join(
+			audio_file[:audio_file.rfind('.')] + '-results', query)
+	out_dir_name, slice_names, trans_names = OIRP.extract_hits(all_lines,
+		found_lines, ind_lines, audio_file, config, form, out_dir_name,
+		index=index, trans_file=path, collect=False)
+	return {'transcript': path, 'audio': audio_file, 'output': out_dir_name,
+		'slice_names': slice_names, 'trans_names': trans_names}
+
+# Function that prints the hits and statistics of a query.
+def print_hits(hits, keywords, keywords_dict, num_lines, num_files, seconds):
+	for path in sorted(hits):
+		print(path)
+		for word, line, start, end, solo in hits[path]:
+			print('\t{}\tline {}\t{}-{} ms\t{}'.format(word, line + 1,
+				start, end, 'solo' if solo else 'in_line'))
+	num_found = sum(len(x) for x in hits.values())
+	print("\nBasic statistics...\n")
+	print('\tNumber of transcripts indexed: {}'.format(num_files))
+	print('\tNumber of transcripts with hits: {}'.format(len(hits)))
+	print('\tTotal number of lines indexed: {}'.format(num_lines))
+	print('\tTotal number of hits: {}'.format(num_found))
+	for word in keywords:
+		print("\tNumber of turns containing {}: {}".format(word,
+			keywords_dict[word]))
+	print('\tQuery time: {:.3f} s'.format(seconds))
+
+# Function that returns text as written by the csv module (utf-8 bytes in
+# Python 2).
+def csv_text(text):
+	if str is bytes and not isinstance(text, bytes):
+		return text.encode('utf-8')
+	return text
+
+# Function that writes the hits of queries to a CSV file.
+# Input -> The filename and a list of (query name, hits). The name is None
+#			for a single query; otherwise it is written in a query column.
+def write_hits(filename, queries):
+	named = any(name is not None for name, hits in queries)
+	with open(filename, 'w') as f:
+		writer = csv.writer(f)
+		writer.writerow(['query'] * named + ['transcript', 'keyword', 'line',
+			'start_ms', 'end_ms', 'solo'])
+		for name, hits in queries:
+			for path in sorted(hits):
+				for word, line, start, end, solo in hits[path]:
+					writer.writerow(([csv_text(name)] if named else []) +
+						[csv_text(path), csv_text(word), line + 1, start, end,
+						int(solo)])
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description = 'Index the keywords of a corpus of transcripts and query'
+			' the index')
+	parser.add_argument('-index', action = 'store', dest = 'index_file',
+		required = True, help = 'SQLite file of the index')
+	parser.add_argument('-build', action = 'store_true', dest = 'build',
+		default = False, help = 'index the transcripts of -directory (only'
+			' the ones that changed since the last build)')
+	parser.add_argument('-directory', action = 'store', dest = 'in_direc',
+		default = None, help = 'directory of the corpus')
+	parser.add_argument('-config', action = 'store', dest = 'config_file',
+		default = None, help = 'configuration giving the keywords (OIRs) and'
+			' extraction mode of every query and the extraction settings')
+	parser.add_argument('-keywords', action = 'store', dest = 'keywords',
+		nargs = '+', default = None, help = 'keywords to query')
+	parser.add_argument('-mode', action = 'store', dest = 'mode',
+		choices = ['solo', 'in_line'], default = None,
+		help = 'extraction mode of the query')
+	parser.add_argument('-csv', action = 'store', dest = 'csv_file',
+		default = None, help = 'CSV file the hits are written to')
+	parser.add_argument('-extract', action = 'store_true', dest = 'extract',
+		default = False, help = 'extract the audio and transcript around the'
+			' hits of every transcript (requires -config)')
+	args = parser.parse_args()
+
+	if args.build and args.in_direc is None:
+		parser.error('-build requires -directory')
+	if args.in_direc is not None and not os.path.isdir(args.in_direc):
+		print("Directory does not exist\nExiting...")
+		sys.exit()
+
+	configs = None
+	if args.config_file is not None:
+		if not OIRP.file_exists(args.config_file):
+			print("File does not exist\nExiting...")
+			sys.exit()
+		configs = OIRP.read_json(args.config_file)
+		try:
+			OIRP.check_configs(configs)
+		except ValueError as e:
+			print("ERROR: {}\nExiting...".format(e))
+			sys.exit()
+	if args.extract and configs is None:
+		parser.error('-extract requires -config')
+	if args.keywords is not None and configs is not None and len(configs) > 1:
+		parser.error('-keywords cannot be used with a configuration of several'
+			' queries')
+
+	with CorpusIndex(args.index_file) as index:
+		if args.build:
+			start = time.time()
+			stats = index.update(args.in_direc)
+			print('Indexed {} in {:.2f} s: {} added, {} updated, {} removed,'
+				' {} unchanged'.format(args.in_direc, time.time() - start,
+				stats['added'], stats['updated'], stats['removed'],
+				stats['unchanged']))
+
+		# Every query of the configuration is run, as with OIRP.py, unless
+		# the keywords are given with -keywords.
+		if args.keywords is not None or configs is None:
+			queries = [(None, args.keywords, configs and configs[0])]
+		else:
+			queries = [(OIRP.query_name(configs, i) if len(configs) > 1 else
+				None, config['OIRs'], config)
+				for i, config in enumerate(configs)]
+		if queries[0][1] is None:
+			if not args.build:
+				parser.error('either -build, -keywords or -config is required')
+			sys.exit()
+
+		num_lines, num_files = index.totals()
+		results = []
+		for name, keywords, config in queries:
+			if not isinstance(keywords[0], type(u'')):
+				keywords = [word.decode(sys.getfilesystemencoding() or 'utf-8')
+					for word in keywords]
+			mode = args.mode
+			if mode is None:
+				mode = config['extraction_mode'].lower() if config else 'in_line'
+			if name is not None:
+				print('\nQuery: {}\n'.format(name))
+
+			start = time.time()
+			hits, keywords_dict = index.query(keywords, mode)
+			seconds = time.time() - start
+			print_hits(hits, keywords, keywords_dict, num_lines, num_files,
+				seconds)
+			stale = index.stale_files(sorted(hits))
+			if len(stale) > 0:
+				print('\nWARNING: These transcripts changed since they were'
+					' indexed, run -build again:')
+				for path in stale:
+					print('\t' + path)
+			results.append((name, keywords, config, hits, stale))
+		if args.csv_file is not None:
+			write_hits(args.csv_file, [(name, hits)
+				for name, keywords, config, hits, stale in results])
+
+	if args.extract:
+		for name, keywords, config, hits, stale in results:
+			if name is not None:
+				print('\nQuery: {}\n'.format(name))
+			config = dict(config, OIRs=keywords)
+			for path in sorted(hits):
+				if path in stale:
+					print('Skipping {} (changed since it was indexed)'.format(path))
+					continue
+				result = extract_hits(path, hits[path], config, name)
+				if result is None:
+					print('WARNING: No audio found for {}'.format(path))
+					continue
+				print('{}: {} audio files and {} transcripts written to {}'.format(
+					path, len(result['slice_names']), len(result['trans_names']),
+					result['output']))
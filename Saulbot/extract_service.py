@@ -0,0 +1,379 @@
+'''
+	Long-running extraction service for Saulbot.
+
+	Every run of OIRP.py starts a new process that reads and parses the
+	transcript and opens the recording again. The service keeps them instead:
+	parsed transcripts (lines and TranscriptIndex) and opened recordings
+	(WavSource) are held in an LRU cache with a memory budget, so repeated
+	queries on the same sessions only search and export.
+
+	Jobs are posted as JSON over HTTP, either on a local TCP port or on a
+	Unix socket:
+
+		POST /extract	{"transcript": ..., "audio": ..., "OIRs": [...],
+						 "time_range": ..., "time_thresh": ...,
+						 "extraction_mode": ..., "output": ...}
+
+	Any setting missing from a job is taken from the configuration file the
+	service was started with. The response is streamed as one JSON object
+	per line: a "clip" event with the paths of every clip as soon as it is
+	written, then a "done" event with the statistics of the job (or an
+	"error" event). GET /stats returns the contents of the cache.
+
+	Jobs are run one at a time, each exporting its clips on the export
+	threads of the configuration.
+
+	Usage:
+		python extract_service.py -config config.json [-port 8765]
+		python extract_service.py -config config.json -socket /tmp/saulbot.sock
+'''
+
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+	from SocketServer import UnixStreamServer
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+	from socketserver import UnixStreamServer
+
+import OIRP
+from metrics import Metrics
+from turn_cache import cached_index
+from turn_index import TranscriptIndex, speaker_tier
+from wav_source import WavSource
+
+# Default memory budget of the cache in MB and default TCP port.
+CACHE_SIZE = 512
+PORT = 8765
+
+
+# Function that returns the size and modification time of a file, used to
+# notice that a cached file changed on disk.
+def file_stamp(path):
+	stat = os.stat(path)
+	return stat.st_size, stat.st_mtime
+
+
+class Transcript(object):
+
+	# With turn_cache the turns are loaded from the sidecar of the transcript
+	# (see turn_cache).
+	def __init__(self, path, turn_cache=False):
+		self.path = path
+		self.form = path[path.rfind('.'):]
+		self.lines = OIRP.read_transcript(path)
+		if turn_cache:
+			self.index = cached_index(path, self.lines)
+		else:
+			self.index = TranscriptIndex(self.lines)
+		self.num_turns = sum(1 for line in self.lines if speaker_tier(line))
+		# Estimate of the memory held: the lines and the turn arrays.
+		self.size = sum(sys.getsizeof(line) for line in self.lines)
+		self.size += sum(x.itemsize * len(x) for x in (self.index.speakers,
+			self.index.starts, self.index.ends, self.index.first_lines,
+			self.index.bullet_lines))
+
+	def close(self):
+		self.index.close()
+
+
+class SessionCache(object):
+
+	# Inputs -> Memory budget in bytes. Transcripts count as the memory they
+	#			hold and recordings as the size of their sample data (the
+	#			pages of the memory map that can become resident).
+	#			Whether transcripts are parsed through the turn cache.
+	def __init__(self, budget, turn_cache=False):
+		self.budget = budget
+		self.turn_cache = turn_cache
+		# (kind, path) -> [stamp, object, size], least recently used first.
+		self.entries = OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	# Function that returns the cached object for a file, loading it with
+	# load(path) if it is not cached or changed on disk since it was loaded.
+	# Output -> The object and whether it was cached.
+	def get(self, kind, path, load, size):
+		key = (kind, os.path.abspath(path))
+		stamp = file_stamp(path)
+		entry = self.entries.pop(key, None)
+		if entry is not None and entry[0] == stamp:
+			self.hits += 1
+			self.entries[key] = entry
+			return entry[1], True
+		if entry is not None:
+			self._drop(entry)
+		self.misses += 1
+		value = load(path)
+		entry = [stamp, value, size(value)]
+		self.entries[key] = entry
+		self.size += entry[2]
+		self._evict()
+		return value, False
+
+	def transcript(self, path):
+		return self.get('transcript', path,
+			lambda path: Transcript(path, self.turn_cache), lambda x: x.size)
+
+	def audio(self, path):
+		return self.get('audio', path, WavSource, lambda x: x.data_size)
+
+	def _drop(self, entry):
+		self.size -= entry[2]
+		entry[1].close()
+
+	# Function that evicts the least recently used entries until the cache
+	# fits in the budget. The most recent entry is always kept, even if it is
+	# larger than the budget on its own.
+	def _evict(self):
+		while self.size > self.budget and len(self.entries) > 1:
+			key, entry = self.entries.popitem(last=False)
+			self._drop(entry)
+			self.evictions += 1
+
+	def clear(self):
+		while len(self.entries) > 0:
+			self._drop(self.entries.popitem()[1])
+
+	def stats(self):
+		return {'budget_mb': round(self.budget / (1024.0 * 1024.0), 1),
+			'size_mb': round(self.size / (1024.0 * 1024.0), 1),
+			'hits': self.hits, 'misses': self.misses,
+			'evictions': self.evictions,
+			'entries': [{'kind': kind, 'path': path,
+				'size_mb': round(entry[2] / (1024.0 * 1024.0), 3)}
+				for (kind, path), entry in self.entries.items()]}
+
+
+# Function that builds the configuration of a job from the job and the
+# default configuration. "keywords" is accepted for "OIRs".
+# Raises a ValueError describing the first problem found.
+def job_config(job, defaults):
+	config = dict(defaults)
+	for key, value in job.items():
+		if key not in ('transcript', 'audio', 'output'):
+			config['OIRs' if key == 'keywords' else key] = value
+	for key in ('OIRs', 'time_range', 'time_thresh', 'extraction_mode'):
+		if key not in config:
+			raise ValueError("Missing setting: {}".format(key))
+	OIRP.check_config(config)
+	return config
+
+# Function that runs an extraction job against the cached sessions.
+# on_clip is called with the paths of the audio slice and transcript
+# excerpt of every clip as soon as it is written.
+# Output -> Dictionary with the statistics of the job.
+def run_job(cache, job, defaults, on_clip):
+	for key in ('transcript', 'audio'):
+		if key not in job:
+			raise ValueError("Missing setting: {}".format(key))
+	trans_file = job['transcript']
+	audio_file = job['audio']
+	for filename in (trans_file, audio_file):
+		if not OIRP.file_exists(filename):
+			raise IOError("File does not exist: {}".format(filename))
+	if not (OIRP.check_extension(trans_file, 'ca') or
+			OIRP.check_extension(trans_file, 'cha')):
+		raise ValueError("Check .ca file extension: {}".format(trans_file))
+	config = job_config(job, defaults)
+
+	metrics = Metrics()
+	with metrics.stage('transcript read'):
+		transcript, trans_cached = cache.transcript(trans_file)
+	with metrics.stage('audio open'):
+		audio, audio_cached = cache.audio(audio_file)
+	metrics.count('lines_scanned', len(transcript.lines))
+
+	with metrics.stage('search'):
+		found_lines, ind_lines, keywords_dict = OIRP.search_keywords(
+			transcript.lines, config['OIRs'], transcript.form,
+			config['extraction_mode'].lower())
+	metrics.count('keyword_hits', len(found_lines))
+
+	out_dir_name = job.get('output')
+	if out_dir_name is None:
+		out_dir_name = audio_file[:audio_file.rfind('.')] + '-results'
+
+	def clip_done(slice_name, trans_name):
+		on_clip(os.path.join(out_dir_name, slice_name),
+			None if trans_name is None else os.path.join(out_dir_name, trans_name))
+
+	out_dir_name, slice_names, trans_names = OIRP.extract_hits(
+		transcript.lines, found_lines, ind_lines, audio_file, config,
+		transcript.form, out_dir_name, metrics, audio, transcript.index,
+		clip_done, trans_file, collect=False)
+
+	return {'transcript': trans_file, 'audio': audio_file,
+		'output': out_dir_name, 'keywords': config['OIRs'],
+		'keywords_dict': keywords_dict, 'num_found': len(found_lines),
+		'num_turns_total': transcript.num_turns,
+		'num_clips': len(slice_names), 'transcript_cached': trans_cached,
+		'audio_cached': audio_cached, 'metrics': metrics.to_dict()}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+	# The connection is closed at the end of every response, which ends the
+	# streamed events.
+	protocol_version = 'HTTP/1.0'
+
+	def send_json(self, status, data):
+		body = json.dumps(data).encode('utf-8')
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def send_event(self, event):
+		self.wfile.write(json.dumps(event).encode('utf-8') + b'\n')
+		self.wfile.flush()
+
+	def do_GET(self):
+		if self.path == '/stats':
+			self.send_json(200, self.server.cache.stats())
+		else:
+			self.send_json(404, {'error': 'Unknown path: ' + self.path})
+
+	def do_POST(self):
+		if self.path != '/extract':
+			self.send_json(404, {'error': 'Unknown path: ' + self.path})
+			return
+		try:
+			length = int(self.headers.get('Content-Length', 0))
+			job = json.loads(self.rfile.read(length).decode('utf-8'))
+			if not isinstance(job, dict):
+				raise ValueError("The job must be a JSON object")
+		except ValueError as e:
+			self.send_json(400, {'error': 'Invalid job: {}'.format(e)})
+			return
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/x-ndjson')
+		self.end_headers()
+		start = time.time()
+		try:
+			stats = run_job(self.server.cache, job, self.server.config,
+				lambda audio, trans: self.send_event({'event': 'clip',
+					'audio': audio, 'transcript': trans}))
+			stats['seconds'] = round(time.time() - start, 6)
+			self.send_event(dict(stats, event='done'))
+			self.log_message('%s: %d clips in %.3f s', job.get('transcript'),
+				stats['num_clips'], stats['seconds'])
+		except socket.error:
+			# The client went away; the clips written so far are kept.
+			self.log_message('%s: client disconnected', job.get('transcript'))
+		except (ValueError, IOError) as e:
+			self.log_message('%s: %s', job.get('transcript'), e)
+			self.send_event({'event': 'error', 'message': str(e)})
+		except Exception as e:
+			self.log_message('%s', traceback.format_exc().strip())
+			self.send_event({'event': 'error', 'message': str(e)})
+
+	# Unix socket clients have no address.
+	def log_message(self, format, *args):
+		client = 'local'
+		if isinstance(self.client_address, tuple):
+			client = self.client_address[0]
+		sys.stderr.write('{} - - [{}] {}\n'.format(client,
+			self.log_date_time_string(), format % args))
+
+
+class ServiceServer(HTTPServer):
+
+	def __init__(self, address, config, cache):
+		self.config = config
+		self.cache = cache
+		HTTPServer.__init__(self, address, ServiceHandler)
+
+
+class UnixServiceServer(UnixStreamServer):
+
+	def __init__(self, path, config, cache):
+		self.config = config
+		self.cache = cache
+		UnixStreamServer.__init__(self, path, ServiceHandler)
+
+	def server_bind(self):
+		UnixStreamServer.server_bind(self)
+		# Used by BaseHTTPRequestHandler.
+		self.server_name = 'localhost'
+		self.server_port = 0
+
+
+# Function that silences the progress output of the extraction so that it
+# does not fill the log of the service.
+def silence_stdout():
+	sys.stdout = open(os.devnull, 'w')
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description = 'Service keeping transcripts and audio open to run'
+			' Saulbot extraction jobs')
+	parser.add_argument('-config', action = 'store', dest = 'config_file',
+		required = True, help = 'configuration giving the default settings of'
+			' the jobs')
+	parser.add_argument('-port', action = 'store', dest = 'port', type = int,
+		default = PORT, help = 'local TCP port to listen on (default: {})'
+			.format(PORT))
+	parser.add_argument('-socket', action = 'store', dest = 'socket_file',
+		default = None, help = 'Unix socket to listen on instead of a TCP port')
+	parser.add_argument('-cache-size', action = 'store', dest = 'cache_size',
+		type = int, default = CACHE_SIZE, help = 'memory budget of the cache of'
+			' transcripts and audio in MB (default: {})'.format(CACHE_SIZE))
+	args = parser.parse_args()
+
+	if not OIRP.file_exists(args.config_file):
+		print("File does not exist\nExiting...")
+		sys.exit()
+	configs = OIRP.read_json(args.config_file)
+	# The configuration holds the default settings of the jobs, and every
+	# job is a single query.
+	if len(configs) != 1:
+		print('ERROR: The configuration of the service must have a single'
+			' entry (the default settings of the jobs)\nExiting...')
+		sys.exit()
+	config = configs[0]
+	if args.cache_size < 0:
+		print('ERROR: The cache size must not be negative\nExiting...')
+		sys.exit()
+
+	cache = SessionCache(args.cache_size * 1024 * 1024,
+		config.get('turn_cache', False))
+	if args.socket_file is not None:
+		if os.path.exists(args.socket_file):
+			os.remove(args.socket_file)
+		server = UnixServiceServer(args.socket_file, config, cache)
+		where = args.socket_file
+	else:
+		# Only local clients can connect.
+		server = ServiceServer(('127.0.0.1', args.port), config, cache)
+		where = 'http://127.0.0.1:{}'.format(args.port)
+	sys.stderr.write('Saulbot extraction service listening on {}\n'.format(
+		where))
+	silence_stdout()
+	# Stopping cleanly (closing the cache and removing the socket) on kill.
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		cache.clear()
+		if args.socket_file is not None and os.path.exists(args.socket_file):
+			os.remove(args.socket_file)
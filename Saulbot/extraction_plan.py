@@ -0,0 +1,437 @@
+'''
+	Split extraction for Saulbot: plan the clips first, cut the audio later.
+
+	A plan run only does the transcript work of OIRP.py (keyword search, time
+	extraction, redundancy removal and window resolution) for one or many
+	sessions and writes the clip jobs to a JSON plan. Only the header of the
+	recordings is read, for their length and sample format. Every query of
+	the configuration is planned for every session (see make_plan).
+
+		python extraction_plan.py plan -config config.json
+			(-transcript T.ca -audio A.wav | -manifest M | -directory D)
+			-output plan.json
+
+	Every job of the plan is one clip: its session (transcript, audio and
+	output directory), the Window it was resolved to (the time range in ms is
+	low_thresh to high_thresh, the transcript lines first_line to end_line and
+	the audio frames start_frame to end_frame), the names of its audio slice
+	and transcript excerpt and the lines of the excerpt with keywords.
+
+	An execute run cuts the clips of all the jobs of a plan, of one shard of
+	them (-shard K/N is the K-th of N contiguous parts, from 1) or of the
+	given job ids, writing the same files as OIRP.py would:
+
+		python extraction_plan.py execute -plan plan.json [-shard 2/8]
+			[-ids 3 4 5] [-jobs 4]
+
+	Shards can be executed on different machines or processes. Clips that
+	were already written are skipped (see clip_journal), so a failed shard
+	(or only the failed job ids, which are printed) can simply be executed
+	again. Paths are stored relative to the plan, so the plan can be moved
+	along with the corpus; execution fails for a session whose transcript or
+	audio has a different size than when it was planned.
+'''
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+
+import OIRP
+from metrics import Metrics, NO_METRICS, write_metrics
+from turn_cache import cached_index
+from turn_index import TranscriptIndex, read_turns
+from wav_source import WavSource
+
+PLAN_VERSION = 2
+
+
+# Function that plans the clips of one session.
+# Inputs -> The transcript and audio filenames, the output directory (None
+#			for the default one next to the audio), the configuration and
+#			the Metrics the stages are recorded in.
+# Output -> The session entry of the plan and the list of its jobs (without
+#			their ids).
+def plan_session(trans_file,audio_file,out_dir_name,config,metrics=NO_METRICS):
+	keywords = config["OIRs"]
+	form = trans_file[trans_file.rfind('.'):]
+	for filename in (trans_file,audio_file):
+		if not OIRP.file_exists(filename):
+			raise IOError("File does not exist: {}".format(filename))
+
+	with metrics.stage('search'):
+		with io.open(trans_file, "r",encoding="utf-8") as txt_file:
+			found_lines,ind_lines,keywords_dict,num_lines,num_turns = \
+				OIRP.search_turns(read_turns(txt_file),keywords,
+					config['extraction_mode'].lower())
+	metrics.count('lines_scanned',num_lines)
+	metrics.count('keyword_hits',len(found_lines))
+	with metrics.stage('time extraction'):
+		times = OIRP.extract_times(found_lines,form)
+	metrics.count('times',len(times))
+
+	if out_dir_name is None:
+		out_dir_name = audio_file[:audio_file.rfind('.')] +'-results'
+	session = {'transcript': trans_file, 'audio': audio_file,
+		'output': out_dir_name,
+		'transcript_size': os.path.getsize(trans_file),
+		'audio_size': os.path.getsize(audio_file),
+		'num_lines': num_lines, 'num_turns': num_turns,
+		'num_found': len(found_lines),
+		'keywords_dict': keywords_dict}
+	jobs = []
+	if len(times) == 0:
+		return session,jobs
+
+	with metrics.stage('redundancy removal'):
+		times = OIRP.rem_redundant_times(times,config["time_thresh"])
+	metrics.count('times_kept',len(times))
+	all_lines = None
+	if not config.get('turn_cache',False):
+		with metrics.stage('transcript read'):
+			all_lines = OIRP.read_transcript(trans_file)
+	index = None
+	try:
+		with metrics.stage('window resolution'):
+			if all_lines is None:
+				index = cached_index(trans_file)
+				all_lines = index.lines
+			else:
+				index = TranscriptIndex(all_lines)
+			with WavSource(audio_file) as audio:
+				windows = OIRP.resolve_windows(index,times,config['time_range'],
+					audio,config.get('merge_windows',False))
+		metrics.count('windows',len(windows))
+
+		hit_lines = set(ind_lines)
+		for window in windows:
+			name = OIRP.clip_name(audio_file,window)
+			trans_name = None
+			if (form == '.ca' or form == '.cha'):
+				trans_name = name[:name.rfind(".")] + '.S.ca'
+			job = dict(window._asdict())
+			job.update({'audio_name': name, 'transcript_name': trans_name,
+				# Lines of the excerpt that are uppercased.
+				'hit_lines': [i for i in range(window.first_line,window.end_line)
+					if all_lines[i] in hit_lines]})
+			jobs.append(job)
+	finally:
+		# The transcript is closed with the index (see turn_cache).
+		if index is not None:
+			index.close()
+	return session,jobs
+
+# Function that plans the clips of several sessions.
+# Every query of the configuration is planned for every session; with
+# several queries, the clips of each query go to a directory named after it
+# inside the output directory of the session, as with OIRP.run_queries.
+# Inputs -> List of (transcript, audio, output) triples, the list of
+#			configurations (queries) and whether to record the metrics of
+#			every session.
+# Output -> The plan and a list of (transcript, error) for the sessions that
+#			could not be planned.
+def make_plan(sessions,configs,record_metrics=False):
+	plan = {'version': PLAN_VERSION, 'configs': configs, 'sessions': [],
+		'jobs': []}
+	failed = []
+	for trans_file,audio_file,output in sessions:
+		for i,config in enumerate(configs):
+			out_dir_name = output
+			label = trans_file
+			if len(configs) > 1:
+				if out_dir_name is None:
+					out_dir_name = audio_file[:audio_file.rfind('.')] +'-results'
+				out_dir_name = os.path.join(out_dir_name,
+					OIRP.query_name(configs,i))
+				label = '{} ({})'.format(trans_file,OIRP.query_name(configs,i))
+			metrics = Metrics() if record_metrics else NO_METRICS
+			try:
+				session,jobs = plan_session(trans_file,audio_file,out_dir_name,
+					config,metrics)
+			except Exception:
+				failed.append((label,traceback.format_exc()))
+				continue
+			session['query'] = i
+			session['metrics'] = metrics.to_dict()
+			for job in jobs:
+				job['id'] = len(plan['jobs'])
+				job['session'] = len(plan['sessions'])
+				plan['jobs'].append(job)
+			plan['sessions'].append(session)
+	return plan,failed
+
+# Function that writes a plan, with the paths relative to the plan.
+def write_plan(filename,plan):
+	base = os.path.dirname(os.path.abspath(filename))
+	sessions = []
+	for session in plan['sessions']:
+		session = dict(session)
+		for key in ('transcript','audio','output'):
+			session[key] = os.path.relpath(os.path.abspath(session[key]),base)
+		sessions.append(session)
+	with open(filename,'w') as f:
+		json.dump(dict(plan,sessions=sessions),f,indent=2,sort_keys=True)
+
+# Function that reads a plan, with the paths relative to the working
+# directory.
+def read_plan(filename):
+	plan = OIRP.read_json(filename)
+	if plan.get('version') != PLAN_VERSION:
+		raise ValueError("Unsupported plan version: {}".format(
+			plan.get('version')))
+	base = os.path.dirname(filename)
+	for session in plan['sessions']:
+		for key in ('transcript','audio','output'):
+			session[key] = os.path.normpath(os.path.join(base,session[key]))
+	return plan
+
+# Function that selects the jobs of a plan to execute.
+# Inputs -> The plan, the shard as (K, N) (the K-th of N contiguous parts,
+#			from 1) and a list of job ids. Either may be None.
+# Output -> The selected jobs, in the order of their ids.
+def select_jobs(plan,shard=None,ids=None):
+	jobs = plan['jobs']
+	if shard is not None:
+		k,n = shard
+		jobs = jobs[(k - 1) * len(jobs) // n:k * len(jobs) // n]
+	if ids is not None:
+		missing = set(ids) - set(job['id'] for job in plan['jobs'])
+		if len(missing) > 0:
+			raise ValueError("Jobs not in the plan: {}".format(
+				", ".join(str(x) for x in sorted(missing))))
+		ids = set(ids)
+		jobs = [job for job in jobs if job['id'] in ids]
+	return jobs
+
+# Function that cuts the clips of some jobs of one session.
+# Inputs -> The configuration of the plan, the session entry, its jobs, the
+#			Metrics the stages are recorded in and on_clip (passed to
+#			export_clips).
+# Output -> Lists of the audio slice and transcript excerpt names.
+def execute_jobs(config,session,jobs,metrics=NO_METRICS,on_clip=None):
+	for key in ('transcript','audio'):
+		if not OIRP.file_exists(session[key]):
+			raise IOError("File does not exist: {}".format(session[key]))
+		if os.path.getsize(session[key]) != session[key + '_size']:
+			raise ValueError("File changed since the plan was made: {}".format(
+				session[key]))
+	form = session['transcript'][session['transcript'].rfind('.'):]
+	with metrics.stage('transcript read'):
+		# With the turn cache only the lines of the excerpts are read.
+		if config.get('turn_cache',False):
+			index = cached_index(session['transcript'])
+		else:
+			index = TranscriptIndex(OIRP.read_transcript(session['transcript']))
+		all_lines = index.lines
+	# The transcript is closed with the index (see turn_cache).
+	with index:
+		windows = [OIRP.Window(**dict((field,job[field])
+			for field in OIRP.Window._fields)) for job in jobs]
+		hit_lines = [all_lines[i] for job in jobs for i in job['hit_lines']]
+		if not os.path.exists(session['output']):
+			os.makedirs(session['output'])
+
+		with metrics.stage('audio open'):
+			audio = WavSource(session['audio'])
+		try:
+			with metrics.stage('export'):
+				return OIRP.export_clips(audio,index,windows,form,config["OIRs"],
+					hit_lines,session['output'],
+					config.get('export_threads',OIRP.EXPORT_THREADS),metrics,
+					on_clip,verify=config.get('verify_clips',False),
+					# Other jobs of the session may be executed elsewhere.
+					collect=False)
+		finally:
+			audio.close()
+
+# Function that runs one unit of an execution in a worker process.
+# Any failure is caught and returned so that it only affects those jobs.
+# The metrics are always recorded: their counters tell the clips written
+# from those already written.
+def run_execute_unit(work):
+	config,session,jobs = work
+	try:
+		metrics = Metrics()
+		execute_jobs(config,session,jobs,metrics)
+		return metrics.to_dict(),None
+	except Exception:
+		return None,traceback.format_exc()
+
+# Function that executes jobs of a plan on a pool of processes.
+# The jobs of a session are executed together (the recording is opened once
+# for them) unless they have to be split to keep all the processes busy.
+# Output -> List of (session, jobs, metrics, error) for every unit executed.
+def execute_plan(plan,jobs,processes=None):
+	processes = processes or multiprocessing.cpu_count()
+	size = max(1,-(-len(jobs) // processes))
+	units = []
+	for job in jobs:
+		if (len(units) == 0 or units[-1][1][0]['session'] != job['session'] or
+			len(units[-1][1]) == size):
+			units.append((plan['sessions'][job['session']],[]))
+		units[-1][1].append(job)
+
+	# Only the configuration of the query of the session is sent to the
+	# workers.
+	work = [(plan['configs'][session['query']],session,unit_jobs)
+		for session,unit_jobs in units]
+	pool = multiprocessing.Pool(processes=processes,
+		initializer=OIRP.init_batch_worker)
+	try:
+		results = []
+		for i,(metrics,error) in enumerate(pool.imap(run_execute_unit,work)):
+			session,unit_jobs = units[i]
+			status = 'FAILED' if error is not None else 'done'
+			print("[{}/{}] {}: {} clips of {}".format(i+1,len(units),status,
+				len(unit_jobs),session['transcript']))
+			results.append((session,unit_jobs,metrics,error))
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
+# Function that parses a shard given as K/N.
+def parse_shard(text):
+	try:
+		k,n = [int(x) for x in text.split('/')]
+	except ValueError:
+		raise argparse.ArgumentTypeError("shard must be given as K/N")
+	if n < 1 or k < 1 or k > n:
+		raise argparse.ArgumentTypeError("shard must be given as K/N with"
+			" 1 <= K <= N")
+	return k,n
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description = 'Plan the clips of Saulbot extractions and execute the'
+			' plans')
+	parser.add_argument('mode', choices = ['plan','execute'],
+		help = 'plan: search the transcripts and write the clip jobs,'
+			' execute: cut the clips of a plan')
+	parser.add_argument('-config', action = 'store', dest = 'config_file',
+		default = None, help = 'configuration of the search (plan)')
+	parser.add_argument('-transcript', action = 'store', dest = 'trans_file',
+		default = None)
+	parser.add_argument('-audio', action = 'store', dest = 'audio_file',
+		default = None)
+	parser.add_argument('-manifest', action = 'store', dest = 'manifest_file',
+		default = None, help = 'CSV or JSON list of transcript/audio/output'
+			' triples to plan')
+	parser.add_argument('-directory', action = 'store', dest = 'in_direc',
+		default = None, help = 'directory of .ca transcripts paired with .wav'
+			' files of the same name to plan')
+	parser.add_argument('-output', action = 'store', dest = 'plan_out',
+		default = None, help = 'file the plan is written to (plan)')
+	parser.add_argument('-plan', action = 'store', dest = 'plan_file',
+		default = None, help = 'plan to execute (execute)')
+	parser.add_argument('-shard', action = 'store', dest = 'shard',
+		type = parse_shard, default = None, help = 'execute only the K-th of'
+			' N parts of the jobs, given as K/N')
+	parser.add_argument('-ids', action = 'store', dest = 'ids', type = int,
+		nargs = '+', default = None, help = 'execute only the jobs with these'
+			' ids')
+	parser.add_argument('-jobs', action = 'store', dest = 'jobs', type = int,
+		default = None, help = 'number of processes cutting clips (default:'
+			' number of cores)')
+	parser.add_argument('-metrics', '--metrics', action = 'store',
+		dest = 'metrics_file', default = None, help = 'JSON file the time'
+			' spent in each stage and the counters are written to')
+	args = parser.parse_args()
+
+	if args.mode == 'plan':
+		if args.config_file == None or args.plan_out == None:
+			parser.error("plan needs -config and -output")
+		if (args.manifest_file == None and args.in_direc == None and
+			(args.trans_file == None or args.audio_file == None)):
+			parser.error("either -transcript and -audio, -manifest or"
+				" -directory is required")
+		if (not OIRP.file_exists(args.config_file) or
+			(args.manifest_file != None and
+				not OIRP.file_exists(args.manifest_file)) or
+			(args.in_direc != None and not os.path.isdir(args.in_direc))):
+			print("File does not exist\nExiting...")
+			sys.exit()
+		configs = OIRP.read_json(args.config_file)
+		try:
+			OIRP.check_configs(configs)
+			if any(config.get('archive') is not None for config in configs):
+				raise ValueError("Archives are not supported in plans, the"
+					" clips are written as separate files")
+			sessions = []
+			if args.trans_file != None and args.audio_file != None:
+				sessions.append((args.trans_file,args.audio_file,None))
+			if args.manifest_file != None:
+				sessions += OIRP.read_manifest(args.manifest_file)
+			if args.in_direc != None:
+				sessions += OIRP.pair_directory(args.in_direc)
+		except (ValueError,KeyError) as e:
+			print("ERROR: {}\nExiting...".format(e))
+			sys.exit()
+
+		metrics = Metrics()
+		plan,failed = make_plan(sessions,configs,args.metrics_file != None)
+		write_plan(args.plan_out,plan)
+		for trans_file,error in failed:
+			print("FAILED: {}\n\t{}".format(trans_file,
+				error.strip().replace('\n','\n\t')))
+		print("{} clips planned for {} sessions, written to {}".format(
+			len(plan['jobs']),len(plan['sessions']),args.plan_out))
+		if args.metrics_file != None:
+			files = [(session['transcript'],session['metrics'])
+				for session in plan['sessions']]
+			# The stages and counters of the run are those of its sessions.
+			for trans_file,session_metrics in files:
+				metrics.add(session_metrics)
+			write_metrics(args.metrics_file,metrics.to_dict(),files)
+		if len(failed) > 0:
+			sys.exit(1)
+	else:
+		if args.plan_file == None:
+			parser.error("execute needs -plan")
+		if not OIRP.file_exists(args.plan_file):
+			print("File does not exist\nExiting...")
+			sys.exit()
+		if (args.jobs != None and args.jobs < 1):
+			print('ERROR: The number of jobs must be at least 1\nExiting...')
+			sys.exit()
+		try:
+			plan = read_plan(args.plan_file)
+			jobs = select_jobs(plan,args.shard,args.ids)
+		except (ValueError,KeyError) as e:
+			print("ERROR: Invalid plan: {}\nExiting...".format(e))
+			sys.exit()
+
+		metrics = Metrics()
+		results = execute_plan(plan,jobs,args.jobs)
+		failed = [(session,unit_jobs,error)
+			for session,unit_jobs,unit_metrics,error in results
+			if error is not None]
+		for session,unit_jobs,error in failed:
+			print("FAILED: {}\n\t{}".format(session['transcript'],
+				error.strip().replace('\n','\n\t')))
+		# Clips already written by an earlier execution are skipped.
+		skipped = sum(unit_metrics['counters'].get('clips_kept',0)
+			for session,unit_jobs,unit_metrics,error in results
+			if error is None)
+		print("{} of {} clips written, {} already written were skipped".format(
+			len(jobs) - skipped -
+			sum(len(unit_jobs) for session,unit_jobs,error in failed),
+			len(jobs),skipped))
+		if args.metrics_file != None:
+			files = [(session['transcript'],unit_metrics)
+				for session,unit_jobs,unit_metrics,error in results
+				if error is None]
+			# The stages and counters of the run are those of its sessions.
+			for trans_file,session_metrics in files:
+				metrics.add(session_metrics)
+			write_metrics(args.metrics_file,metrics.to_dict(),files)
+		if len(failed) > 0:
+			print("Failed job ids (execute again with -ids): {}".format(
+				" ".join(str(job['id']) for session,unit_jobs,error in failed
+					for job in unit_jobs)))
+			sys.exit(1)
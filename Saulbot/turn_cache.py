@@ -0,0 +1,217 @@
+'''
+	Binary sidecar cache of parsed transcripts for Saulbot.
+
+	Parsing a transcript into a TranscriptIndex goes over every line of its
+	text. With the "turn_cache" setting the parsed turn table is saved next
+	to the transcript (session.S.ca.turns for session.S.ca) the first time,
+	and later runs map it into memory instead of parsing the text again.
+	Processes working on the same transcript share the pages of the map.
+
+	The sidecar is a fixed layout file:
+
+		magic		b'SAULTURN'
+		header		length (4 bytes, little-endian) and JSON: version, size,
+					modification time and SHA-1 of the transcript, number of
+					turns and lines and the speaker names
+		arrays		aligned on 8 bytes, little-endian: start and end times,
+					first and bullet lines of every turn (int64), the byte
+					offset of every line in the transcript and of its end
+					(int64) and the speaker of every turn (int32)
+
+	A sidecar is used if the transcript has the same size and modification
+	time, or the same size and SHA-1 (a copied transcript), as when it was
+	written; otherwise it is written again. The line offsets let excerpts
+	be read from the transcript without reading the rest of it
+	(TranscriptLines).
+'''
+
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from turn_index import TranscriptIndex
+
+MAGIC = b'SAULTURN'
+VERSION = 1
+SIDECAR_SUFFIX = '.turns'
+
+
+class TranscriptLines(object):
+
+	# A read-only list of the lines of a transcript, read from the file by
+	# their byte offsets when they are used. Lines are decoded the same way
+	# as OIRP.read_transcript reads them.
+	def __init__(self, filename, offsets):
+		self.filename = filename
+		self._offsets = offsets
+		self._file = open(filename, 'rb')
+		self._map = None
+		if offsets[-1] > 0:
+			self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	def close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+		self._file.close()
+
+	def __len__(self):
+		return len(self._offsets) - 1
+
+	def _line(self, i):
+		line = self._map[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+		# Universal newlines, as in text mode.
+		if line.endswith(u'\r\n'):
+			return line[:-2] + u'\n'
+		if line.endswith(u'\r'):
+			return line[:-1] + u'\n'
+		return line
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			return [self._line(i) for i in range(*key.indices(len(self)))]
+		if key < 0:
+			key += len(self)
+		if not 0 <= key < len(self):
+			raise IndexError('line out of range')
+		return self._line(key)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self._line(i)
+
+
+# Function that returns the filename of the sidecar of a transcript.
+def sidecar_name(trans_file):
+	return trans_file + SIDECAR_SUFFIX
+
+# Function that returns the byte offsets of the lines of a text and of its
+# end, splitting lines the same way as universal newlines.
+def line_offsets(data):
+	text = np.frombuffer(data, dtype=np.uint8)
+	cr = text == 13
+	# A \r ends a line unless it is followed by \n.
+	cr[:-1] &= text[1:] != 10
+	ends = np.flatnonzero((text == 10) | cr) + 1
+	return np.unique(np.concatenate([[0], ends, [len(text)]])).astype(np.int64)
+
+# Function that writes the sidecar of a transcript.
+# Inputs -> Filename of the transcript, its contents, their line offsets and
+#			its TranscriptIndex.
+def write_sidecar(trans_file, data, offsets, index):
+	stat = os.stat(trans_file)
+	header = json.dumps({'version': VERSION, 'size': stat.st_size,
+		'mtime': stat.st_mtime, 'sha1': hashlib.sha1(data).hexdigest(),
+		'num_turns': len(index.starts), 'num_lines': len(offsets) - 1,
+		'speaker_names': index.speaker_names}).encode('utf-8')
+	# Padding the header so that the arrays are aligned.
+	header += b' ' * (-(len(MAGIC) + 4 + len(header)) % 8)
+	arrays = [np.asarray(x, dtype='<i8') for x in (index.starts, index.ends,
+		index.first_lines, index.bullet_lines, offsets)]
+	arrays.append(np.asarray(index.speakers, dtype='<i4'))
+
+	# Written under a temporary name so that other processes never see a
+	# partial sidecar.
+	filename = sidecar_name(trans_file)
+	temp = '{}.{}.tmp'.format(filename, os.getpid())
+	try:
+		with open(temp, 'wb') as f:
+			f.write(MAGIC + struct.pack('<I', len(header)) + header)
+			for array in arrays:
+				f.write(array.tobytes())
+		os.rename(temp, filename)
+	finally:
+		if os.path.exists(temp):
+			os.remove(temp)
+
+# Function that reads the header of a sidecar.
+# Output -> The header and the offset of the arrays, or None if the file is
+#			not a sidecar of this version.
+def read_header(filename):
+	with open(filename, 'rb') as f:
+		start = f.read(len(MAGIC) + 4)
+		if len(start) < len(MAGIC) + 4 or start[:len(MAGIC)] != MAGIC:
+			return None
+		length = struct.unpack('<I', start[len(MAGIC):])[0]
+		try:
+			header = json.loads(f.read(length).decode('utf-8'))
+		except ValueError:
+			return None
+	if header.get('version') != VERSION:
+		return None
+	return header, len(MAGIC) + 4 + length
+
+# Function that checks that a sidecar was written for the transcript as it
+# is now.
+def is_fresh(trans_file, header):
+	stat = os.stat(trans_file)
+	if stat.st_size != header['size']:
+		return False
+	if stat.st_mtime == header['mtime']:
+		return True
+	digest = hashlib.sha1()
+	with open(trans_file, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+	return digest.hexdigest() == header['sha1']
+
+# Function that maps the sidecar of a transcript into memory.
+# Inputs -> Filename of the transcript and its lines (None to read them from
+#			the transcript when they are used).
+# Output -> The TranscriptIndex, or None if there is no fresh sidecar.
+def load_sidecar(trans_file, lines=None):
+	filename = sidecar_name(trans_file)
+	if not os.path.isfile(filename):
+		return None
+	found = read_header(filename)
+	if found is None or not is_fresh(trans_file, found[0]):
+		return None
+	header, start = found
+	num_turns, num_lines = header['num_turns'], header['num_lines']
+	if (os.path.getsize(filename) !=
+		start + 8 * (4 * num_turns + num_lines + 1) + 4 * num_turns):
+		return None
+	data = np.memmap(filename, dtype=np.uint8, mode='r', offset=start)
+	arrays = []
+	pos = 0
+	for dtype, count in (('<i8', num_turns),) * 4 + (('<i8', num_lines + 1),
+		('<i4', num_turns)):
+		size = np.dtype(dtype).itemsize * count
+		arrays.append(data[pos:pos + size].view(dtype))
+		pos += size
+	starts, ends, first_lines, bullet_lines, offsets, speakers = arrays
+	if lines is None:
+		lines = TranscriptLines(trans_file, offsets)
+	elif len(lines) != num_lines:
+		return None
+	return TranscriptIndex.from_arrays(lines, header['speaker_names'],
+		speakers, starts, ends, first_lines, bullet_lines)
+
+# Function that returns the TranscriptIndex of a transcript from its sidecar,
+# parsing the transcript and writing the sidecar if it is missing or stale.
+# Inputs -> Filename of the transcript and its lines, if they were already
+#			read (otherwise they are read from the transcript when they are
+#			used, if the sidecar is fresh; the index must then be closed).
+def cached_index(trans_file, lines=None):
+	index = load_sidecar(trans_file, lines)
+	if index is not None:
+		return index
+	with open(trans_file, 'rb') as f:
+		data = f.read()
+	if lines is None:
+		with io.open(trans_file, 'r', encoding='utf-8') as txt_file:
+			lines = txt_file.readlines()
+	index = TranscriptIndex(lines)
+	offsets = line_offsets(data)
+	if len(offsets) - 1 == len(lines):
+		try:
+			write_sidecar(trans_file, data, offsets, index)
+		except (IOError, OSError):
+			# The directory of the transcript may be read-only.
+			pass
+	return index
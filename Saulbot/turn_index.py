@@ -0,0 +1,292 @@
+'''
+	Parsed transcript index for Saulbot.
+
+	A TranscriptIndex parses a .ca/.cha transcript once and stores every
+	timed turn (speaker, start and end times from the \x15start_end\x15 bullet
+	and the span of lines making up the turn) in compact typed arrays.
+	Extraction windows are then resolved with binary search on the turn
+	start times and transcript excerpts are copied by line range, so the
+	cost of extraction scales with the number of hits instead of
+	hits x transcript length. The windows of all the hits can be resolved
+	at once with the vectorized windows and line_ranges.
+
+	read_turns assembles the turns of a transcript in a single forward pass
+	over its lines (e.g. straight from the open file), holding only the
+	lines of the turns not finished yet.
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+import numpy as np
+
+BULLET = u'\x15'
+
+
+# Function that parses the first bullet of a line.
+# Returns (start_ms, end_ms) or None if the line has no valid bullet.
+def parse_bullet(line):
+	first = line.find(BULLET)
+	if first == -1:
+		return None
+	last = line.find(BULLET, first + 1)
+	if last == -1:
+		return None
+	times = line[first + 1:last]
+	sep = times.find('_')
+	try:
+		if sep == -1:
+			start = end = int(float(times))
+		else:
+			start = int(float(times[:sep]))
+			end = int(float(times[sep + 1:]))
+	except ValueError:
+		return None
+	return start, end
+
+
+# Function that checks whether a line starts a speaker tier (*SPK:).
+def speaker_tier(line):
+	return line.startswith('*') and ':' in line
+
+
+# A turn: its range of lines [first_line, end_line) in the transcript, its
+# lines and the line numbers the turn was assembled for (see read_turns).
+# The speaker and times are parsed when they are used.
+class Turn(namedtuple('Turn', ['first_line', 'end_line', 'lines',
+		'line_nums'])):
+	__slots__ = ()
+
+	@property
+	def text(self):
+		return u''.join(self.lines)
+
+	# The name of the speaker if the turn starts at a speaker tier.
+	@property
+	def speaker(self):
+		line = self.lines[0]
+		if speaker_tier(line):
+			return line[1:line.find(':')]
+		return None
+
+	# The (start_ms, end_ms) of the first bullet of the turn or None.
+	@property
+	def bullet(self):
+		for j, line in enumerate(self.lines):
+			if BULLET in line:
+				# A bullet is normally on a single line.
+				if line.count(BULLET) < 2:
+					line = u''.join(self.lines[j:])
+				return parse_bullet(line)
+		return None
+
+
+# Generator that reads the turns of a transcript in one pass over its lines.
+# A turn starts at the last line with a ':' (a speaker tier, but also a
+# header or dependent tier) and ends at the line carrying its bullet. A line
+# after a bullet that does not start a new turn closes a turn that runs from
+# the last start to that line. Lines before any start belong to a turn
+# starting at the first line, and the lines after the last bullet to a
+# turn without a bullet.
+# Every line is in the line_nums of exactly one turn. Turns are yielded in
+# the order of their lines.
+# Only the lines since the start of the current turn are kept.
+def read_turns(lines):
+	# Line number of the current turn start and of the last bullet line.
+	start = 0
+	last_bullet = -1
+	# Lines kept from line number base on.
+	kept = []
+	base = 0
+	# Turns waiting for their bullet: [first line, line numbers].
+	pending = []
+	i = -1
+	for i, line in enumerate(lines):
+		kept.append(line)
+		if ':' in line:
+			start = i
+		if last_bullet >= start:
+			# The turn already has its bullet and ends at this line.
+			yield Turn(start, i + 1, kept[start - base:], [i])
+		elif pending and pending[-1][0] == start:
+			pending[-1][1].append(i)
+		else:
+			pending.append([start, [i]])
+		if BULLET in line and pending:
+			last_bullet = i
+			for first, line_nums in pending:
+				yield Turn(first, i + 1, kept[first - base:], line_nums)
+			pending = []
+		elif pending or start == base:
+			continue
+		# Dropping the lines no turn can include any more.
+		del kept[:start - base]
+		base = start
+	for first, line_nums in pending:
+		yield Turn(first, i + 1, kept[first - base:], line_nums)
+
+
+class TranscriptIndex(object):
+
+	def __init__(self, lines):
+		self.lines = lines
+		self.speaker_names = []
+		speaker_ids = {}
+		# One entry per timed turn, in transcript order.
+		self.speakers = array('i')
+		self.starts = array('l')
+		self.ends = array('l')
+		# First line of the turn and the line carrying its bullet.
+		self.first_lines = array('l')
+		self.bullet_lines = array('l')
+
+		turn_start = 0
+		speaker = -1
+		for i, line in enumerate(lines):
+			# A speaker tier starts a new turn.
+			if speaker_tier(line):
+				name = line[1:line.find(':')]
+				if name not in speaker_ids:
+					speaker_ids[name] = len(self.speaker_names)
+					self.speaker_names.append(name)
+				speaker = speaker_ids[name]
+				turn_start = i
+			bullet = parse_bullet(line)
+			if bullet is None:
+				continue
+			self.speakers.append(speaker)
+			self.starts.append(bullet[0])
+			self.ends.append(bullet[1])
+			self.first_lines.append(turn_start)
+			self.bullet_lines.append(i)
+			# The bullet closes the turn.
+			turn_start = i + 1
+			speaker = -1
+
+		self.speakers = np.array(self.speakers, dtype=np.int32)
+		self.starts = np.array(self.starts, dtype=np.int64)
+		self.ends = np.array(self.ends, dtype=np.int64)
+		self.first_lines = np.array(self.first_lines, dtype=np.int64)
+		self.bullet_lines = np.array(self.bullet_lines, dtype=np.int64)
+		self._sort()
+
+	# Function that makes an index from turn arrays parsed before (see
+	# turn_cache), without parsing the lines.
+	@classmethod
+	def from_arrays(cls, lines, speaker_names, speakers, starts, ends,
+			first_lines, bullet_lines):
+		index = cls.__new__(cls)
+		index.lines = lines
+		index.speaker_names = list(speaker_names)
+		index.speakers = speakers
+		index.starts = starts
+		index.ends = ends
+		index.first_lines = first_lines
+		index.bullet_lines = bullet_lines
+		index._sort()
+		return index
+
+	def _sort(self):
+		# Binary search needs the start times in order. Gailbot transcripts
+		# already are, otherwise a sorted permutation is searched instead.
+		self._order = None
+		if np.any(self.starts[1:] < self.starts[:-1]):
+			# A stable sort keeps turns with the same start time in order.
+			self._order = np.argsort(self.starts, kind='mergesort')
+			self._sorted_starts = self.starts[self._order]
+		else:
+			self._sorted_starts = self.starts
+
+	def __len__(self):
+		return len(self.starts)
+
+	# Function that closes the transcript the lines are read from, if they
+	# are read from it when they are used (see turn_cache.TranscriptLines).
+	def close(self):
+		if hasattr(self.lines, 'close'):
+			self.lines.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _entry(self, pos):
+		if self._order is None:
+			return pos
+		return self._order[pos]
+
+	# Function that resolves a time range in milliseconds to the turns that
+	# bound it: the latest turn starting at or before low_ms (or the first
+	# turn) and the earliest turn starting at or after high_ms (or the last
+	# turn). Returns the positions of both turns in start time order.
+	def window(self, low_ms, high_ms):
+		starts = self._sorted_starts
+		low = bisect_right(starts, low_ms) - 1
+		if low < 0:
+			low = 0
+		# Starting at the first turn with that start time.
+		low = bisect_left(starts, starts[low])
+		high = bisect_left(starts, high_ms)
+		if high == len(starts):
+			high = len(starts) - 1
+		return low, high
+
+	# Function that resolves many time ranges at once, the same way as
+	# window. Inputs and outputs are arrays.
+	def windows(self, low_ms, high_ms):
+		starts = self._sorted_starts
+		low = np.searchsorted(starts, low_ms, side='right') - 1
+		low = np.maximum(low, 0)
+		low = np.searchsorted(starts, starts[low], side='left')
+		high = np.searchsorted(starts, high_ms, side='left')
+		high = np.minimum(high, len(starts) - 1)
+		return low, high
+
+	def start_at(self, pos):
+		return self._sorted_starts[pos]
+
+	# Function that returns the range of lines [first, end) of the
+	# transcript excerpt between the turns at the given positions.
+	# The excerpt runs from the bullet line of the low turn up to and
+	# including the next bullet line starting at the high turn's time, or
+	# to the end of the transcript if there is none.
+	def line_range(self, low, high):
+		starts = self._sorted_starts
+		first = self.bullet_lines[self._entry(low)]
+		high_time = starts[high]
+		pos = bisect_left(starts, high_time, low + 1)
+		while pos < len(starts) and starts[pos] == high_time:
+			line = self.bullet_lines[self._entry(pos)]
+			if line > first:
+				return first, line + 1
+			pos += 1
+		return first, len(self.lines)
+
+	# Function that returns the line ranges of many windows at once, the
+	# same way as line_range. Inputs and outputs are arrays.
+	def line_ranges(self, low, high):
+		if self._order is not None:
+			# The bullet lines are not in start time order, so the ranges
+			# are found one by one.
+			ranges = [self.line_range(l, h) for l, h in zip(low, high)]
+			return (np.array([r[0] for r in ranges], dtype=np.int64),
+				np.array([r[1] for r in ranges], dtype=np.int64))
+		starts = self._sorted_starts
+		first = self.bullet_lines[low]
+		# Turns after the low turn have later bullet lines, so the end is the
+		# bullet line of the first turn after it starting at the high time.
+		pos = np.maximum(low + 1,
+			np.searchsorted(starts, starts[high], side='left'))
+		found = pos < len(starts)
+		pos = np.minimum(pos, len(starts) - 1)
+		found &= starts[pos] == starts[high]
+		end = np.where(found, self.bullet_lines[pos] + 1, len(self.lines))
+		return first, end
+
+	# Function that returns the lines of the excerpt between two turns.
+	def excerpt(self, low, high):
+		first, end = self.line_range(low, high)
+		return self.lines[first:end]
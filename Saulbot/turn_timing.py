@@ -0,0 +1,309 @@
+'''
+	Turn-timing analytics for Saulbot transcripts.
+
+	The timed turns of every transcript (the speaker and the start and end
+	times of the \x15start_end\x15 bullets, as parsed by TranscriptIndex) are
+	put in start time order and measured with numpy over the whole arrays:
+
+		duration		end - start of a turn
+		gap				start of a turn - end of the turn before it; negative
+						gaps are overlaps. Gaps between different speakers
+						are transitions, gaps between turns of the same
+						speaker are pauses within a speaker.
+
+	With a configuration file, the turns with keyword hits (any of its
+	queries) are compared with the other turns (the baseline): their
+	durations, the transition into them and the transition out of them
+	(the response to them).
+
+	Three CSV files are written to the output directory:
+
+		timing_turns.csv	one row per timed turn of every transcript
+		timing_summary.csv	statistics (count, mean, std, percentiles and
+							the share of negative values) of every measure,
+							per transcript and for the whole corpus (ALL)
+		timing_gaps.csv		histograms of the transition and pause gaps
+
+	Usage:
+		python turn_timing.py (-transcript T.ca | -manifest M | -directory D)
+			[-config config.json] -output [Directory]
+'''
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+import OIRP
+from corpus_index import csv_text, list_transcripts
+from turn_cache import cached_index
+from turn_index import TranscriptIndex, read_turns
+
+# Columns of the turn table, in the order they are written.
+TURN_COLUMNS = ('turn', 'speaker', 'start_ms', 'end_ms', 'duration_ms',
+	'gap_ms', 'speaker_change', 'hit')
+
+# Statistics of the summary.
+SUMMARY_COLUMNS = ('count', 'mean', 'std', 'min', 'p5', 'p25', 'median', 'p75',
+	'p95', 'max', 'negative_share')
+PERCENTILES = (0, 5, 25, 50, 75, 95, 100)
+
+# Bins of the gap histograms in ms (with one more bin on each side for the
+# gaps outside the range).
+GAP_RANGE = 2000
+GAP_BIN = 100
+
+
+# Function that builds the turn table of a transcript.
+# Inputs -> The TranscriptIndex of the transcript and the line numbers of
+#			the lines with keyword hits.
+# Output -> Dictionary of the columns of TURN_COLUMNS as arrays, with the
+#			turns in start time order. turn is the position of the turn in
+#			the transcript, speaker the speaker name, gap_ms is NaN for the
+#			first turn and speaker_change is -1 where a speaker is unknown.
+def turn_table(index, hit_nums=()):
+	# A stable sort keeps turns with the same start time in order.
+	order = np.argsort(index.starts, kind='mergesort')
+	starts = index.starts[order]
+	ends = index.ends[order]
+	speakers = index.speakers[order]
+	num_turns = len(order)
+
+	gaps = np.full(num_turns, np.nan)
+	gaps[1:] = starts[1:] - ends[:-1]
+	change = np.full(num_turns, -1, dtype=np.int8)
+	known = (speakers[1:] >= 0) & (speakers[:-1] >= 0)
+	change[1:][known] = speakers[1:][known] != speakers[:-1][known]
+
+	# The turn of a line is the first turn whose bullet is at or after it,
+	# if the turn starts at or before it.
+	hit = np.zeros(num_turns, dtype=bool)
+	lines = np.asarray(hit_nums, dtype=np.int64)
+	turns = np.searchsorted(index.bullet_lines, lines, side='left')
+	inside = turns < num_turns
+	turns, lines = turns[inside], lines[inside]
+	turns = turns[index.first_lines[turns] <= lines]
+	position = np.empty(num_turns, dtype=np.int64)
+	position[order] = np.arange(num_turns)
+	hit[position[turns]] = True
+
+	names = np.array(index.speaker_names + [u''], dtype=object)
+	return {'turn': order, 'speaker': names[speakers], 'start_ms': starts,
+		'end_ms': ends, 'duration_ms': ends - starts, 'gap_ms': gaps,
+		'speaker_change': change, 'hit': hit}
+
+# Function that joins the turn tables of several transcripts.
+# Output -> The joined table and the array of the transcript of every turn.
+def join_tables(tables):
+	sessions = np.concatenate([np.full(len(table['turn']), i, dtype=np.int32)
+		for i, (name, table) in enumerate(tables)] or
+		[np.zeros(0, dtype=np.int32)])
+	joined = {}
+	for column in TURN_COLUMNS:
+		joined[column] = np.concatenate([table[column]
+			for name, table in tables]) if tables else np.zeros(0)
+	# The first turn of a transcript has no turn before it.
+	first = np.ones(len(sessions), dtype=bool)
+	first[1:] = sessions[1:] != sessions[:-1]
+	joined['gap_ms'] = np.where(first, np.nan, joined['gap_ms'])
+	joined['speaker_change'] = np.where(first, -1, joined['speaker_change'])
+	return joined, sessions
+
+# Function that returns the statistics of SUMMARY_COLUMNS of some values
+# (the NaNs are left out).
+def describe(values):
+	values = np.asarray(values, dtype=np.float64)
+	values = values[~np.isnan(values)]
+	if len(values) == 0:
+		return [0] + [''] * (len(SUMMARY_COLUMNS) - 1)
+	low, p5, p25, median, p75, p95, high = np.percentile(values, PERCENTILES)
+	return [len(values), values.mean(), values.std(), low, p5, p25, median,
+		p75, p95, high, np.mean(values < 0)]
+
+# Function that measures a turn table.
+# Output -> List of (measure, group, values) for the summary.
+def measures(table):
+	duration = table['duration_ms']
+	gaps = table['gap_ms']
+	change = table['speaker_change']
+	hit = table['hit']
+	transition = change == 1
+	# The transition out of a turn is the transition into the next one.
+	after = np.full(len(gaps), np.nan)
+	after[:-1] = np.where(transition[1:], gaps[1:], np.nan)
+
+	rows = [('duration_ms', 'all', duration)]
+	speakers = table['speaker']
+	if len(speakers) > 0:
+		names, groups = np.unique(speakers, return_inverse=True)
+		for i, name in enumerate(names):
+			rows.append(('duration_ms', u'speaker ' + (name or u'unknown'),
+				duration[groups == i]))
+	rows += [('gap_ms transition', 'all', gaps[transition]),
+		('gap_ms pause', 'all', gaps[change == 0])]
+	if hit.any():
+		rows += [('duration_ms', 'hit', duration[hit]),
+			('duration_ms', 'baseline', duration[~hit]),
+			('gap_ms transition', 'into hit', gaps[transition & hit]),
+			('gap_ms transition', 'into baseline', gaps[transition & ~hit]),
+			('gap_ms transition', 'after hit', after[hit]),
+			('gap_ms transition', 'after baseline', after[~hit])]
+	return rows
+
+# Function that returns the histograms of the transition and pause gaps.
+# Output -> List of (measure, bin low, bin high, count).
+def gap_histograms(table):
+	edges = np.arange(-GAP_RANGE, GAP_RANGE + GAP_BIN, GAP_BIN)
+	edges = np.concatenate([[-np.inf], edges, [np.inf]])
+	rows = []
+	for measure, selected in (('gap_ms transition',
+			table['speaker_change'] == 1),
+			('gap_ms pause', table['speaker_change'] == 0)):
+		counts = np.histogram(table['gap_ms'][selected], edges)[0]
+		rows += zip([measure] * len(counts), edges[:-1], edges[1:], counts)
+	return rows
+
+# Function that reads a transcript and builds its turn table.
+# Inputs -> Filename of the transcript, the configurations whose keyword
+#			hits are marked (may be empty) and whether the turns are loaded
+#			through the turn cache (then the text is only read for the
+#			keyword search).
+def transcript_table(trans_file, configs, turn_cache=False):
+	lines = None
+	hit_nums = []
+	if len(configs) > 0 or not turn_cache:
+		lines = OIRP.read_transcript(trans_file)
+	for config in configs:
+		OIRP.search_turns(read_turns(lines), config['OIRs'],
+			config['extraction_mode'].lower(), hit_nums)
+	if turn_cache:
+		with cached_index(trans_file, lines) as index:
+			return turn_table(index, hit_nums)
+	return turn_table(TranscriptIndex(lines), hit_nums)
+
+# Function that returns a value as written in the CSV files (NaN and
+# infinities are left empty).
+def csv_value(value):
+	if isinstance(value, float):
+		if not np.isfinite(value):
+			return ''
+		return int(value) if value.is_integer() else round(value, 3)
+	if isinstance(value, type(u'')):
+		return csv_text(value)
+	return value
+
+# Function that writes the three CSV files of the timing of some transcripts.
+# Inputs -> The output directory and a list of (transcript, turn table).
+def write_timing(out_dir_name, tables):
+	if not os.path.exists(out_dir_name):
+		os.makedirs(out_dir_name)
+	joined, sessions = join_tables(tables)
+	names = [name for name, table in tables]
+
+	with open(os.path.join(out_dir_name, 'timing_turns.csv'), 'w') as f:
+		writer = csv.writer(f)
+		writer.writerow(('transcript',) + TURN_COLUMNS)
+		# The columns are converted as a whole; the text is only encoded once
+		# per transcript and speaker.
+		columns = [np.array([csv_text(name) for name in names],
+			dtype=object)[sessions].tolist()]
+		for column in TURN_COLUMNS:
+			values = joined[column]
+			if column == 'speaker':
+				speakers, values = np.unique(values, return_inverse=True)
+				values = np.array([csv_text(name) for name in speakers],
+					dtype=object)[values]
+			elif column == 'gap_ms':
+				# The gaps are whole ms, except the missing first ones.
+				missing = np.isnan(values)
+				values = np.where(missing, 0, values).astype(np.int64).astype(object)
+				values[missing] = ''
+			elif column == 'hit':
+				values = values.astype(np.int8)
+			columns.append(values.tolist())
+		writer.writerows(zip(*columns))
+
+	summaries = [(name, table) for name, table in tables]
+	if len(tables) > 1:
+		summaries.append(('ALL', joined))
+	with open(os.path.join(out_dir_name, 'timing_summary.csv'), 'w') as f:
+		writer = csv.writer(f)
+		writer.writerow(('transcript', 'measure', 'group') + SUMMARY_COLUMNS)
+		for name, table in summaries:
+			for measure, group, values in measures(table):
+				writer.writerow([csv_text(name), measure, csv_text(group)] +
+					[csv_value(value) for value in describe(values)])
+
+	with open(os.path.join(out_dir_name, 'timing_gaps.csv'), 'w') as f:
+		writer = csv.writer(f)
+		writer.writerow(('transcript', 'measure', 'bin_low_ms', 'bin_high_ms',
+			'count'))
+		for name, table in summaries:
+			for measure, low, high, count in gap_histograms(table):
+				writer.writerow([csv_text(name), measure, csv_value(low),
+					csv_value(high), count])
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description = 'Turn-timing statistics of transcripts')
+	parser.add_argument('-transcript', action = 'store', dest = 'trans_file',
+		default = None)
+	parser.add_argument('-manifest', action = 'store', dest = 'manifest_file',
+		default = None, help = 'CSV or JSON list of transcript/audio/output'
+			' triples (only the transcripts are used)')
+	parser.add_argument('-directory', action = 'store', dest = 'in_direc',
+		default = None, help = 'directory of .ca/.cha transcripts')
+	parser.add_argument('-config', action = 'store', dest = 'config_file',
+		default = None, help = 'configuration whose keyword hits are compared'
+			' with the other turns')
+	parser.add_argument('-output', action = 'store', dest = 'out_dir_name',
+		required = True, help = 'directory the CSV files are written to')
+	parser.add_argument('-turn-cache', action = 'store_true',
+		dest = 'turn_cache', default = False, help = 'load the turns from the'
+			' sidecar of every transcript, writing it if needed (see'
+			' turn_cache)')
+	args = parser.parse_args()
+
+	if (args.trans_file == None and args.manifest_file == None and
+		args.in_direc == None):
+		parser.error("either -transcript, -manifest or -directory is required")
+	if ((args.trans_file != None and not OIRP.file_exists(args.trans_file)) or
+		(args.manifest_file != None and
+			not OIRP.file_exists(args.manifest_file)) or
+		(args.in_direc != None and not os.path.isdir(args.in_direc)) or
+		(args.config_file != None and not OIRP.file_exists(args.config_file))):
+		print("File does not exist\nExiting...")
+		sys.exit()
+
+	configs = []
+	try:
+		if args.config_file != None:
+			configs = OIRP.read_json(args.config_file)
+			OIRP.check_configs(configs)
+		transcripts = []
+		if args.trans_file != None:
+			transcripts.append(args.trans_file)
+		if args.manifest_file != None:
+			transcripts += [trans_file for trans_file, audio_file, output in
+				OIRP.read_manifest(args.manifest_file)]
+		if args.in_direc != None:
+			transcripts += list_transcripts(args.in_direc)
+	except (ValueError, KeyError) as e:
+		print("ERROR: {}\nExiting...".format(e))
+		sys.exit()
+
+	tables = []
+	for trans_file in transcripts:
+		try:
+			tables.append((trans_file, transcript_table(trans_file, configs,
+				args.turn_cache)))
+		except (IOError, UnicodeDecodeError) as e:
+			print("WARNING: Skipping {}: {}".format(trans_file, e))
+	write_timing(args.out_dir_name, tables)
+	print("Timing of {} turns in {} transcripts written to {}".format(
+		sum(len(table['turn']) for name, table in tables), len(tables),
+		args.out_dir_name))
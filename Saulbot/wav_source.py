@@ -0,0 +1,169 @@
+'''
+	Audio source layer for Saulbot.
+
+	A WavSource opens a WAV recording once and serves every slice from it.
+	Only the RIFF header is parsed; the sample data is memory-mapped and
+	slices are read straight from the data chunk by byte offset, so the
+	recording is never decoded as a whole and memory stays flat regardless
+	of the length of the recording.
+'''
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# Size of the blocks copied from the memory map when writing a slice.
+COPY_BLOCK_SIZE = 1 << 20
+
+
+class WavFormatError(Exception):
+	pass
+
+
+class WavSource(object):
+
+	def __init__(self, filename):
+		self.filename = filename
+		self._file = open(filename, 'rb')
+		try:
+			self._parse_header()
+			self._map = mmap.mmap(self._file.fileno(), 0,
+				access=mmap.ACCESS_READ)
+		except Exception:
+			self._file.close()
+			raise
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	# Function that reads the RIFF header and locates the fmt and data chunks.
+	def _parse_header(self):
+		file_size = os.fstat(self._file.fileno()).st_size
+		riff = self._file.read(12)
+		if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+			raise WavFormatError("Not a RIFF/WAVE file: " + self.filename)
+		self.fmt_chunk = None
+		self.data_offset = None
+		self.data_size = None
+		pos = 12
+		while pos + 8 <= file_size:
+			self._file.seek(pos)
+			chunk_id, chunk_size = struct.unpack('<4sI', self._file.read(8))
+			if chunk_id == b'fmt ':
+				self.fmt_chunk = self._file.read(chunk_size)
+			elif chunk_id == b'data':
+				self.data_offset = pos + 8
+				# Streamed recordings may carry a bogus data size.
+				self.data_size = min(chunk_size, file_size - self.data_offset)
+				break
+			# Chunks are word aligned.
+			pos += 8 + chunk_size + (chunk_size & 1)
+		if self.fmt_chunk is None or self.data_offset is None:
+			raise WavFormatError("Missing fmt or data chunk: " + self.filename)
+		(self.format_tag, self.channels, self.frame_rate, _,
+			self.frame_width, self.bits_per_sample) = \
+			struct.unpack('<HHIIHH', self.fmt_chunk[:16])
+		if self.frame_width == 0 or self.frame_rate == 0:
+			raise WavFormatError("Invalid fmt chunk: " + self.filename)
+		self.sample_width = self.frame_width // self.channels
+		# Ignoring any trailing partial frame.
+		self.data_size -= self.data_size % self.frame_width
+
+	def close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+		if not self._file.closed:
+			self._file.close()
+
+	def frame_count(self):
+		return self.data_size // self.frame_width
+
+	@property
+	def duration_seconds(self):
+		return float(self.frame_count()) / self.frame_rate
+
+	# Function that converts a time in milliseconds to a byte offset into
+	# the data chunk. Frames are computed the same way pydub slices them.
+	def byte_offset(self, ms):
+		frame = int(ms * (self.frame_rate / 1000.0))
+		frame = max(0, min(frame, self.frame_count()))
+		return frame * self.frame_width
+
+	# Function that returns the byte range in the data chunk for the time
+	# range [low_ms, high_ms).
+	def byte_range(self, low_ms, high_ms):
+		start = self.byte_offset(low_ms)
+		end = max(start, self.byte_offset(high_ms))
+		return start, end
+
+	# Function that returns the frame ranges for many time ranges at once,
+	# computed the same way as byte_range. Inputs and outputs are arrays.
+	def frame_ranges(self, low_ms, high_ms):
+		rate = self.frame_rate / 1000.0
+		count = self.frame_count()
+		start = np.clip((np.asarray(low_ms, dtype=np.float64) * rate)
+			.astype(np.int64), 0, count)
+		end = np.clip((np.asarray(high_ms, dtype=np.float64) * rate)
+			.astype(np.int64), 0, count)
+		return start, np.maximum(start, end)
+
+	# Function that generates the WAV header for a slice of the given size.
+	def wav_header(self, data_size):
+		fmt_size = len(self.fmt_chunk)
+		pad = fmt_size & 1
+		riff_size = 4 + 8 + fmt_size + pad + 8 + data_size + (data_size & 1)
+		return (struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE') +
+			struct.pack('<4sI', b'fmt ', fmt_size) + self.fmt_chunk +
+			b'\0' * pad + struct.pack('<4sI', b'data', data_size))
+
+	# Function that writes the time range [low_ms, high_ms) to a WAV file.
+	# The samples are copied block by block straight from the memory map.
+	# Returns the number of sample bytes written.
+	def export(self, low_ms, high_ms, out_file):
+		start, end = self.byte_range(low_ms, high_ms)
+		return self._export_bytes(start, end, out_file)
+
+	# Function that writes the frames [start, end) to a WAV file.
+	def export_frames(self, start, end, out_file):
+		return self._export_bytes(start * self.frame_width,
+			end * self.frame_width, out_file)
+
+	def _export_bytes(self, start, end, out_file):
+		with open(out_file, 'wb') as f:
+			f.write(self.wav_header(end - start))
+			pos = self.data_offset + start
+			stop = self.data_offset + end
+			while pos < stop:
+				block_end = min(pos + COPY_BLOCK_SIZE, stop)
+				f.write(self._map[pos:block_end])
+				pos = block_end
+			if (end - start) & 1:
+				f.write(b'\0')
+		return end - start
+
+	# Function that reads the WAV file for the time range [low_ms, high_ms)
+	# into memory, so that it can be written later (e.g. by another thread)
+	# without the source. Returns the list of byte strings making up the
+	# file: header, samples and the padding byte if needed.
+	def read_clip(self, low_ms, high_ms):
+		start, end = self.byte_range(low_ms, high_ms)
+		return self._read_bytes(start, end)
+
+	# Function that reads the WAV file for the frames [start, end) into
+	# memory, like read_clip.
+	def read_frames(self, start, end):
+		return self._read_bytes(start * self.frame_width,
+			end * self.frame_width)
+
+	def _read_bytes(self, start, end):
+		chunks = [self.wav_header(end - start),
+			self._map[self.data_offset + start:self.data_offset + end]]
+		if (end - start) & 1:
+			chunks.append(b'\0')
+		return chunks
@@ -0,0 +1,341 @@
+'''
+	Reproducible benchmarks for Saulbot and the CHAT-XML Converter.
+
+	Synthetic transcripts and WAV files (see synthetic.py) are generated in a
+	temporary directory and the following are timed, each in its own process
+	so that its peak memory can be measured:
+
+		Saulbot:	search_keywords, rem_redundant_times, resolve_windows,
+					slice_audio, extract_transcript, export_clips
+		Converter:	refine_CHAT, remove_lines, the convert loop (with the stub
+					CHATTER of stub_chatter.py, one-shot and worker backends,
+					and with the native writer)
+
+	For every benchmark the best time over the repeats, the throughput and
+	the peak memory growth are reported. Results can be saved as a baseline
+	and later runs checked against it; the check fails (exit status 1) if the
+	throughput drops or the memory grows beyond the tolerance.
+
+	Usage:
+		python bench.py [-turns N] [-repeat N] [-only name ...]
+			[-save-baseline] [-check] [-baseline baselines.json]
+			[-tolerance 0.25]
+'''
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, os.path.join(ROOT, 'Saulbot'))
+sys.path.insert(0, os.path.join(ROOT, 'CHAT-XML Converter'))
+
+import synthetic
+import OIRP
+import chatter
+from turn_index import TranscriptIndex
+from wav_source import WavSource
+
+# Default file the baselines are stored in.
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baselines.json')
+# Command that runs the stub CHATTER.
+STUB_COMMAND = '"' + sys.executable + '" "' + \
+	os.path.join(BENCH_DIR, 'stub_chatter.py') + '"'
+# Keyword list with many repair initiator variants.
+KEYWORDS = synthetic.KEYWORDS + [u'huh', u'sorry what', u'excuse me',
+	u'come again', u'say again', u'what do you mean', u'pardon me',
+	u'you what', u'eh', u'hm'] + [u'variant%d' % i for i in range(44)]
+
+
+# Function that returns the peak memory of the process in MB.
+def peak_memory():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# ru_maxrss is in bytes on macOS and in KB elsewhere.
+	if sys.platform == 'darwin':
+		return peak / (1024.0 * 1024.0)
+	return peak / 1024.0
+
+# Function that reads all the lines of a transcript.
+def read_lines(filename):
+	with io.open(filename, 'r', encoding='utf-8') as f:
+		return f.readlines()
+
+# Function that reads all the lines of a CHAT file the way chatter.py does.
+def read_cha(filename):
+	with open(filename, 'rU') as f:
+		return f.readlines()
+
+'''
+Benchmarks.
+Each benchmark is a function taking the fixtures and returning a function
+to time (which is called once per repeat) and the amount of work done by
+one call with its unit, used for the throughput.
+'''
+
+def bench_search_keywords(fixtures):
+	lines = read_lines(fixtures['ca'])
+	def run():
+		OIRP.search_keywords(lines, KEYWORDS, '.ca', 'in_line')
+	return run, len(lines), 'lines'
+
+def bench_rem_redundant_times(fixtures):
+	lines = read_lines(fixtures['ca'])
+	found_lines = OIRP.search_keywords(lines, KEYWORDS, '.ca', 'in_line')[0]
+	times = OIRP.extract_times(found_lines, '.ca')
+	# Every turn is a hit, to stress the clustering.
+	times = times + OIRP.extract_times(lines, '.ca')
+	def run():
+		OIRP.rem_redundant_times(list(times), 10)
+	return run, len(times), 'times'
+
+def bench_resolve_windows(fixtures):
+	lines = read_lines(fixtures['ca'])
+	audio = WavSource(fixtures['wav'])
+	index = TranscriptIndex(lines)
+	# Every turn is a hit, as in runs with thousands of hits.
+	times = OIRP.extract_times(lines, '.ca')
+	def run():
+		OIRP.resolve_windows(index, times, 10, audio)
+	return run, len(times), 'windows'
+
+# Function that computes the windows for the extraction benchmarks.
+def extraction_windows(fixtures, lines, audio):
+	found_lines, ind_lines, keywords_dict = OIRP.search_keywords(lines,
+		synthetic.KEYWORDS, '.ca', 'solo')
+	times = OIRP.rem_redundant_times(OIRP.extract_times(found_lines, '.ca'), 10)
+	index = TranscriptIndex(lines)
+	windows = OIRP.resolve_windows(index, times, 10, audio)
+	return index, windows, ind_lines
+
+def bench_slice_audio(fixtures):
+	lines = read_lines(fixtures['ca'])
+	audio = WavSource(fixtures['wav'])
+	index, windows, ind_lines = extraction_windows(fixtures, lines, audio)
+	out_dir = tempfile.mkdtemp(dir=fixtures['dir'])
+	size = [0]
+	def run():
+		size[0] = 0
+		for window in windows:
+			name = OIRP.slice_audio(audio, window, out_dir)
+			size[0] += os.path.getsize(os.path.join(out_dir, name))
+	run()
+	return run, size[0] / (1024.0 * 1024.0), 'MB'
+
+def bench_extract_transcript(fixtures):
+	lines = read_lines(fixtures['ca'])
+	audio = WavSource(fixtures['wav'])
+	index, windows, ind_lines = extraction_windows(fixtures, lines, audio)
+	out_dir = tempfile.mkdtemp(dir=fixtures['dir'])
+	slice_names = ['clip-%d.wav' % i for i in range(len(windows))]
+	def run():
+		OIRP.extract_transcript(index, windows, slice_names, '.ca',
+			synthetic.KEYWORDS, ind_lines, out_dir)
+	return run, len(windows), 'excerpts'
+
+def bench_export_clips(fixtures):
+	lines = read_lines(fixtures['ca'])
+	audio = WavSource(fixtures['wav'])
+	index, windows, ind_lines = extraction_windows(fixtures, lines, audio)
+	out_dir = tempfile.mkdtemp(dir=fixtures['dir'])
+	def run():
+		OIRP.export_clips(audio, index, windows, '.ca', synthetic.KEYWORDS,
+			ind_lines, out_dir)
+	return run, len(windows), 'clips'
+
+def bench_refine_CHAT(fixtures):
+	lines = read_cha(fixtures['cha'])
+	def run():
+		chatter.refine_CHAT(lines)
+	return run, len(lines), 'lines'
+
+def bench_remove_lines(fixtures):
+	lines = chatter.refine_CHAT(read_cha(fixtures['cha']))
+	line_nums = list(range(0, len(lines), 7))
+	def run():
+		chatter.remove_lines(lines, line_nums, [])
+	return run, len(lines), 'lines'
+
+# Function that creates a benchmark of the convert loop for a backend.
+def convert_benchmark(worker, native=False):
+	def bench(fixtures):
+		paths = fixtures['cha_files']
+		backend = chatter.make_backend(worker, STUB_COMMAND +
+			(' -worker' if worker else ''), native)
+		def run():
+			for path in paths:
+				chatter.convert_file(path, backend)
+		return run, len(paths), 'files'
+	return bench
+
+# All the benchmarks in the order they are run.
+BENCHMARKS = [
+	('search_keywords', bench_search_keywords),
+	('rem_redundant_times', bench_rem_redundant_times),
+	('resolve_windows', bench_resolve_windows),
+	('slice_audio', bench_slice_audio),
+	('extract_transcript', bench_extract_transcript),
+	('export_clips', bench_export_clips),
+	('refine_CHAT', bench_refine_CHAT),
+	('remove_lines', bench_remove_lines),
+	('convert_process', convert_benchmark(False)),
+	('convert_worker', convert_benchmark(True)),
+	('convert_native', convert_benchmark(False, True)),
+]
+
+# Function that generates the fixtures in a directory.
+# Inputs -> Directory and number of turns of the transcripts.
+def make_fixtures(dir_name, turns):
+	fixtures = {'dir': dir_name}
+	fixtures['ca'] = os.path.join(dir_name, 'session.ca')
+	duration = synthetic.write_transcript(fixtures['ca'], turns, seed=1)
+	fixtures['wav'] = os.path.join(dir_name, 'session.wav')
+	synthetic.write_wav(fixtures['wav'], duration)
+	fixtures['cha'] = os.path.join(dir_name, 'session.cha')
+	synthetic.write_transcript(fixtures['cha'], turns, seed=2)
+	# Small files for the convert loop, in their own directory.
+	cha_dir = os.path.join(dir_name, 'cha')
+	os.makedirs(cha_dir)
+	fixtures['cha_files'] = []
+	for i in range(20):
+		path = os.path.join(cha_dir, 'file%d.cha' % i)
+		synthetic.write_transcript(path, max(1, turns // 50), seed=10 + i)
+		fixtures['cha_files'].append(path)
+	return fixtures
+
+# Function that runs a benchmark in a child process.
+def run_child(bench, fixtures, repeat, queue):
+	# The benchmarked functions print their progress.
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		run, work, unit = bench(fixtures)
+		start_memory = peak_memory()
+		times = []
+		for i in range(repeat):
+			start = timeit.default_timer()
+			run()
+			times.append(timeit.default_timer() - start)
+		best = min(times)
+		queue.put({'seconds': best, 'work': work, 'unit': unit,
+			'throughput': work / best if best > 0 else float('inf'),
+			'peak_memory_mb': max(0.0, peak_memory() - start_memory)})
+	except Exception as e:
+		queue.put({'error': '{}: {}'.format(type(e).__name__, e)})
+
+# Function that runs a benchmark in its own process.
+def run_benchmark(bench, fixtures, repeat):
+	queue = multiprocessing.Queue()
+	proc = multiprocessing.Process(target=run_child,
+		args=(bench, fixtures, repeat, queue))
+	proc.start()
+	result = queue.get()
+	proc.join()
+	return result
+
+# Function that compares the results with the baselines.
+# Output -> List of regressions.
+def check_baselines(results, baselines, turns, tolerance):
+	regressions = []
+	for name, result in results.items():
+		base = baselines.get(str(turns), {}).get(name)
+		if base is None or 'error' in result:
+			continue
+		if result['throughput'] < base['throughput'] * (1 - tolerance):
+			regressions.append('{}: throughput {:.1f} {}/s is below the baseline'
+				' {:.1f} {}/s'.format(name, result['throughput'], result['unit'],
+				base['throughput'], base['unit']))
+		# Small allocations are within the noise of ru_maxrss.
+		limit = base['peak_memory_mb'] * (1 + tolerance) + 5
+		if result['peak_memory_mb'] > limit:
+			regressions.append('{}: peak memory {:.1f} MB is above the baseline'
+				' {:.1f} MB'.format(name, result['peak_memory_mb'],
+				base['peak_memory_mb']))
+	return regressions
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(
+		description = 'Benchmarks for Saulbot and the CHAT-XML Converter')
+	parser.add_argument('-turns', action = 'store', dest = 'turns', type = int,
+		default = 20000, help = 'number of turns of the synthetic transcripts')
+	parser.add_argument('-repeat', action = 'store', dest = 'repeat', type = int,
+		default = 3, help = 'number of times each benchmark is run')
+	parser.add_argument('-only', action = 'store', dest = 'only', nargs = '*',
+		default = None, help = 'names of the benchmarks to run')
+	parser.add_argument('-baseline', action = 'store', dest = 'baseline',
+		default = BASELINE_FILE, help = 'file the baselines are stored in')
+	parser.add_argument('-save-baseline', action = 'store_true',
+		dest = 'save', default = False, help = 'store the results as baselines')
+	parser.add_argument('-check', action = 'store_true', dest = 'check',
+		default = False, help = 'fail if the results regress from the baselines')
+	parser.add_argument('-tolerance', action = 'store', dest = 'tolerance',
+		type = float, default = 0.25, help = 'allowed relative regression')
+	args = parser.parse_args()
+
+	names = [name for name, bench in BENCHMARKS]
+	if args.only is not None:
+		for name in args.only:
+			if name not in names:
+				print('ERROR: Unknown benchmark {}\nExiting...'.format(name))
+				sys.exit(1)
+
+	dir_name = tempfile.mkdtemp(prefix='gailbot-bench-')
+	try:
+		print('Generating fixtures ({} turns)...'.format(args.turns))
+		fixtures = make_fixtures(dir_name, args.turns)
+		results = {}
+		print('\n{:<22}{:>12}{:>26}{:>16}'.format('Benchmark', 'Time (s)',
+			'Throughput', 'Peak mem (MB)'))
+		for name, bench in BENCHMARKS:
+			if args.only is not None and name not in args.only:
+				continue
+			result = run_benchmark(bench, fixtures, args.repeat)
+			results[name] = result
+			if 'error' in result:
+				print('{:<22}ERROR: {}'.format(name, result['error']))
+				continue
+			print('{:<22}{:>12.4f}{:>14.1f} {:<11}{:>16.1f}'.format(name,
+				result['seconds'], result['throughput'], result['unit'] + '/s',
+				result['peak_memory_mb']))
+	finally:
+		shutil.rmtree(dir_name, ignore_errors=True)
+
+	baselines = {}
+	if os.path.exists(args.baseline):
+		with open(args.baseline, 'r') as f:
+			baselines = json.load(f)
+
+	failed = [name for name, result in results.items() if 'error' in result]
+	if args.check:
+		regressions = check_baselines(results, baselines, args.turns,
+			args.tolerance)
+		if str(args.turns) not in baselines:
+			print('\nWARNING: No baselines for {} turns in {}'.format(
+				args.turns, args.baseline))
+		if len(regressions) > 0:
+			print('\nREGRESSIONS:')
+			for regression in regressions:
+				print('\t' + regression)
+			sys.exit(1)
+		print('\nNo regressions.')
+
+	if args.save:
+		baselines.setdefault(str(args.turns), {})
+		for name, result in results.items():
+			if 'error' not in result:
+				baselines[str(args.turns)][name] = result
+		baselines.setdefault('machine', platform.platform())
+		with open(args.baseline, 'w') as f:
+			json.dump(baselines, f, indent=2, sort_keys=True)
+		print('\nBaselines saved to {}'.format(args.baseline))
+
+	if len(failed) > 0:
+		sys.exit(1)
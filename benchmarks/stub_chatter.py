@@ -0,0 +1,54 @@
+'''
+	Stub CHATTER used by the benchmarks in place of the Java program.
+
+	It rejects every line containing synthetic.STUB_ILLEGAL (reporting it the
+	way CHATTER does, so that chatter.get_line_nums can parse it) and writes
+	a minimal XML document for files without errors.
+
+	Usage:
+		python stub_chatter.py [CHAT file]	(one-shot, like CHATTER)
+		python stub_chatter.py -worker		(chatter.ChatterWorker protocol)
+'''
+
+import io
+import sys
+
+ILLEGAL = u'@@ILLEGAL@@'
+END_MARKER = '@@CHATTER-DONE@@'
+
+
+# Function that checks a CHAT file.
+# Output -> The diagnostics and the XML (None if there are errors).
+def check(filename):
+	errors = []
+	utterances = 0
+	with io.open(filename, 'r', encoding='utf-8', errors='replace') as f:
+		for i, line in enumerate(f):
+			if line.find(ILLEGAL) != -1 and line.find(u'ORIGINAL') == -1:
+				errors.append('Error on line %d, column 1: illegal token' % i)
+			if line.startswith(u'*'):
+				utterances += 1
+	if len(errors) > 0:
+		return '\n'.join(errors) + '\n', None
+	xml = ('<?xml version="1.0" encoding="UTF-8"?>\n<CHAT>' +
+		'<u/>' * utterances + '</CHAT>\n')
+	return '', xml
+
+if __name__ == '__main__':
+	if sys.argv[1:] == ['-worker']:
+		while True:
+			request = sys.stdin.readline()
+			if len(request) == 0:
+				break
+			cha_file, xml_file = request.rstrip('\r\n').split('\t')
+			diagnostics, xml = check(cha_file)
+			if xml is not None:
+				with open(xml_file, 'a') as f:
+					f.write(xml)
+			sys.stdout.write(diagnostics + '\n' + END_MARKER + '\n')
+			sys.stdout.flush()
+	else:
+		diagnostics, xml = check(sys.argv[-1])
+		sys.stderr.write(diagnostics)
+		if xml is not None:
+			sys.stdout.write(xml)
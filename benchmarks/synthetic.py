@@ -0,0 +1,138 @@
+'''
+	Generators for synthetic benchmark fixtures.
+
+	Transcripts are written in the CA (.ca) or CHAT (.cha) format with
+	headers, several speakers, \x15start_end\x15 bullets, CAlite symbols,
+	multi-line turns and keyword turns (including solo turns). The .cha
+	transcripts also contain the syntax that chatter.py refines (comments,
+	curse words, negative signs, swapped bullets) and a marker that the stub
+	CHATTER rejects so that the repair loop is exercised.
+
+	WAV files are written in blocks so that memory stays flat regardless of
+	their length.
+'''
+
+import io
+import random
+import struct
+import wave
+
+# Ordinary words used in the turns.
+WORDS = [u'yeah', u'so', u'the', u'thing', u'is', u'I', u'think', u'okay',
+	u'that', u'was', u'really', u'good', u'and', u'then', u'we', u'went',
+	u'there', u'but', u'you', u'know', u'right', u'mhm', u'well', u'like']
+
+# CAlite symbols mixed into the turns.
+CA_SYMBOLS = [u'(.)', u'(0.5)', u'\u2191', u'\u2193', u'\xb0', u'\u2248',
+	u'\u2206', u'\u2207', u'hm:m', u'<', u'>', u'[', u']', u'\u263a']
+
+# Keywords used in the keyword turns (the OIRs of the example config).
+KEYWORDS = [u'pardon', u'sorry', u'what', u'who', u'when', u'where']
+
+# Token rejected by the stub CHATTER.
+STUB_ILLEGAL = u'@@ILLEGAL@@'
+
+SPEAKERS = [u'SP1', u'SP2', u'SP3']
+
+
+# Function that generates the text of a turn.
+def turn_text(rand, min_words, max_words):
+	words = []
+	for i in range(rand.randint(min_words, max_words)):
+		if rand.random() < 0.15:
+			words.append(rand.choice(CA_SYMBOLS))
+		else:
+			words.append(rand.choice(WORDS))
+		if rand.random() < 0.05:
+			words.append(rand.choice(KEYWORDS))
+	return u' '.join(words)
+
+# Function that generates the extra syntax of .cha files refined by
+# chatter.py.
+def cha_noise(rand):
+	r = rand.random()
+	if r < 0.05:
+		return u' [^ comment]'
+	if r < 0.08:
+		return u' ****'
+	if r < 0.1:
+		return u' -uh'
+	if r < 0.11:
+		return u' ' + STUB_ILLEGAL
+	return u''
+
+# Function that generates the lines of a synthetic transcript.
+# Inputs -> Number of turns, random seed and form ('.ca' or '.cha').
+# Output -> Generator of lines and, at the end, the duration in seconds
+#			(through the returned list).
+def transcript_lines(turns, seed=0, form='.ca', duration=None):
+	rand = random.Random(seed)
+	yield u'@Begin\n'
+	yield u'@Languages:\teng\n'
+	yield u'@Participants:\t' + u', '.join(speaker + u' Speaker'
+		for speaker in SPEAKERS) + u'\n'
+	yield u'@Options:\tCA\n'
+	time = 0
+	for i in range(turns):
+		speaker = rand.choice(SPEAKERS)
+		length = rand.randint(400, 4000)
+		start, end = time, time + length
+		# Occasionally swapped bullets (fixed by chatter.py).
+		if form == '.cha' and rand.random() < 0.02:
+			start, end = end, start
+		bullet = u'\x15%d_%d\x15' % (start, end)
+		r = rand.random()
+		if r < 0.05:
+			# Solo keyword turn.
+			text = rand.choice(KEYWORDS) + rand.choice([u'?', u'', u' .'])
+			yield u'*%s:\t%s %s\n' % (speaker, text, bullet)
+		elif r < 0.2:
+			# Multi-line turn.
+			first = turn_text(rand, 4, 10)
+			rest = turn_text(rand, 2, 8)
+			if form == '.cha':
+				rest += cha_noise(rand)
+			yield u'*%s:\t%s\n' % (speaker, first)
+			yield u'\t%s . %s\n' % (rest, bullet)
+		else:
+			text = turn_text(rand, 1, 12)
+			if form == '.cha':
+				text += cha_noise(rand)
+			yield u'*%s:\t%s . %s\n' % (speaker, text, bullet)
+		# Gaps and overlaps between turns.
+		time = max(0, time + length + rand.randint(-300, 900))
+	yield u'@End\n'
+	if duration is not None:
+		duration.append(time / 1000.0 + 5)
+
+# Function that writes a synthetic transcript.
+# Output -> The duration (in seconds) of the conversation.
+def write_transcript(filename, turns, seed=0, form=None):
+	if form is None:
+		form = filename[filename.rfind('.'):]
+	duration = []
+	with io.open(filename, 'w', encoding='utf-8') as f:
+		for line in transcript_lines(turns, seed, form, duration):
+			f.write(line)
+	return duration[0]
+
+# Function that writes a synthetic WAV file of the given duration.
+# The samples are a cheap deterministic waveform written one block at a time.
+def write_wav(filename, seconds, frame_rate=16000, channels=1, sample_width=2):
+	block = 65536
+	pattern = struct.pack('<' + 'h' * 256, *[(i * 257) % 32768 - 16384
+		for i in range(256)])
+	frame_width = channels * sample_width
+	out = wave.open(filename, 'wb')
+	try:
+		out.setnchannels(channels)
+		out.setsampwidth(sample_width)
+		out.setframerate(frame_rate)
+		remaining = int(seconds * frame_rate) * frame_width
+		data = (pattern * (block // len(pattern) + 1))[:block]
+		while remaining > 0:
+			chunk = data[:min(block, remaining)]
+			out.writeframes(chunk)
+			remaining -= len(chunk)
+	finally:
+		out.close()
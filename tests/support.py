@@ -0,0 +1,102 @@
+'''
+	Shared fixtures of the regression checks.
+
+	The modules of Saulbot, the CHAT-XML Converter and the synthetic
+	fixture generators of the benchmarks are importable once this module is
+	imported. Every test case runs in its own temporary directory, with the
+	output of the tools (progress, statistics) silenced.
+'''
+
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TESTS_DIR)
+SAULBOT_DIR = os.path.join(ROOT, 'Saulbot')
+CONVERTER_DIR = os.path.join(ROOT, 'CHAT-XML Converter')
+BENCH_DIR = os.path.join(ROOT, 'benchmarks')
+for path in (SAULBOT_DIR, CONVERTER_DIR, BENCH_DIR):
+	if path not in sys.path:
+		sys.path.insert(0, path)
+
+import synthetic
+
+# Configuration of the extractions of the checks.
+CONFIG = {'OIRs': synthetic.KEYWORDS, 'extraction_mode': 'in_line',
+	'time_range': 5, 'time_thresh': 5}
+# Command that runs the stub CHATTER.
+STUB_COMMAND = '"' + sys.executable + '" "' + \
+	os.path.join(BENCH_DIR, 'stub_chatter.py') + '"'
+
+
+# Function that writes a synthetic session: a .ca transcript and a WAV
+# recording of the same duration.
+# Output -> The transcript and audio filenames.
+def write_session(dir_name, name, turns=200, seed=0):
+	trans_file = os.path.join(dir_name, name + '.ca')
+	audio_file = os.path.join(dir_name, name + '.wav')
+	synthetic.write_wav(audio_file, synthetic.write_transcript(trans_file,
+		turns, seed))
+	return trans_file, audio_file
+
+# Function that writes a configuration file.
+def write_config(filename, configs):
+	with open(filename, 'w') as f:
+		json.dump(configs, f)
+	return filename
+
+# Function that runs one of the scripts of Saulbot or the converter.
+# Output -> The exit status and the output of the script.
+def run_script(script, args, cwd=None):
+	proc = subprocess.Popen([sys.executable, script] + args, cwd=cwd,
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	output = proc.communicate()[0]
+	return proc.returncode, output
+
+# Function that returns the files of a directory tree and their contents,
+# relative to the directory, to compare two outputs.
+def tree_contents(dir_name, exclude=()):
+	contents = {}
+	for root, dirs, files in os.walk(dir_name):
+		for name in files:
+			if name in exclude:
+				continue
+			path = os.path.join(root, name)
+			with open(path, 'rb') as f:
+				contents[os.path.relpath(path, dir_name)] = f.read()
+	return contents
+
+# Function that returns the modification times of the files of a directory
+# tree (see tree_contents).
+def tree_mtimes(dir_name, exclude=()):
+	return dict((name, os.path.getmtime(os.path.join(dir_name, name)))
+		for name in tree_contents(dir_name, exclude))
+
+# Context manager that silences the standard output.
+@contextlib.contextmanager
+def quiet():
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		yield
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+
+class TempDirTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp(prefix='saulbot-test-')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir, ignore_errors=True)
+
+	def path(self, *names):
+		return os.path.join(self.dir, *names)
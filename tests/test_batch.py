@@ -0,0 +1,54 @@
+'''
+	Regression checks of the batch mode of OIRP.py (-directory).
+'''
+
+import os
+import unittest
+
+import support
+import OIRP
+
+
+class PairDirectoryTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		os.mkdir(self.path('corpus'))
+		self.sessions = [support.write_session(self.path('corpus'), name,
+			seed=seed) for seed, name in enumerate(['s1', 's2'])]
+		self.config = support.write_config(self.path('config.json'),
+			[support.CONFIG])
+
+	def run_batch(self):
+		status, output = support.run_script(
+			os.path.join(support.SAULBOT_DIR, 'OIRP.py'),
+			['-config', self.config, '-directory', self.path('corpus')])
+		self.assertEqual(status, 0, output)
+
+	def test_pairs_sessions(self):
+		self.assertEqual(OIRP.pair_directory(self.path('corpus')),
+			[(trans_file, audio_file, None)
+				for trans_file, audio_file in self.sessions])
+
+	# The excerpts and audio slices written by a run are not sessions.
+	def test_rerun_skips_results(self):
+		self.run_batch()
+		self.assertEqual(len(OIRP.pair_directory(self.path('corpus'))), 2)
+		self.run_batch()
+		self.assertEqual(sorted(os.listdir(self.path('corpus'))),
+			['s1-results', 's1.ca', 's1.wav', 's2-results', 's2.ca', 's2.wav'])
+		for name in ('s1-results', 's2-results'):
+			self.assertFalse(any(x.endswith('-results')
+				for x in os.listdir(self.path('corpus', name))))
+
+	# Output directories given in a manifest are recognized by their journal.
+	def test_skips_journaled_directories(self):
+		trans_file, audio_file = self.sessions[0]
+		with support.quiet():
+			OIRP.run_session(trans_file, audio_file, support.CONFIG,
+				self.path('corpus', 'clips'))
+		self.assertEqual(len(OIRP.pair_directory(self.path('corpus'))), 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
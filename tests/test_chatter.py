@@ -0,0 +1,61 @@
+'''
+	Regression checks of the pre-validation of chatter.py.
+'''
+
+import io
+import os
+import unittest
+
+import support
+import chatter
+
+HEADERS = (u'@Begin\n@Languages:\teng\n'
+	u'@Participants:\tSP1 Speaker1, SP2 Speaker2\n@Options:\tCA\n')
+
+
+class PrevalidationTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		self.backend = chatter.make_backend(native=True)
+
+	def tearDown(self):
+		self.backend.close()
+		support.TempDirTestCase.tearDown(self)
+
+	def convert(self, body):
+		cha_file = self.path('file.cha')
+		with io.open(cha_file, 'w', encoding='utf-8') as f:
+			f.write(HEADERS + body + u'@End\n')
+		with support.quiet():
+			result = chatter.convert_file(cha_file, self.backend)
+		with io.open(self.path('file.xml'), 'r', encoding='utf-8') as f:
+			return result, f.read()
+
+	# The placeholder of an undeclared speaker is accepted by the converter,
+	# so it only runs once.
+	def test_undeclared_speaker_single_pass(self):
+		result, xml = self.convert(u'*SP1:\thello . \x150_1000\x15\n'
+			u'*XYZ:\twho are you . \x151000_2000\x15\n'
+			u'*SP2:\tme . \x152000_3000\x15\n')
+		self.assertEqual(result['iterations'], 1)
+		self.assertEqual([i for i, line in result['lines_removed']], [5])
+		self.assertNotIn(u'XYZ', xml)
+		self.assertIn(u'ORIGINAL', xml)
+
+	def test_empty_utterance_placeholder(self):
+		lines = chatter.remove_lines([u'*SP1:\t \x150_1000\x15\n'], [0], [])
+		self.assertEqual(lines, [u'*SP1:\tORIGINAL DATA REMOVED \x150_1000\x15\n'])
+
+	# CA uses < and > on their own: they are kept and only the utterances
+	# whose delimiters do not balance are reported.
+	def test_ca_markup_kept(self):
+		result, xml = self.convert(u'*SP1:\tshe >said that< . \x150_1000\x15\n'
+			u'*SP2:\t>quick . \x151000_2000\x15\n')
+		self.assertEqual(result['lines_removed'], [])
+		self.assertEqual(result['unbalanced'], [5])
+		self.assertIn(u'said', xml)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+'''
+	Regression checks of the archive output (clip_archive.py).
+'''
+
+import os
+import tarfile
+import unittest
+import zipfile
+
+import support
+import OIRP
+from clip_archive import ARCHIVE_FORMATS, unpack
+from clip_journal import JOURNAL_FILE
+
+
+class ClipArchiveTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		self.trans_file, self.audio_file = support.write_session(self.dir, 's1')
+		self.files = support.tree_contents(self.extract(None, 'files'),
+			[JOURNAL_FILE])
+
+	def extract(self, archive, name):
+		with support.quiet():
+			OIRP.run_session(self.trans_file, self.audio_file,
+				dict(support.CONFIG, archive=archive), self.path(name))
+		return self.path(name)
+
+	# Every clip unpacked from an archive is the file written without it.
+	def test_unpack_round_trip(self):
+		for archive in ARCHIVE_FORMATS:
+			manifest_file = os.path.join(self.extract(archive, archive),
+				's1-clips.json')
+			written = unpack(manifest_file, self.path(archive + '-unpacked'))
+			self.assertEqual(sorted(written), sorted(self.files))
+			self.assertEqual(support.tree_contents(
+				self.path(archive + '-unpacked')), self.files, archive)
+
+	# The members of zip and tar archives are the usual files.
+	def test_members(self):
+		with zipfile.ZipFile(os.path.join(self.extract('zip', 'zip'),
+			's1-clips.zip')) as f:
+			self.assertEqual(dict((name, f.read(name))
+				for name in f.namelist()), self.files)
+		tar = tarfile.open(os.path.join(self.extract('tar', 'tar'),
+			's1-clips.tar'))
+		try:
+			self.assertEqual(dict((member.name,
+				tar.extractfile(member).read()) for member in tar), self.files)
+		finally:
+			tar.close()
+
+	def test_unpack_some_clips(self):
+		manifest_file = os.path.join(self.extract('wav', 'wav'),
+			's1-clips.json')
+		name = sorted(x for x in self.files if x.endswith('.wav'))[0]
+		written = unpack(manifest_file, self.path('some'), [name])
+		self.assertEqual(written[0], name)
+		self.assertEqual(support.tree_contents(self.path('some')),
+			dict((x, self.files[x]) for x in written))
+		self.assertRaises(ValueError, unpack, manifest_file, self.path('some'),
+			['missing.wav'])
+
+
+if __name__ == '__main__':
+	unittest.main()
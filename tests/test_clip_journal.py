@@ -0,0 +1,80 @@
+'''
+	Regression checks of the journal of the results directories
+	(clip_journal.py).
+'''
+
+import json
+import os
+import unittest
+
+import support
+import OIRP
+from clip_journal import ClipJournal, JOURNAL_FILE
+from metrics import Metrics
+
+
+class ClipJournalTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		self.trans_file, self.audio_file = support.write_session(self.dir, 's1')
+
+	def extract(self, config=support.CONFIG, out_dir_name=None):
+		metrics = Metrics()
+		with support.quiet():
+			result = OIRP.run_session(self.trans_file, self.audio_file, config,
+				out_dir_name, metrics)
+		return result['output'], metrics.counters
+
+	# A rerun does not extract again the clips already written.
+	def test_rerun_writes_nothing(self):
+		out_dir_name, counters = self.extract()
+		self.assertEqual(counters.get('clips_kept', 0), 0)
+		mtimes = support.tree_mtimes(out_dir_name, [JOURNAL_FILE])
+		out_dir_name, counters = self.extract()
+		self.assertEqual(counters['clips_kept'], counters['clips'])
+		self.assertNotIn('audio_bytes_written', counters)
+		self.assertNotIn('transcript_bytes_written', counters)
+		self.assertEqual(support.tree_mtimes(out_dir_name, [JOURNAL_FILE]),
+			mtimes)
+
+	# Missing and damaged files are written again.
+	def test_rewrites_damaged_files(self):
+		out_dir_name, counters = self.extract()
+		contents = support.tree_contents(out_dir_name, [JOURNAL_FILE])
+		names = sorted(name for name in contents if name.endswith('.wav'))
+		os.remove(os.path.join(out_dir_name, names[0]))
+		with open(os.path.join(out_dir_name, names[1]), 'r+b') as f:
+			f.truncate(10)
+		out_dir_name, counters = self.extract()
+		self.assertEqual(counters['clips_kept'], counters['clips'] - 2)
+		self.assertEqual(support.tree_contents(out_dir_name, [JOURNAL_FILE]),
+			contents)
+
+	# After a change of the configuration the results directory holds what a
+	# fresh run writes: the clips no longer produced are removed.
+	def test_changed_config_removes_orphans(self):
+		self.extract()
+		config = dict(support.CONFIG, time_range=2)
+		out_dir_name, counters = self.extract(config)
+		self.assertGreater(counters['files_removed'], 0)
+		fresh_dir_name, counters = self.extract(config, self.path('fresh'))
+		self.assertEqual(support.tree_contents(out_dir_name, [JOURNAL_FILE]),
+			support.tree_contents(fresh_dir_name, [JOURNAL_FILE]))
+
+	# A journal line cut short by a run that died is ignored, and the
+	# entries of removed files are dropped.
+	def test_reads_interrupted_journal(self):
+		with ClipJournal(self.dir) as journal:
+			journal.record('a.wav', 'rec.wav', {'start_frame': 0}, 4, 1)
+			journal.record('b.wav', 'rec.wav', {'start_frame': 8}, 4, 2)
+			journal.collect('rec.wav', set(['a.wav']))
+		with open(self.path(JOURNAL_FILE), 'a') as f:
+			f.write(json.dumps({'file': 'c.wav', 'source': 'rec.wav'})[:20])
+		with ClipJournal(self.dir) as journal:
+			self.assertEqual(sorted(journal.entries), ['a.wav'])
+			self.assertEqual(journal.entries['a.wav']['crc32'], 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,80 @@
+'''
+	Regression checks of the SQLite keyword index (corpus_index.py).
+'''
+
+import io
+import os
+import unittest
+
+import support
+import OIRP
+import turn_timing
+from corpus_index import CorpusIndex, list_transcripts
+from turn_index import read_turns
+
+
+class CorpusIndexTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		os.mkdir(self.path('corpus'))
+		self.sessions = [support.write_session(self.path('corpus'), name,
+			seed=seed) for seed, name in enumerate(['s1', 's2'])]
+
+	def build(self):
+		with CorpusIndex(self.path('corpus.db')) as index:
+			return index.update(self.path('corpus'))
+
+	# The index finds the lines that OIRP.search_turns finds, in the same
+	# order.
+	def test_query_matches_search(self):
+		self.build()
+		for mode in ('in_line', 'solo'):
+			with CorpusIndex(self.path('corpus.db')) as index:
+				hits, keywords_dict = index.query(support.CONFIG['OIRs'], mode)
+			for trans_file, audio_file in self.sessions:
+				hit_nums = []
+				with io.open(trans_file, 'r', encoding='utf-8') as f:
+					OIRP.search_turns(read_turns(f), support.CONFIG['OIRs'],
+						mode, hit_nums)
+				self.assertEqual([line for word, line, start, end, solo in
+					hits[os.path.abspath(trans_file)]], hit_nums)
+
+	def test_update_is_incremental(self):
+		self.assertEqual(self.build(), {'added': 2, 'updated': 0,
+			'removed': 0, 'unchanged': 0})
+		self.assertEqual(self.build()['unchanged'], 2)
+		with io.open(self.sessions[0][0], 'a', encoding='utf-8') as f:
+			f.write(u'*SP1:\tpardon ? \x15999000_999500\x15\n')
+		os.remove(self.sessions[1][0])
+		self.assertEqual(self.build(), {'added': 0, 'updated': 1,
+			'removed': 1, 'unchanged': 0})
+
+	# Lines before the first speaker tier get the times of the first turn,
+	# not those of the end of the file.
+	def test_lines_before_first_turn(self):
+		trans_file = self.path('corpus', 'early.ca')
+		with io.open(trans_file, 'w', encoding='utf-8') as f:
+			f.write(u'pardon ?\n*SP1:\thello \x151000_2000\x15\n'
+				u'*SP2:\tyes \x153000_4000\x15\n')
+		self.build()
+		with CorpusIndex(self.path('corpus.db')) as index:
+			hits, keywords_dict = index.query([u'pardon'], 'in_line')
+		self.assertEqual(hits[os.path.abspath(trans_file)],
+			[(u'pardon', 0, 1000, 2000, True)])
+
+	# The excerpts written by an extraction are not indexed (nor analyzed
+	# by turn_timing.py -directory, which lists the same transcripts).
+	def test_skips_results(self):
+		with support.quiet():
+			for trans_file, audio_file in self.sessions:
+				OIRP.run_session(trans_file, audio_file, support.CONFIG)
+		self.assertEqual(list_transcripts(self.path('corpus')),
+			[os.path.abspath(trans_file) for trans_file, audio_file
+				in self.sessions])
+		self.assertIs(turn_timing.list_transcripts, list_transcripts)
+		self.assertEqual(self.build()['added'], 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
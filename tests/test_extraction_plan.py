@@ -0,0 +1,43 @@
+'''
+	Regression checks of the plan and execute modes (extraction_plan.py).
+'''
+
+import os
+import unittest
+
+import support
+
+SCRIPT = os.path.join(support.SAULBOT_DIR, 'extraction_plan.py')
+
+
+class ExecuteTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		self.trans_file, self.audio_file = support.write_session(self.dir, 's1')
+		config = support.write_config(self.path('config.json'),
+			[support.CONFIG])
+		status, output = support.run_script(SCRIPT, ['plan', '-config', config,
+			'-directory', self.dir, '-output', self.path('plan.json')])
+		self.assertEqual(status, 0, output)
+		self.num_clips = int(output.split('\n')[-2].split()[0])
+
+	def execute(self):
+		status, output = support.run_script(SCRIPT, ['execute', '-plan',
+			self.path('plan.json'), '-jobs', '1'])
+		self.assertEqual(status, 0, output)
+		return output.strip().split('\n')[-1]
+
+	# A resumed execution reports the clips it skipped apart from those it
+	# wrote.
+	def test_summary_counts_skipped_clips(self):
+		self.assertEqual(self.execute(), '{0} of {0} clips written, 0 already'
+			' written were skipped'.format(self.num_clips))
+		os.remove(self.path('s1-results', sorted(x for x in
+			os.listdir(self.path('s1-results')) if x.endswith('.wav'))[0]))
+		self.assertEqual(self.execute(), '1 of {0} clips written, {1} already'
+			' written were skipped'.format(self.num_clips, self.num_clips - 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
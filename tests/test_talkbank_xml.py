@@ -0,0 +1,101 @@
+'''
+	Regression checks of the native TalkBank XML writer (talkbank_xml.py).
+
+	The XML of a fixture is checked against the elements CHATTER writes for
+	it. When chatter.jar is in the directory of the converter, the XML of
+	both converters is also compared.
+'''
+
+import io
+import os
+import unittest
+from distutils.spawn import find_executable
+
+from lxml import etree
+
+import support
+import chatter
+import talkbank_xml
+
+TRANSCRIPT = (u'@Begin\n@Languages:\teng\n'
+	u'@Participants:\tSP1 Speaker1, SP2 Speaker2\n@Options:\tCA\n'
+	u'*SP1:\thello there . \x150_1000\x15\n'
+	u'*SP2:\tpardon (.) ? \x151000_2000\x15\n'
+	u'*SP1:\txxx , I said hello \x152000_3500\x15\n'
+	u'@End\n')
+# Speaker, content and time range of the utterances of the transcript.
+UTTERANCES = [
+	('SP1', [('w', u'hello'), ('w', u'there'), ('t', 'p')], (0.0, 1.0)),
+	('SP2', [('w', u'pardon'), ('pause', 'simple'), ('t', 'q')], (1.0, 2.0)),
+	('SP1', [('w', u'xxx'), ('s', 'comma'), ('w', u'I'), ('w', u'said'),
+		('w', u'hello'), ('t', 'missing CA terminator')], (2.0, 3.5))]
+CHATTER_JAR = os.path.join(support.CONVERTER_DIR, 'chatter.jar')
+CHATTER_AVAILABLE = (os.path.isfile(CHATTER_JAR) and
+	find_executable('java') is not None)
+
+
+# Function that returns the speaker, content and time range of the
+# utterances of an XML file, with or without the TalkBank namespace.
+def utterances(xml_file):
+	found = []
+	for element in etree.parse(xml_file).getroot():
+		if not talkbank_xml.is_utterance(element):
+			continue
+		content = []
+		times = None
+		for child in element:
+			name = etree.QName(child).localname
+			if name == 'w':
+				content.append((name, child.text))
+			elif name == 'pause':
+				content.append((name, child.get('symbolic-length')))
+			elif name in ('s', 't'):
+				content.append((name, child.get('type')))
+			elif name == 'media':
+				times = (float(child.get('start')), float(child.get('end')))
+		found.append((element.get('who'), content, times))
+	return found
+
+
+class NativeWriterTest(support.TempDirTestCase):
+
+	def convert(self, backend, name):
+		cha_file = self.path(name, 'file.cha')
+		os.mkdir(self.path(name))
+		with io.open(cha_file, 'w', encoding='utf-8') as f:
+			f.write(TRANSCRIPT)
+		try:
+			with support.quiet():
+				result = chatter.convert_file(cha_file, backend)
+		finally:
+			backend.close()
+		self.assertEqual(result['lines_removed'], [])
+		return self.path(name, 'file.xml')
+
+	def test_utterances(self):
+		xml_file = self.convert(chatter.make_backend(native=True), 'native')
+		self.assertEqual(utterances(xml_file), UTTERANCES)
+		root = etree.parse(xml_file).getroot()
+		self.assertEqual(root.tag, talkbank_xml.tag('CHAT'))
+		self.assertEqual([(x.get('id'), x.get('role')) for x in
+			root.find(talkbank_xml.tag('Participants'))],
+			[('SP1', 'Speaker1'), ('SP2', 'Speaker2')])
+
+	@unittest.skipUnless(CHATTER_AVAILABLE, 'CHATTER is not available')
+	def test_matches_chatter(self):
+		native_file = self.convert(chatter.make_backend(native=True), 'native')
+		chatter_file = self.convert(chatter.make_backend(
+			command=chatter.CHATTER_COMMAND.replace('chatter.jar',
+			'"' + CHATTER_JAR + '"')), 'chatter')
+		self.assertEqual(utterances(native_file), utterances(chatter_file))
+
+	# The lines that cannot be written are reported the way CHATTER reports
+	# them, by their number in the transcript.
+	def test_diagnostics(self):
+		lines = io.StringIO(TRANSCRIPT.replace(u'*SP2:', u'*XYZ:')).readlines()
+		diagnostics = talkbank_xml.write_xml(lines, io.BytesIO())
+		self.assertEqual(chatter.get_line_nums('\n'.join(diagnostics)), [5])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+'''
+	Regression checks of the sidecar cache of parsed transcripts
+	(turn_cache.py).
+'''
+
+import io
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+import support
+import OIRP
+from clip_journal import JOURNAL_FILE
+from turn_cache import cached_index, load_sidecar, sidecar_name
+from turn_index import TranscriptIndex
+
+
+class TurnCacheTest(support.TempDirTestCase):
+
+	def setUp(self):
+		support.TempDirTestCase.setUp(self)
+		self.trans_file, self.audio_file = support.write_session(self.dir, 's1')
+
+	def parsed_index(self):
+		with io.open(self.trans_file, 'r', encoding='utf-8') as f:
+			return TranscriptIndex(f.readlines())
+
+	def assertSameIndex(self, index, expected):
+		self.assertEqual(list(index.lines), list(expected.lines))
+		self.assertEqual(index.speaker_names, expected.speaker_names)
+		for name in ('speakers', 'starts', 'ends', 'first_lines',
+			'bullet_lines'):
+			self.assertTrue(np.array_equal(getattr(index, name),
+				getattr(expected, name)), name)
+		low_ms = expected.starts - 5000
+		high_ms = expected.ends + 5000
+		for found, wanted in zip(index.windows(low_ms, high_ms),
+			expected.windows(low_ms, high_ms)):
+			self.assertTrue(np.array_equal(found, wanted))
+
+	# The sidecar written by the first run is mapped by the next one and gives
+	# the same index as parsing the transcript.
+	def test_sidecar_matches_parsing(self):
+		cached_index(self.trans_file).close()
+		self.assertTrue(os.path.isfile(sidecar_name(self.trans_file)))
+		with load_sidecar(self.trans_file) as index:
+			self.assertIsNotNone(index)
+			self.assertSameIndex(index, self.parsed_index())
+
+	# The lines of transcripts with Windows and old Mac line ends are read
+	# from the sidecar's offsets as in text mode.
+	def test_line_ends(self):
+		with open(self.trans_file, 'rb') as f:
+			data = f.read()
+		for newline in (b'\r\n', b'\r'):
+			with open(self.trans_file, 'wb') as f:
+				f.write(data.replace(b'\n', newline))
+			cached_index(self.trans_file).close()
+			with load_sidecar(self.trans_file) as index:
+				self.assertSameIndex(index, self.parsed_index())
+
+	# A sidecar is not used once the transcript changed, but is for a copy of
+	# the same transcript.
+	def test_stale_sidecar(self):
+		cached_index(self.trans_file).close()
+		copy_file = self.path('copy.ca')
+		shutil.copyfile(self.trans_file, copy_file)
+		shutil.copyfile(sidecar_name(self.trans_file), sidecar_name(copy_file))
+		with load_sidecar(copy_file) as index:
+			self.assertIsNotNone(index)
+		with io.open(self.trans_file, 'a', encoding='utf-8') as f:
+			f.write(u'*SP1:\tpardon ? \x15999000_999500\x15\n')
+		self.assertIsNone(load_sidecar(self.trans_file))
+		with cached_index(self.trans_file) as index:
+			self.assertSameIndex(index, self.parsed_index())
+		with load_sidecar(self.trans_file) as index:
+			self.assertSameIndex(index, self.parsed_index())
+
+	def test_close_releases_transcript(self):
+		cached_index(self.trans_file).close()
+		index = load_sidecar(self.trans_file)
+		index.close()
+		self.assertTrue(index.lines._file.closed)
+
+	# The extractions are the same with the cache, when it is written and
+	# when it is used.
+	def test_extraction(self):
+		with support.quiet():
+			OIRP.run_session(self.trans_file, self.audio_file, support.CONFIG,
+				self.path('parsed'))
+			for name in ('written', 'mapped'):
+				OIRP.run_session(self.trans_file, self.audio_file,
+					dict(support.CONFIG, turn_cache=True), self.path(name))
+		expected = support.tree_contents(self.path('parsed'), [JOURNAL_FILE])
+		self.assertTrue(len(expected) > 0)
+		for name in ('written', 'mapped'):
+			self.assertEqual(support.tree_contents(self.path(name),
+				[JOURNAL_FILE]), expected, name)
+
+
+if __name__ == '__main__':
+	unittest.main()